@@ -1,6 +1,7 @@
 """
 Админ-панель ParkingBot
 """
+import html
 import logging, asyncio
 from datetime import datetime
 from aiogram import Router, F
@@ -10,12 +11,16 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-import database as db
-import os
-import sqlite3
-import tempfile
-from openpyxl import Workbook
-from config import ADMIN_PASSWORD, FIXED_ADDRESS, DATABASE_PATH
+import db_async as db
+from middlewares import current_user
+from outbound import outbox
+from chat_executor import executor
+import backup
+import broadcasts
+import export
+import metrics
+import tracing
+from config import ADMIN_PASSWORD, FIXED_ADDRESS
 from keyboards import *
 from utils import *
 
@@ -119,7 +124,7 @@ class AdminSlotEditStates(StatesGroup):
 async def cmd_admin(message: Message, state: FSMContext):
     """Команда /admin"""
     await state.clear()
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user:
         await message.answer("❌ Сначала /start"); return
     if user['role'] == 'admin':
@@ -131,7 +136,7 @@ async def cmd_admin(message: Message, state: FSMContext):
 @router.message(F.text == "🔑 Админ-панель")
 async def admin_start(message: Message, state: FSMContext):
     await state.clear()
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user: return
     if user['role'] == 'admin':
         await message.answer("🔑 <b>Админ-панель</b>", reply_markup=get_admin_panel_keyboard(), parse_mode="HTML")
@@ -142,9 +147,9 @@ async def admin_start(message: Message, state: FSMContext):
 @router.message(AdminStates.waiting_password)
 async def admin_password(message: Message, state: FSMContext):
     if message.text == ADMIN_PASSWORD:
-        user = db.get_user_by_telegram_id(message.from_user.id)
-        db.set_user_role(user['id'], 'admin')
-        db.create_admin_session(user['id'], message.from_user.id)
+        user = await current_user(message.from_user.id)
+        await db.set_user_role(user['id'], 'admin')
+        await db.create_admin_session(user['id'], message.from_user.id)
         await state.clear()
         await message.answer("✅ Вы админ!", reply_markup=get_main_menu_keyboard(True))
         await message.answer("🔑 <b>Админ-панель</b>", reply_markup=get_admin_panel_keyboard(), parse_mode="HTML")
@@ -157,7 +162,7 @@ async def admin_password(message: Message, state: FSMContext):
 @router.callback_query(F.data == "admin_pending")
 async def admin_pending(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    bookings = db.get_pending_bookings()
+    bookings = await db.get_pending_bookings()
     if not bookings:
         await callback.message.edit_text("✅ Нет ожидающих заявок.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -175,7 +180,7 @@ async def admin_pending(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "admin_all_bookings")
 async def admin_all_bookings(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    bookings = db.get_all_bookings(limit=20)
+    bookings = await db.get_all_bookings(limit=20)
     if not bookings:
         await callback.message.edit_text("📋 Нет бронирований.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -195,7 +200,7 @@ async def admin_all_bookings(callback: CallbackQuery, state: FSMContext):
 async def admin_booking_detail(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_bk_",""))
-    b = db.get_booking_by_id(bid)
+    b = await db.get_booking_by_id(bid)
     if not b: await callback.message.edit_text("❌ Не найдена."); return
     s = datetime.fromisoformat(b['start_time'])
     e = datetime.fromisoformat(b['end_time'])
@@ -222,7 +227,7 @@ async def admin_booking_detail(callback: CallbackQuery, state: FSMContext):
 async def admin_confirm(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_confirm_",""))
-    ok, status = db.confirm_booking_idempotent(bid)
+    ok, status = await db.confirm_booking_idempotent(bid)
 
     if status == 'already':
         try:
@@ -239,90 +244,76 @@ async def admin_confirm(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer(f"❌ Не удалось подтвердить бронь #{bid}.")
         return
 
-    b = db.get_booking_by_id(bid)
+    b = await db.get_booking_by_id(bid)
     await callback.message.edit_text(f"✅ Бронь #{bid} подтверждена!")
 
     # Финальное сообщение пользователю с адресом
-    try:
-        await callback.bot.send_message(
-            b['customer_telegram_id'],
-            f"🎉 <b>Всё подтверждено!</b>\n\n"
-            f"🏠 {b['spot_number']}\n"
-            f"📍 {FIXED_ADDRESS}\n"
-            f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}",
-            parse_mode="HTML"
-        )
-    except:
-        pass
+    outbox.send(
+        b['customer_telegram_id'],
+        f"🎉 <b>Всё подтверждено!</b>\n\n"
+        f"🏠 {b['spot_number']}\n"
+        f"📍 {FIXED_ADDRESS}\n"
+        f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}",
+        parse_mode="HTML"
+    )
 
     # Сообщение арендодателю (поставщику), что слот взяли и оплатили (без контактов арендатора)
-    try:
-        if b.get('supplier_telegram_id'):
-            await callback.bot.send_message(
-                b['supplier_telegram_id'],
-                f"✅ Ваш слот забронирован и оплачен!\n\n📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}",
-                parse_mode="HTML"
-            )
-    except:
-        pass
+    if b.get('supplier_telegram_id'):
+        outbox.send(
+            b['supplier_telegram_id'],
+            f"✅ Ваш слот забронирован и оплачен!\n\n📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}",
+            parse_mode="HTML"
+        )
 
-    db.log_admin_action('booking_confirmed', booking_id=bid)
+    await db.log_admin_action('booking_confirmed', booking_id=bid)
 
 @router.callback_query(F.data.startswith("adm_reject_"))
 async def admin_reject(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_reject_",""))
-    b = db.get_booking_by_id(bid)
-    db.reject_booking(bid)
+    b = await db.get_booking_by_id(bid)
+    await db.reject_booking(bid)
     await callback.message.edit_text(f"❌ Бронь #{bid} отклонена.")
     if b:
-        try:
-            await callback.bot.send_message(
-                b['customer_telegram_id'],
-                f"❌ <b>Бронь #{bid} отклонена.</b>\n🅿️ Номер места не раскрывается.",
-                parse_mode="HTML"
-            )
-        except: pass
-    db.log_admin_action('booking_rejected', booking_id=bid)
+        outbox.send(
+            b['customer_telegram_id'],
+            f"❌ <b>Бронь #{bid} отклонена.</b>\n🅿️ Номер места не раскрывается.",
+            parse_mode="HTML"
+        )
+    await db.log_admin_action('booking_rejected', booking_id=bid)
 
 @router.callback_query(F.data.startswith("adm_cancel_"))
 async def admin_cancel(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_cancel_",""))
-    b = db.get_booking_by_id(bid)
-    db.cancel_booking(bid)
+    b = await db.get_booking_by_id(bid)
+    await db.cancel_booking(bid)
     await callback.message.edit_text(f"❌ Бронь #{bid} отменена админом.")
     if b:
-        try:
-            await callback.bot.send_message(
-                b['customer_telegram_id'],
-                f"❌ <b>Бронь #{bid} отменена администратором.</b>",
-                parse_mode="HTML"
-            )
-        except:
-            pass
+        outbox.send(
+            b['customer_telegram_id'],
+            f"❌ <b>Бронь #{bid} отменена администратором.</b>",
+            parse_mode="HTML"
+        )
 
         # уведомление арендодателя
-        try:
-            if b.get('supplier_telegram_id'):
-                await callback.bot.send_message(
-                    b['supplier_telegram_id'],
-                    f"❌ <b>Бронь #{bid} отменена</b>\n"
-                    f"🏠 Место: {b['spot_number']}\n"
-                    f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}\n"
-                    f"ℹ️ Интервал снова доступен для бронирования.",
-                    parse_mode="HTML"
-                )
-        except:
-            pass
+        if b.get('supplier_telegram_id'):
+            outbox.send(
+                b['supplier_telegram_id'],
+                f"❌ <b>Бронь #{bid} отменена</b>\n"
+                f"🏠 Место: {b['spot_number']}\n"
+                f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}\n"
+                f"ℹ️ Интервал снова доступен для бронирования.",
+                parse_mode="HTML"
+            )
 
-    db.log_admin_action('booking_cancelled_admin', booking_id=bid)
+    await db.log_admin_action('booking_cancelled_admin', booking_id=bid)
 
 @router.callback_query(F.data.startswith("adm_edit_"))
 async def admin_edit(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_edit_",""))
-    b = db.get_booking_by_id(bid)
+    b = await db.get_booking_by_id(bid)
     if not b:
         return
 
@@ -365,27 +356,24 @@ async def admin_set_hours(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("❌ Ошибка данных.")
         return
 
-    ok = db.admin_edit_booking_hours(bid, hours)
+    ok = await db.admin_edit_booking_hours(bid, hours)
     if not ok:
         await callback.message.edit_text("❌ Не удалось обновить бронь.")
         return
 
-    b = db.get_booking_by_id(bid)
+    b = await db.get_booking_by_id(bid)
     await callback.message.edit_text(f"✅ Бронь #{bid} обновлена: оплачено {hours}ч. Остаток снова свободен.")
-    db.log_admin_action('booking_edited', booking_id=bid, details=f"paid={hours}h")
+    await db.log_admin_action('booking_edited', booking_id=bid, details=f"paid={hours}h")
 
     # уведомим арендатора
     if b:
-        try:
-            await callback.bot.send_message(
-                b['customer_telegram_id'],
-                f"📝 <b>Бронь #{bid} обновлена администратором.</b>\n"
-                f"✅ Оплачено: {hours}ч\n"
-                f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}",
-                parse_mode="HTML"
-            )
-        except:
-            pass
+        outbox.send(
+            b['customer_telegram_id'],
+            f"📝 <b>Бронь #{bid} обновлена администратором.</b>\n"
+            f"✅ Оплачено: {hours}ч\n"
+            f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}",
+            parse_mode="HTML"
+        )
 
 @router.message(AdminStates.waiting_edit_hours)
 async def admin_edit_hours(message: Message, state: FSMContext):
@@ -399,7 +387,7 @@ async def admin_edit_hours(message: Message, state: FSMContext):
 @router.callback_query(F.data == "admin_slots")
 async def admin_slots(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    spots = db.get_spots_with_free_availabilities()
+    spots = await db.get_spots_with_free_availabilities()
     if not spots:
         await callback.message.edit_text("🏠 Нет активных мест со свободными слотами.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -418,8 +406,8 @@ async def admin_spot_detail(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     sid = int(callback.data.replace("adm_spot_",""))
     # Для админки показываем и свободные, и забронированные интервалы
-    avails = db.get_spot_availabilities_all(sid)
-    spot = db.get_spot_by_id(sid)
+    avails = await db.get_spot_availabilities_all(sid)
+    spot = await db.get_spot_by_id(sid)
     if not spot: return
     buttons = []
     for a in avails[:20]:
@@ -438,7 +426,7 @@ async def admin_spot_detail(callback: CallbackQuery, state: FSMContext):
 async def admin_slot_action(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     aid = int(callback.data.replace("adm_sa_",""))
-    slot = db.get_availability_by_id(aid)
+    slot = await db.get_availability_by_id(aid)
     if not slot: return
     s = datetime.fromisoformat(str(slot['start_time']))
     e = datetime.fromisoformat(str(slot['end_time']))
@@ -456,7 +444,7 @@ async def admin_slot_action(callback: CallbackQuery, state: FSMContext):
 async def admin_toggle(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     aid = int(callback.data.replace("adm_toggle_",""))
-    new_status = db.admin_toggle_slot(aid)
+    new_status = await db.admin_toggle_slot(aid)
     if new_status == -1:
         await callback.message.edit_text("❌ Этот слот привязан к брони — менять статус нельзя.")
         return
@@ -465,23 +453,23 @@ async def admin_toggle(callback: CallbackQuery, state: FSMContext):
         return
     st = "🔴 забронированным" if new_status else "🟢 свободным"
     await callback.message.edit_text(f"✅ Слот стал {st}.")
-    db.log_admin_action('slot_toggled', details=f"slot={aid}, booked={new_status}")
+    await db.log_admin_action('slot_toggled', details=f"slot={aid}, booked={new_status}")
 
 
 @router.callback_query(F.data.startswith("adm_delslot_"))
 async def admin_delete_slot(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     slot_id = int(callback.data.replace("adm_delslot_", ""))
-    slot = db.get_slot_by_id(slot_id)
+    slot = await db.get_slot_by_id(slot_id)
     if not slot:
         await callback.message.edit_text("❌ Слот не найден.")
         return
     spot_id = slot['spot_id']
-    ok = db.admin_delete_availability(slot_id)
+    ok = await db.admin_delete_availability(slot_id)
     if not ok:
         await callback.message.edit_text("❌ Нельзя удалить: слот привязан к брони или данные некорректны.")
         return
-    db.log_admin_action('slot_deleted', spot_id=spot_id, details=f"slot={slot_id}")
+    await db.log_admin_action('slot_deleted', spot_id=spot_id, details=f"slot={slot_id}")
     await callback.message.edit_text(
         "✅ Слот удалён.",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -494,7 +482,7 @@ async def admin_delete_slot(callback: CallbackQuery, state: FSMContext):
 async def admin_edit_slot_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     slot_id = int(callback.data.replace("adm_editstart_", ""))
-    slot = db.get_slot_by_id(slot_id)
+    slot = await db.get_slot_by_id(slot_id)
     if not slot:
         await callback.message.edit_text("❌ Слот не найден.")
         return
@@ -515,7 +503,7 @@ async def admin_edit_slot_start(callback: CallbackQuery, state: FSMContext):
 async def admin_edit_slot_end(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     slot_id = int(callback.data.replace("adm_editend_", ""))
-    slot = db.get_slot_by_id(slot_id)
+    slot = await db.get_slot_by_id(slot_id)
     if not slot:
         await callback.message.edit_text("❌ Слот не найден.")
         return
@@ -591,7 +579,7 @@ async def admin_slot_edit_time(callback: CallbackQuery, state: FSMContext):
         return
 
     # Актуальные значения слота
-    slot = db.get_slot_by_id(slot_id)
+    slot = await db.get_slot_by_id(slot_id)
     if not slot:
         await callback.message.edit_text("❌ Слот не найден.")
         await state.clear()
@@ -608,11 +596,11 @@ async def admin_slot_edit_time(callback: CallbackQuery, state: FSMContext):
     else:
         new_start, new_end = cur_start, new_dt
 
-    ok = db.admin_update_availability_interval(slot_id, new_start, new_end)
+    ok = await db.admin_update_availability_interval(slot_id, new_start, new_end)
     if not ok:
         await callback.message.edit_text("❌ Не удалось обновить слот (проверьте, что нет пересечений и конец позже начала).")
         return
-    db.log_admin_action('slot_edited', spot_id=slot['spot_id'], details=f"slot={slot_id}, field={field}")
+    await db.log_admin_action('slot_edited', spot_id=slot['spot_id'], details=f"slot={slot_id}, field={field}")
     await state.clear()
     # Вернёмся к карточке слота
     await callback.message.edit_text("✅ Слот обновлён.", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -644,17 +632,17 @@ async def _show_users_page(callback: CallbackQuery, state: FSMContext, page: int
                 reply_markup=_users_keyboard([], 0, 1, "admin_users_page", show_search=True),
             )
             return
-        total = db.search_users_count(q)
+        total = await db.search_users_count(q)
         pages = max(1, (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE)
         page = min(page, pages - 1)
-        users = db.search_users(q, limit=USERS_PAGE_SIZE, offset=page * USERS_PAGE_SIZE)
+        users = await db.search_users(q, limit=USERS_PAGE_SIZE, offset=page * USERS_PAGE_SIZE)
         text = f"👥 <b>Пользователи</b>\n🔎 <b>Поиск:</b> {q}\nВсего: {total}"
         kb = _users_keyboard(users, page, pages, "admin_users_search_page", show_search=False)
     else:
-        total = db.get_users_count()
+        total = await db.get_users_count()
         pages = max(1, (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE)
         page = min(page, pages - 1)
-        users = db.get_all_users(limit=USERS_PAGE_SIZE, offset=page * USERS_PAGE_SIZE)
+        users = await db.get_all_users(limit=USERS_PAGE_SIZE, offset=page * USERS_PAGE_SIZE)
         text = f"👥 <b>Пользователи ({total})</b>"
         kb = _users_keyboard(users, page, pages, "admin_users_page", show_search=True)
 
@@ -708,9 +696,9 @@ async def admin_users_search_query(message: Message, state: FSMContext):
         msg_id = data.get('user_search_origin_msg_id')
         await state.set_state(None)
 
-        total = db.get_users_count()
+        total = await db.get_users_count()
         pages = max(1, (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE)
-        users = db.get_all_users(limit=USERS_PAGE_SIZE, offset=0)
+        users = await db.get_all_users(limit=USERS_PAGE_SIZE, offset=0)
         text = f"👥 <b>Пользователи ({total})</b>"
         kb = _users_keyboard(users, 0, pages, "admin_users_page", show_search=True)
 
@@ -736,8 +724,8 @@ async def admin_users_search_query(message: Message, state: FSMContext):
     await state.update_data(user_search_query=q)
     await state.set_state(None)
 
-    total = db.search_users_count(q)
-    users = db.search_users(q, limit=USERS_PAGE_SIZE, offset=0)
+    total = await db.search_users_count(q)
+    users = await db.search_users(q, limit=USERS_PAGE_SIZE, offset=0)
     pages = max(1, (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE)
     text = f"👥 <b>Пользователи</b>\n🔎 <b>Поиск:</b> {q}\nВсего: {total}"
     kb = _users_keyboard(users, 0, pages, "admin_users_search_page", show_search=False)
@@ -767,7 +755,7 @@ async def noop_callback(callback: CallbackQuery):
 async def admin_user_detail(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     uid = int(callback.data.replace("adm_user_",""))
-    user = db.get_user_by_id(uid)
+    user = await db.get_user_by_id(uid)
     if not user: return
     card = f"\n💳 {user['bank']}: {user['card_number']}" if user.get('card_number') else ""
     car = ""
@@ -793,13 +781,13 @@ async def admin_user_detail(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("set_admin_"))
 async def set_admin(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    db.set_user_role(int(callback.data.replace("set_admin_","")), 'admin')
+    await db.set_user_role(int(callback.data.replace("set_admin_","")), 'admin')
     await callback.message.edit_text("✅ Теперь админ.")
 
 @router.callback_query(F.data.startswith("set_user_"))
 async def set_user(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    db.set_user_role(int(callback.data.replace("set_user_","")), 'user')
+    await db.set_user_role(int(callback.data.replace("set_user_","")), 'user')
     await callback.message.edit_text("✅ Теперь обычный пользователь.")
 
 @router.callback_query(F.data.startswith("ban_menu_"))
@@ -822,22 +810,20 @@ async def ban_duration(callback: CallbackQuery, state: FSMContext):
 async def ban_reason(message: Message, state: FSMContext):
     data = await state.get_data()
     reason = "" if message.text == "-" else message.text[:200]
-    db.ban_user(data['ban_user_id'], data.get('ban_hours'), reason)
+    await db.ban_user(data['ban_user_id'], data.get('ban_hours'), reason)
     await state.clear()
-    user = db.get_user_by_id(data['ban_user_id'])
+    user = await db.get_user_by_id(data['ban_user_id'])
     await message.answer(f"🚫 {user['full_name']} забанен.", reply_markup=get_main_menu_keyboard(True))
-    try:
-        t = "🚫 Вы заблокированы"
-        if data.get('ban_hours'): t += f" на {data['ban_hours']}ч"
-        else: t += " навсегда"
-        if reason: t += f"\n📝 {reason}"
-        await message.bot.send_message(user['telegram_id'], t)
-    except: pass
+    t = "🚫 Вы заблокированы"
+    if data.get('ban_hours'): t += f" на {data['ban_hours']}ч"
+    else: t += " навсегда"
+    if reason: t += f"\n📝 {reason}"
+    outbox.send(user['telegram_id'], t)
 
 @router.callback_query(F.data.startswith("unban_"))
 async def unban(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    db.unban_user(int(callback.data.replace("unban_","")))
+    await db.unban_user(int(callback.data.replace("unban_","")))
     await callback.message.edit_text("✅ Разбанен.")
 
 
@@ -845,7 +831,13 @@ async def unban(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    s = db.get_statistics()
+    s = await db.get_statistics()
+    days = await db.get_daily_statistics(7)
+    pc = get_price_cache_stats()
+    ex = executor.stats()
+    trend = "\n".join(
+        f"{datetime.strptime(d['day'], '%Y-%m-%d').strftime('%d.%m')}: "
+        f"{d['bookings']} / {d['confirmed']} / {d['revenue']:g}₽" for d in days)
     await callback.message.edit_text(
         f"📈 <b>Статистика</b>\n\n"
         f"👥 Пользователи: {s['total_users']} (активных: {s['active_users']})\n"
@@ -853,8 +845,26 @@ async def admin_stats(callback: CallbackQuery, state: FSMContext):
         f"📋 Бронирований: {s['total_bookings']}\n"
         f"⏳ Ожидает: {s['pending_bookings']}\n"
         f"✅ Подтверждено: {s['confirmed_bookings']}\n"
-        f"💰 Доход: {s['total_revenue']}₽",
+        f"💰 Доход: {s['total_revenue']}₽\n\n"
+        f"📊 <b>7 дней</b> (брони / подтверждено / доход, по дню начала):\n{trend}\n\n"
+        f"🧮 Кэш цен: {pc['hit_rate']}% попаданий ({pc['hits']}/{pc['hits'] + pc['misses']}), "
+        f"{pc['size']}/{pc['max_size']}\n"
+        f"⚙️ Апдейты: в работе {ex['running']}, ждут {ex['waiting']} (макс. очередь чата {ex['max_depth']}), "
+        f"ожидание p50/p95 {ex['wait_p50_ms']}/{ex['wait_p95_ms']} мс",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Панель", callback_data="admin_panel")]]),
+        parse_mode="HTML")
+
+@router.callback_query(F.data == "admin_metrics")
+async def admin_metrics(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    text = metrics.summary()
+    if tracing.recent_slow:
+        tree = tracing.recent_slow[-1]
+        text += f"\n\n🐢 <b>Последний медленный апдейт</b>\n<pre>{html.escape(tree[-1500:])}</pre>"
+    await callback.message.edit_text(f"{text}\n\n🕒 {now_local():%H:%M:%S}",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_metrics")],
             [InlineKeyboardButton(text="🔙 Панель", callback_data="admin_panel")]]),
         parse_mode="HTML")
 
@@ -862,7 +872,12 @@ async def admin_stats(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "admin_broadcast")
 async def broadcast_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    await callback.message.edit_text("📢 Кому отправить?", reply_markup=get_broadcast_target_keyboard())
+    text, kb = "📢 Кому отправить?", get_broadcast_target_keyboard()
+    running = await db.get_running_broadcasts()
+    if running:
+        text = "\n\n".join(broadcasts.progress_text(b) for b in running) + "\n\n" + text
+        kb.inline_keyboard[:0] = [broadcasts.cancel_keyboard(b['id']).inline_keyboard[0] for b in running]
+    await callback.message.edit_text(text, reply_markup=kb)
 
 @router.callback_query(F.data.startswith("broadcast_"))
 async def broadcast_target(callback: CallbackQuery, state: FSMContext):
@@ -875,16 +890,21 @@ async def broadcast_target(callback: CallbackQuery, state: FSMContext):
 async def broadcast_send(message: Message, state: FSMContext):
     data = await state.get_data()
     target = data.get('broadcast_target','all')
-    users = db.get_active_users() if target == 'active' else db.get_all_users(limit=10000)
     await state.clear()
-    sent = 0; fail = 0
-    for u in users:
-        try:
-            await message.bot.send_message(u['telegram_id'], message.text)
-            sent += 1
-            if sent % 20 == 0: await asyncio.sleep(0.5)
-        except: fail += 1
-    await message.answer(f"📢 Отправлено: {sent}, ошибок: {fail}", reply_markup=get_main_menu_keyboard(True))
+    # Рассылка — задание в БД, идёт в фоне пачками; это сообщение обновляется прогрессом
+    job_id = await db.create_broadcast(message.text, target, message.chat.id)
+    b = await db.get_broadcast(job_id)
+    msg = await message.answer(broadcasts.progress_text(b), reply_markup=broadcasts.cancel_keyboard(job_id))
+    await db.set_broadcast_message(job_id, msg.message_id)
+    broadcasts.start(job_id)
+    await message.answer("Меню:", reply_markup=get_main_menu_keyboard(True))
+
+
+@router.callback_query(F.data.startswith("bcast_cancel_"))
+async def broadcast_cancel(callback: CallbackQuery, state: FSMContext):
+    job_id = int(callback.data.replace("bcast_cancel_", ""))
+    ok = await broadcasts.cancel(job_id)
+    await callback.answer("⛔ Рассылка остановлена" if ok else "Рассылка уже завершена")
 
 
 # ==================== NAV ====================
@@ -898,18 +918,24 @@ async def admin_panel(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "admin_export_db")
 async def admin_export_db(callback: CallbackQuery):
     await callback.answer()
+    msg = await callback.message.answer("⏳ Снимаю копию базы…")
     try:
-        file = FSInputFile(DATABASE_PATH)
-        await callback.message.answer_document(file, caption="💾 Резервная копия базы данных")
+        # Согласованный снимок через backup API (живой файл при WAL мог быть неполным)
+        snap = await backup.snapshot(compress=True)
+        await callback.message.answer_document(
+            FSInputFile(snap['path']),
+            caption=f"💾 Резервная копия базы данных\nintegrity_check: ok, {snap['size'] // 1024} КБ")
+        await msg.delete()
     except Exception as e:
-        await callback.message.answer(f"Не удалось выгрузить базу: {e}")
+        logger.error(f"db export: {e}")
+        await msg.edit_text(f"Не удалось выгрузить базу: {e}")
 
 
 @router.callback_query(F.data.startswith("adm_pay_confirm_"))
 async def admin_pay_confirm(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_pay_confirm_", ""))
-    ok, status = db.confirm_booking_idempotent(bid)
+    ok, status = await db.confirm_booking_idempotent(bid)
     if status == 'already':
         await callback.message.answer(f"ℹ️ Бронь #{bid} уже подтверждена.")
         return
@@ -921,90 +947,107 @@ async def admin_pay_confirm(callback: CallbackQuery, state: FSMContext):
         return
 
     # Берём расширенные данные (в т.ч. telegram_id арендодателя)
-    b = db.get_booking_by_id(bid) or db.get_booking_full(bid)
+    b = await db.get_booking_by_id(bid) or await db.get_booking_full(bid)
     if b:
         # Сообщение клиенту (после подтверждения оплаты показываем номер места)
-        try:
-            await callback.bot.send_message(
-                b.get('customer_telegram_id'),
-                f"🎉 <b>Оплата подтверждена!</b>\n\n"
-                f"🏠 {b.get('spot_number','')}\n"
-                f"📍 {FIXED_ADDRESS}\n"
-                f"📅 {format_datetime(b.get('start_time'))} — {format_datetime(b.get('end_time'))}",
-                parse_mode="HTML"
-            )
-        except Exception:
-            pass
+        outbox.send(
+            b.get('customer_telegram_id'),
+            f"🎉 <b>Оплата подтверждена!</b>\n\n"
+            f"🏠 {b.get('spot_number','')}\n"
+            f"📍 {FIXED_ADDRESS}\n"
+            f"📅 {format_datetime(b.get('start_time'))} — {format_datetime(b.get('end_time'))}",
+            parse_mode="HTML"
+        )
 
         # Уведомление арендодателя (без контактов арендатора)
-        try:
-            sup_tid = b.get('supplier_telegram_id')
-            if sup_tid:
-                await callback.bot.send_message(
-                    sup_tid,
-                    f"✅ Ваш слот забронирован и оплачен!\n\n📅 {format_datetime(b.get('start_time'))} — {format_datetime(b.get('end_time'))}",
-                    parse_mode="HTML"
-                )
-        except Exception:
-            pass
+        sup_tid = b.get('supplier_telegram_id')
+        if sup_tid:
+            outbox.send(
+                sup_tid,
+                f"✅ Ваш слот забронирован и оплачен!\n\n📅 {format_datetime(b.get('start_time'))} — {format_datetime(b.get('end_time'))}",
+                parse_mode="HTML"
+            )
 
     await callback.message.answer(f"✅ Бронь #{bid} подтверждена.")
 @router.callback_query(F.data.startswith("adm_pay_decline_"))
 async def admin_pay_decline(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("adm_pay_decline_", ""))
-    ok = db.decline_payment(bid)
-    b = db.get_booking_full(bid)
+    ok = await db.decline_payment(bid)
+    b = await db.get_booking_full(bid)
     if b:
-        try:
-            await callback.bot.send_message(
-                b["customer_telegram_id"],
-                f"❌ Оплата по брони #{bid} отклонена администратором.\n"
-                f"Проверьте чек и отправьте снова."
-            )
-        except:
-            pass
+        outbox.send(
+            b["customer_telegram_id"],
+            f"❌ Оплата по брони #{bid} отклонена администратором.\n"
+            f"Проверьте чек и отправьте снова."
+        )
     await callback.message.answer("Готово." if ok else "Не удалось.")
 
+# ==================== EXPORT ====================
+_export_lock = asyncio.Lock()
+_EXPORT_TABLES = list(export.TABLES)
+_EXPORT_PERIODS = ((0, "За всё время"), (30, "30 дней"), (7, "7 дней"), (1, "Сегодня"))
+
+
+def _export_tables_label(t: str) -> str:
+    return "все таблицы" if t == "all" else export.TITLES[_EXPORT_TABLES[int(t)]]
+
+
 @router.callback_query(F.data == "admin_export_excel")
 async def admin_export_excel(callback: CallbackQuery):
     await callback.answer()
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        wb = Workbook()
-        wb.remove(wb.active)
-
-        def add_sheet(table_name: str):
-            try:
-                cur.execute(f"SELECT * FROM {table_name}")
-                rows = cur.fetchall()
-            except Exception:
-                return
-            ws = wb.create_sheet(title=table_name[:31])
-            if not rows:
-                ws.append(["(empty)"])
-                return
-            headers = rows[0].keys()
-            ws.append(list(headers))
-            for r in rows:
-                ws.append([r[h] for h in headers])
-
-        for tname in ("users", "parking_spots", "spot_availability", "bookings", "events_log"):
-            add_sheet(tname)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            tmp_path = tmp.name
-        wb.save(tmp_path)
-
-        file = FSInputFile(tmp_path)
-        await callback.message.answer_document(file, caption="📊 Выгрузка в Excel (.xlsx)")
+    buttons = [[InlineKeyboardButton(text="📚 Все таблицы", callback_data="exp_t_all")]]
+    buttons += [[InlineKeyboardButton(text=export.TITLES[t], callback_data=f"exp_t_{i}")]
+                for i, t in enumerate(_EXPORT_TABLES)]
+    buttons.append([InlineKeyboardButton(text="🔙 Панель", callback_data="admin_panel")])
+    await callback.message.edit_text("📊 <b>Выгрузка</b>\n\nЧто выгрузить?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
+
 
+@router.callback_query(F.data.startswith("exp_t_"))
+async def admin_export_period(callback: CallbackQuery):
+    await callback.answer()
+    t = callback.data.replace("exp_t_", "")
+    buttons = [[InlineKeyboardButton(text=label, callback_data=f"exp_p_{t}_{days}")]
+               for days, label in _EXPORT_PERIODS]
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin_export_excel")])
+    await callback.message.edit_text(f"📊 <b>Выгрузка: {_export_tables_label(t)}</b>\n\nЗа какой период?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("exp_p_"))
+async def admin_export_format(callback: CallbackQuery):
+    await callback.answer()
+    t, days = callback.data.replace("exp_p_", "").split("_")
+    buttons = [[InlineKeyboardButton(text="📗 Excel (.xlsx)", callback_data=f"exp_f_{t}_{days}_xlsx")],
+               [InlineKeyboardButton(text="🗜 CSV (.csv.gz)", callback_data=f"exp_f_{t}_{days}_csv")],
+               [InlineKeyboardButton(text="🔙 Назад", callback_data=f"exp_t_{t}")]]
+    await callback.message.edit_text(f"📊 <b>Выгрузка: {_export_tables_label(t)}</b>\n\nФормат?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("exp_f_"))
+async def admin_export_run(callback: CallbackQuery):
+    await callback.answer()
+    t, days, fmt = callback.data.replace("exp_f_", "").split("_")
+    if _export_lock.locked():
+        await callback.message.answer("⏳ Выгрузка уже готовится, дождитесь файла.")
+        return
+    tables = _EXPORT_TABLES if t == "all" else [_EXPORT_TABLES[int(t)]]
+    period = dict(_EXPORT_PERIODS)[int(days)]
+    await callback.message.edit_text(f"⏳ Готовлю выгрузку: {_export_tables_label(t)}, {period.lower()}…")
+    async with _export_lock:
+        paths = []
         try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-    except Exception as e:
-        await callback.message.answer(f"Не удалось выгрузить Excel: {e}")
+            # чтение и запись файла — в отдельном потоке, event loop не блокируется
+            paths, counts = await asyncio.to_thread(export.build, tables, fmt, int(days) or None)
+            summary = ", ".join(f"{export.TITLES[k]}: {v}" for k, v in counts.items())
+            for path in paths:
+                await callback.message.answer_document(
+                    FSInputFile(path), caption=f"📊 Выгрузка ({period.lower()})\n{summary}"[:1024])
+            await callback.message.edit_text(f"✅ Выгрузка готова: {summary}")
+        except Exception as e:
+            logger.error(f"export: {e}")
+            await callback.message.answer(f"Не удалось выгрузить: {e}")
+        finally:
+            export.cleanup(paths)
@@ -0,0 +1,347 @@
+"""
+Индекс интервалов spot_availability в памяти процесса
+
+Для каждого места храним все интервалы (свободные и занятые), отсортированные
+по началу, плюс максимальную длину интервала места — этого достаточно, чтобы
+окно [a, b) находилось двумя bisect'ами: пересекать [a, b) могут только
+интервалы с началом в [a - max_len, b). Свободные интервалы всех мест
+дополнительно лежат в одном общем отсортированном списке (поиск по дате,
+ближайшие слоты).
+
+Индекс ничего не знает про SQLite: database.py перестраивает его целиком
+(rebuild) и обновляет затронутые места после каждого коммита (refresh).
+Время — целые секунды от 1970-01-01 по локальным «настенным» часам,
+как и строки в БД.
+"""
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+_INF = float('inf')
+_CHUNK = 500
+
+# Поля места/поставщика, которые get_available_slots добавляет к строке слота
+_SLOT_META = ('spot_number', 'price_per_hour', 'address', 'description',
+              'supplier_id', 'supplier_name', 'card_number', 'bank')
+
+
+def to_key(val) -> int:
+    """datetime или строка 'YYYY-MM-DD HH:MM[:SS]' → секунды от эпохи."""
+    if not isinstance(val, datetime):
+        val = datetime.fromisoformat(str(val))
+    return int((val.replace(tzinfo=None) - _EPOCH).total_seconds())
+
+
+class _Spot:
+    __slots__ = ('meta', 'keys', 'rows', 'max_len', 'free_max_len', 'free_max_end')
+
+    def __init__(self):
+        self.meta = None            # ps.* + supplier_name/card_number/bank (None — места нет)
+        self.keys = []              # [(start, id)] по возрастанию
+        self.rows = []              # [(start, end, row_dict)] параллельно keys
+        self.max_len = 0
+        self.free_max_len = 0       # самый длинный свободный интервал места
+        self.free_max_end = None
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._spots: dict[int, _Spot] = {}
+        self._free: list[tuple] = []    # (start, id, end, spot_id)
+        self._free_max_len = 0          # максимум free_max_len по местам
+        self.ready = False
+        self._version = 0               # растёт при любом изменении — ключ кэша счётчиков
+        self._counts: dict[tuple, int] = {}
+        self._stats = {'rebuilds': 0, 'refreshes': 0, 'queries': 0, 'count_hits': 0}
+
+    # ---------- загрузка ----------
+    def rebuild(self, conn):
+        """Полная загрузка из БД."""
+        with self._lock:
+            self._spots = {}
+            self._free = []
+            self._free_max_len = 0
+            self._load(conn, None)
+            self.ready = True
+            self._changed()
+            self._stats['rebuilds'] += 1
+
+    def refresh(self, conn, spot_ids=(), supplier_ids=()):
+        """Перечитывает затронутые места (и места затронутых поставщиков)."""
+        with self._lock:
+            if not self.ready:
+                return
+            ids = set(spot_ids)
+            if supplier_ids:
+                sup = set(supplier_ids)
+                ids.update(sid for sid, s in self._spots.items()
+                           if s.meta and s.meta['supplier_id'] in sup)
+            if not ids:
+                return
+            shrink = False
+            for sid in ids:
+                shrink |= self._drop(sid)
+            ids = list(ids)
+            for i in range(0, len(ids), _CHUNK):
+                self._load(conn, ids[i:i + _CHUNK])
+            if shrink:
+                # ушёл самый длинный свободный интервал — иначе окно поиска
+                # (min_end - _free_max_len) только растёт
+                self._free_max_len = max((s.free_max_len for s in self._spots.values()), default=0)
+            self._changed()
+            self._stats['refreshes'] += 1
+
+    def reset(self):
+        with self._lock:
+            self.ready = False
+            self._changed()
+
+    def _changed(self):
+        self._version += 1
+        self._counts.clear()
+
+    def _drop(self, sid) -> bool:
+        """Убирает место из индекса. True — у него был самый длинный свободный интервал."""
+        spot = self._spots.pop(sid, None)
+        if not spot:
+            return False
+        for start, end, row in spot.rows:
+            if row['is_booked'] == 0:
+                i = bisect_left(self._free, (start, row['id']))
+                if i < len(self._free) and self._free[i][1] == row['id']:
+                    del self._free[i]
+        return spot.free_max_len > 0 and spot.free_max_len >= self._free_max_len
+
+    def _load(self, conn, ids):
+        where, params = '', ()
+        if ids is not None:
+            where = f" WHERE ps.id IN ({','.join('?' * len(ids))})"
+            params = tuple(ids)
+        for r in conn.execute(
+            '''SELECT ps.*, u.id AS _supplier, u.full_name AS supplier_name, u.card_number, u.bank
+               FROM parking_spots ps LEFT JOIN users u ON ps.supplier_id = u.id''' + where, params
+        ):
+            self._spots.setdefault(r['id'], _Spot()).meta = dict(r)
+
+        where = where.replace('ps.id', 'spot_id')
+        loaded = set()
+        cur = conn.execute('SELECT * FROM spot_availability' + where + ' ORDER BY start_time, id', params)
+        # при схеме с INTEGER-минутами строки не разбираем
+        minutes = 'start_min' in [d[0] for d in cur.description]
+        for r in cur:
+            try:
+                if minutes and r['start_min'] is not None:
+                    start, end = r['start_min'] * 60, r['end_min'] * 60
+                else:
+                    start, end = to_key(r['start_time']), to_key(r['end_time'])
+            except (TypeError, ValueError):
+                logger.warning(f"availability index: bad interval in slot {r['id']}")
+                continue
+            row = dict(r)
+            spot = self._spots.setdefault(row['spot_id'], _Spot())
+            spot.keys.append((start, row['id']))
+            spot.rows.append((start, end, row))
+            spot.max_len = max(spot.max_len, end - start)
+            loaded.add(row['spot_id'])
+            if row['is_booked'] == 0:
+                spot.free_max_end = end if spot.free_max_end is None else max(spot.free_max_end, end)
+                if ids is None:
+                    self._free.append((start, row['id'], end, row['spot_id']))
+                else:
+                    insort(self._free, (start, row['id'], end, row['spot_id']))
+                spot.free_max_len = max(spot.free_max_len, end - start)
+                self._free_max_len = max(self._free_max_len, end - start)
+        if ids is None:
+            self._free.sort()
+        # строки в БД могут быть с секундами и без — порядок по ключам, а не по тексту
+        for sid in loaded:
+            spot = self._spots[sid]
+            order = sorted(range(len(spot.keys)), key=spot.keys.__getitem__)
+            spot.keys = [spot.keys[i] for i in order]
+            spot.rows = [spot.rows[i] for i in order]
+
+    # ---------- запросы ----------
+    def _listed(self, spot: _Spot) -> bool:
+        m = spot.meta
+        return bool(m) and m['is_available'] == 1 and m['_supplier'] is not None
+
+    def _bounds(self, now, day_start, day_end):
+        min_end = to_key(now) + 1
+        hi = _INF
+        if day_start is not None:
+            min_end = max(min_end, to_key(day_start))
+            hi = to_key(day_end)
+        return min_end, hi
+
+    def _slot_row(self, start, aid, sid, exclude_supplier) -> dict | None:
+        """Строка слота с полями места или None, если место скрыто/исключено."""
+        spot = self._spots[sid]
+        if not self._listed(spot):
+            return None
+        meta = spot.meta
+        if exclude_supplier and meta['supplier_id'] == exclude_supplier:
+            return None
+        row = spot.rows[bisect_left(spot.keys, (start, aid))][2]
+        d = dict(row)
+        for k in _SLOT_META:
+            d[k] = meta[k]
+        return d
+
+    def free_slots(self, now, day_start=None, day_end=None, exclude_supplier=None) -> list[dict]:
+        """Свободные слоты (end > now), пересекающие сутки [day_start, day_end),
+        как в get_available_slots: sa.* + поля места и поставщика."""
+        min_end, hi = self._bounds(now, day_start, day_end)
+        out = []
+        with self._lock:
+            self._stats['queries'] += 1
+            i = bisect_left(self._free, (min_end - self._free_max_len,))
+            free = self._free
+            while i < len(free) and free[i][0] < hi:
+                start, aid, end, sid = free[i]
+                i += 1
+                if end < min_end:
+                    continue
+                d = self._slot_row(start, aid, sid, exclude_supplier)
+                if d is not None:
+                    out.append(d)
+        return out
+
+    def free_page(self, now, day_start=None, day_end=None, exclude_supplier=None,
+                  after=None, before=None, limit: int = 20) -> tuple[list[dict], bool]:
+        """Страница free_slots по ключу (start, id): после after или перед before.
+
+        Возвращает (слоты по возрастанию, есть ли ещё в направлении листания).
+        Просматривается только страница, а не весь список свободных слотов.
+        """
+        min_end, hi = self._bounds(now, day_start, day_end)
+        lo = min_end - self._free_max_len
+        out = []
+        more = False
+        with self._lock:
+            self._stats['queries'] += 1
+            free = self._free
+            if before is not None:
+                i = bisect_left(free, tuple(before)) - 1
+                while i >= 0 and free[i][0] >= lo:
+                    start, aid, end, sid = free[i]
+                    i -= 1
+                    if end < min_end or start >= hi:
+                        continue
+                    d = self._slot_row(start, aid, sid, exclude_supplier)
+                    if d is None:
+                        continue
+                    if len(out) == limit:
+                        more = True
+                        break
+                    out.append(d)
+                out.reverse()
+            else:
+                i = bisect_left(free, (after[0], after[1] + 1) if after is not None else (lo,))
+                while i < len(free) and free[i][0] < hi:
+                    start, aid, end, sid = free[i]
+                    i += 1
+                    if end < min_end:
+                        continue
+                    d = self._slot_row(start, aid, sid, exclude_supplier)
+                    if d is None:
+                        continue
+                    if len(out) == limit:
+                        more = True
+                        break
+                    out.append(d)
+        return out, more
+
+    def count_free(self, now, day_start=None, day_end=None, exclude_supplier=None) -> int:
+        """Число слотов free_slots. Запоминается до следующего изменения индекса
+        (и не дольше минуты — слоты заканчиваются со временем)."""
+        min_end, hi = self._bounds(now, day_start, day_end)
+        key = (min_end // 60, hi, exclude_supplier)
+        with self._lock:
+            n = self._counts.get(key)
+            if n is not None:
+                self._stats['count_hits'] += 1
+                return n
+            n = 0
+            i = bisect_left(self._free, (min_end - self._free_max_len,))
+            free = self._free
+            while i < len(free) and free[i][0] < hi:
+                start, aid, end, sid = free[i]
+                i += 1
+                if end < min_end:
+                    continue
+                spot = self._spots[sid]
+                if not self._listed(spot):
+                    continue
+                if exclude_supplier and spot.meta['supplier_id'] == exclude_supplier:
+                    continue
+                n += 1
+            if len(self._counts) > 1000:
+                self._counts.clear()
+            self._counts[key] = n
+        return n
+
+    def nearest_free(self, now, to, limit: int) -> list[dict]:
+        """Свободные интервалы с началом в [now, to], по возрастанию начала."""
+        to_k = to_key(to)
+        out = []
+        with self._lock:
+            self._stats['queries'] += 1
+            i = bisect_left(self._free, (to_key(now),))
+            free = self._free
+            while i < len(free) and free[i][0] <= to_k and len(out) < limit:
+                start, aid, end, sid = free[i]
+                i += 1
+                spot = self._spots[sid]
+                meta = spot.meta
+                if not meta or meta['is_available'] != 1:
+                    continue
+                row = spot.rows[bisect_left(spot.keys, (start, aid))][2]
+                out.append({'availability_id': aid, 'spot_id': sid,
+                            'start_time': row['start_time'], 'end_time': row['end_time'],
+                            'spot_number': meta['spot_number'], 'price_per_hour': meta['price_per_hour'],
+                            'address': meta['address'], 'supplier_id': meta['supplier_id']})
+        return out
+
+    def spots_with_free(self, now, limit: int) -> list[dict]:
+        """Места (ps.* + supplier_name) с хотя бы одним свободным слотом, end > now."""
+        now_k = to_key(now)
+        with self._lock:
+            self._stats['queries'] += 1
+            metas = [s.meta for s in self._spots.values()
+                     if self._listed(s) and s.free_max_end is not None and s.free_max_end > now_k]
+        metas.sort(key=lambda m: str(m.get('created_at') or ''), reverse=True)
+        out = []
+        for m in metas[:limit]:
+            d = {k: v for k, v in m.items() if k not in ('_supplier', 'card_number', 'bank')}
+            out.append(d)
+        return out
+
+    def has_overlap(self, spot_id, start, end, now, exclude_slot_id=None) -> bool:
+        """Есть ли у места интервал (любой), пересекающий [start, end) и не закончившийся к now."""
+        a, b, now_k = to_key(start), to_key(end), to_key(now)
+        with self._lock:
+            self._stats['queries'] += 1
+            spot = self._spots.get(spot_id)
+            if not spot:
+                return False
+            i = bisect_left(spot.keys, (a - spot.max_len,))
+            while i < len(spot.keys) and spot.keys[i][0] < b:
+                s, e, row = spot.rows[i]
+                i += 1
+                if e > a and e > now_k and row['id'] != exclude_slot_id:
+                    return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, ready=self.ready, spots=len(self._spots),
+                        slots=sum(len(s.keys) for s in self._spots.values()),
+                        free=len(self._free))
+
+
+index = AvailabilityIndex()
@@ -0,0 +1,152 @@
+"""
+Резервные копии БД ParkingBot
+
+Копия снимается через sqlite3 backup API порциями по BACKUP_PAGES_PER_STEP
+страниц с паузой между шагами — запись в БД не останавливается, а копия
+согласованная (в отличие от копирования файла при живом -wal). Если БД
+меняется другим соединением, SQLite начинает копирование заново; после
+BACKUP_MAX_RESTARTS перезапусков копируем одним шагом (в WAL это не мешает
+писателям).
+
+Каждый снимок проверяется PRAGMA integrity_check до сжатия, хранятся
+последние BACKUP_KEEP снимков в BACKUP_DIR. snapshot() запускает работу
+в потоке, чтобы не блокировать event loop.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from config import (DATABASE_PATH, BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_PAGES_PER_STEP,
+                    BACKUP_STEP_SLEEP, BACKUP_MAX_RESTARTS)
+
+logger = logging.getLogger(__name__)
+
+_PREFIX = "parking_"
+_lock = asyncio.Lock()
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy(dest: str) -> int:
+    """Онлайн-копия DATABASE_PATH в dest. Возвращает число перезапусков копирования."""
+    restarts = 0
+    src = sqlite3.connect(DATABASE_PATH)
+    try:
+        last = None
+
+        def progress(status, remaining, total):
+            nonlocal last, restarts
+            if last is not None and remaining > last:
+                restarts += 1
+                if restarts > BACKUP_MAX_RESTARTS:
+                    raise _Restarted()
+            last = remaining
+
+        dst = sqlite3.connect(dest)
+        try:
+            try:
+                src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP)
+            except _Restarted:
+                logger.warning(f"backup: source changed {restarts} times, copying in one step")
+                src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return restarts
+
+
+def check(path: str) -> tuple[bool, str]:
+    """PRAGMA integrity_check снимка (.db или .db.gz). Возвращает (ok, результат проверки)."""
+    tmp = None
+    try:
+        if path.endswith(".gz"):
+            fd, tmp = tempfile.mkstemp(suffix=".db")
+            with os.fdopen(fd, "wb") as out, gzip.open(path, "rb") as f:
+                shutil.copyfileobj(f, out)
+            path = tmp
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+        finally:
+            conn.close()
+        return rows == ["ok"], "; ".join(rows[:5])
+    except (sqlite3.Error, OSError, EOFError) as e:
+        return False, str(e)
+    finally:
+        if tmp:
+            os.remove(tmp)
+
+
+def make_snapshot(compress: bool = BACKUP_COMPRESS, keep: int = BACKUP_KEEP) -> dict:
+    """Снимок в BACKUP_DIR: копия → integrity_check → сжатие → ротация.
+
+    Возвращает {'path', 'size', 'restarts'}; при неудачной проверке — RuntimeError.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = _PREFIX + datetime.now().strftime("%Y%m%d_%H%M%S")
+    n = 1
+    while any(os.path.exists(os.path.join(BACKUP_DIR, name + ext)) for ext in (".db", ".db.gz")):
+        n += 1
+        name = name.split("-")[0] + f"-{n}"
+    path = os.path.join(BACKUP_DIR, name + ".db")
+    part, gz_part = path + ".part", path + ".gz.part"
+    try:
+        restarts = _copy(part)
+        ok, detail = check(part)
+        if not ok:
+            raise RuntimeError(f"integrity_check: {detail}")
+        if compress:
+            with open(part, "rb") as f, gzip.open(gz_part, "wb", compresslevel=6) as out:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            os.remove(part)
+            path, part = path + ".gz", gz_part
+        os.replace(part, path)
+    except Exception:
+        for p in (part, gz_part):
+            if os.path.exists(p):
+                os.remove(p)
+        raise
+    _rotate(keep)
+    size = os.path.getsize(path)
+    logger.info(f"backup: {path} ({size} bytes, restarts={restarts})")
+    return {'path': path, 'size': size, 'restarts': restarts}
+
+
+def list_snapshots() -> list[str]:
+    """Пути снимков, новые первыми."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    paths = [os.path.join(BACKUP_DIR, n) for n in os.listdir(BACKUP_DIR)
+             if n.startswith(_PREFIX) and (n.endswith(".db") or n.endswith(".db.gz"))]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def _rotate(keep: int):
+    if keep <= 0:
+        return
+    for path in list_snapshots()[keep:]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"backup rotate {path}: {e}")
+
+
+async def snapshot(compress: bool = BACKUP_COMPRESS) -> dict:
+    """make_snapshot в потоке; одновременно идёт не больше одного снимка."""
+    async with _lock:
+        return await asyncio.to_thread(make_snapshot, compress)
+
+
+async def scheduled_snapshot():
+    try:
+        await snapshot()
+    except Exception as e:
+        logger.error(f"scheduled backup: {e}")
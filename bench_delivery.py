@@ -0,0 +1,207 @@
+"""
+Бенчмарк доставки апдейтов: long polling против вебхука (webhook.py)
+на локальном фейковом Bot API.
+
+    python bench_delivery.py [--updates 2000] [--chats 50] [--work-ms 20] [--in-flight 100]
+
+Фейковый сервер отвечает на getMe / getUpdates / setWebhook / sendMessage.
+Каждый апдейт — сообщение в один из --chats чатов; обработчик «работает»
+--work-ms мс и отвечает sendMessage. Задержка — от появления апдейта на
+сервере (polling) или начала POST (вебхук, до WEBHOOK_MAX_CONNECTIONS
+запросов одновременно, как у Telegram) до прихода ответа на сервер.
+Также считаются нарушения порядка ответов внутри чата; как в боте, апдейты
+идут через ChatSerialMiddleware (--no-serial — без него).
+Проверяется только доставка: обработчики бота и БД не участвуют.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import statistics
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import ClientSession, TCPConnector, web
+
+from config import WEBHOOK_MAX_CONNECTIONS
+from middlewares import ChatSerialMiddleware
+import webhook
+
+TOKEN = "123456:BENCH"
+SECRET = "bench-secret"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: очередь апдейтов для getUpdates и учёт sendMessage."""
+
+    def __init__(self):
+        self.pending: deque = deque()
+        self.arrived = asyncio.Event()
+        self.sent: dict[int, float] = {}      # update_id → время ответа
+        self.order: dict[int, list] = {}      # chat_id → порядок ответов (seq)
+        self.done = asyncio.Event()
+        self.expected = 0
+        self._msg_id = 0
+
+    def push(self, update: dict):
+        self.pending.append(update)
+        self.arrived.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        if method == 'getMe':
+            return self._ok({'id': 123456, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'})
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(int(params.get('offset') or 0),
+                                                    float(params.get('timeout') or 0)))
+        if method == 'sendMessage':
+            chat_id, text = int(params['chat_id']), params['text']
+            uid, seq = map(int, text.split(':'))
+            self.sent[uid] = time.perf_counter()
+            self.order.setdefault(chat_id, []).append(seq)
+            if len(self.sent) >= self.expected:
+                self.done.set()
+            self._msg_id += 1
+            return self._ok({'message_id': self._msg_id, 'date': int(time.time()), 'text': text,
+                             'chat': {'id': chat_id, 'type': 'private'}})
+        return self._ok(True)
+
+    async def _get_updates(self, offset: int, timeout: float) -> list:
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [self.pending[i] for i in range(min(100, len(self.pending)))]
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+
+def _make_updates(n: int, chats: int) -> list[dict]:
+    rnd = random.Random(1)
+    seq: dict[int, int] = {}
+    updates = []
+    for uid in range(1, n + 1):
+        chat = 1000 + rnd.randrange(chats)
+        seq[chat] = seq.get(chat, 0) + 1
+        updates.append({'update_id': uid, 'message': {
+            'message_id': uid, 'date': int(time.time()), 'text': f"{uid}:{seq[chat]}",
+            'chat': {'id': chat, 'type': 'private'},
+            'from': {'id': chat, 'is_bot': False, 'first_name': 'u'}}})
+    return updates
+
+
+def _dispatcher(work_ms: float, serial: bool) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def echo(message: Message):
+        await asyncio.sleep(work_ms / 1000 * random.uniform(0.5, 1.5))
+        await message.answer(message.text)
+
+    dp = Dispatcher()
+    if serial:
+        dp.update.outer_middleware(ChatSerialMiddleware())
+    dp.include_router(router)
+    return dp
+
+
+async def _serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def run_mode(mode: str, updates: list[dict], work_ms: float, in_flight: int, serial: bool) -> dict:
+    api = FakeBotAPI()
+    api.expected = len(updates)
+    api_app = web.Application()
+    api_app.router.add_route('*', '/bot{token}/{method}', api.handle)
+    api_port = _free_port()
+    api_runner = await _serve(api_app, api_port)
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}")))
+    dp = _dispatcher(work_ms, serial)
+    started: dict[int, float] = {}
+    try:
+        t0 = time.perf_counter()
+        if mode == 'polling':
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+            await asyncio.sleep(0.2)   # дождаться первого getUpdates
+            t0 = time.perf_counter()
+            for u in updates:
+                started[u['update_id']] = time.perf_counter()
+                api.push(u)
+            await api.done.wait()
+            elapsed = time.perf_counter() - t0
+            await dp.stop_polling()
+            await polling
+        else:
+            hook_port = _free_port()
+            hook_runner = await _serve(webhook.build_app(dp, bot, secret_token=SECRET, path="/webhook",
+                                                         max_in_flight=in_flight), hook_port)
+            url = f"http://127.0.0.1:{hook_port}/webhook"
+            async with ClientSession(connector=TCPConnector(limit=WEBHOOK_MAX_CONNECTIONS)) as http:
+                async def post(u):
+                    started[u['update_id']] = time.perf_counter()
+                    async with http.post(url, json=u,
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as r:
+                        r.raise_for_status()
+                t0 = time.perf_counter()
+                # Telegram шлёт апдейты одного чата последовательно, разные чаты — параллельно
+                by_chat: dict[int, list] = {}
+                for u in updates:
+                    by_chat.setdefault(u['message']['chat']['id'], []).append(u)
+
+                async def chat_stream(items):
+                    for u in items:
+                        await post(u)
+                await asyncio.gather(*(chat_stream(items) for items in by_chat.values()))
+                await api.done.wait()
+                elapsed = time.perf_counter() - t0
+            await hook_runner.cleanup()
+    finally:
+        await bot.session.close()
+        await api_runner.cleanup()
+    lat = sorted((api.sent[uid] - started[uid]) * 1000 for uid in started)
+    violations = sum(sum(1 for a, b in zip(seqs, seqs[1:]) if b < a) for seqs in api.order.values())
+    return {'elapsed': elapsed, 'rate': len(updates) / elapsed, 'p50': statistics.median(lat),
+            'p95': lat[int(len(lat) * 0.95) - 1], 'max': lat[-1], 'violations': violations}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--updates', type=int, default=2000)
+    ap.add_argument('--chats', type=int, default=50)
+    ap.add_argument('--work-ms', type=float, default=20)
+    ap.add_argument('--in-flight', type=int, default=100)
+    ap.add_argument('--no-serial', action='store_true', help="без ChatSerialMiddleware (порядок не гарантирован)")
+    args = ap.parse_args()
+
+    updates = _make_updates(args.updates, args.chats)
+    print(f"{args.updates} updates, {args.chats} chats, handler ~{args.work_ms} ms")
+    print(f"{'mode':<8} {'time s':>8} {'upd/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'order':>6}")
+    for mode in ('polling', 'webhook'):
+        r = asyncio.run(run_mode(mode, updates, args.work_ms, args.in_flight, not args.no_serial))
+        print(f"{mode:<8} {r['elapsed']:>8.2f} {r['rate']:>8.0f} {r['p50']:>8.1f} {r['p95']:>8.1f} "
+              f"{r['max']:>8.1f} {r['violations']:>6}")
+
+
+if __name__ == "__main__":
+    main()
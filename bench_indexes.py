@@ -0,0 +1,141 @@
+"""
+Бенчмарк индексов: старый набор (одиночные индексы) против управляемого
+набора database.INDEXES на синтетической БД.
+
+    python bench_indexes.py [--rows 1000000] [--repeat 20]
+
+--rows — число строк в spot_availability и в bookings (каждой).
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp(prefix="bench_idx_")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "bench.db")
+
+import database as db  # noqa: E402  (DATABASE_PATH должен быть задан до импорта)
+
+LEGACY_INDEXES = {
+    'idx_u_tg': 'users(telegram_id)',
+    'idx_sp_sup': 'parking_spots(supplier_id)',
+    'idx_sa_sp': 'spot_availability(spot_id)',
+    'idx_sa_bk': 'spot_availability(is_booked)',
+    'idx_bk_cust': 'bookings(customer_id)',
+    'idx_bk_st': 'bookings(status)',
+}
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _populate(conn, rows: int):
+    rnd = random.Random(42)
+    n_users, n_spots = max(10, rows // 100), max(10, rows // 50)
+    base = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=180)
+    conn.executemany("INSERT INTO users (telegram_id, full_name, phone) VALUES (?,?,?)",
+                     ((100000 + i, f"U{i}", "+7") for i in range(n_users)))
+    conn.executemany("INSERT INTO parking_spots (supplier_id, spot_number) VALUES (?,?)",
+                     ((rnd.randint(1, n_users), str(i)) for i in range(n_spots)))
+
+    def sa():
+        for _ in range(rows):
+            st = base + timedelta(minutes=15 * rnd.randint(0, 365 * 96))
+            yield (rnd.randint(1, n_spots), st.strftime(FMT),
+                   (st + timedelta(minutes=15 * rnd.randint(2, 48))).strftime(FMT),
+                   1 if rnd.random() < 0.7 else 0)
+    conn.executemany("INSERT INTO spot_availability (spot_id, start_time, end_time, is_booked) VALUES (?,?,?,?)", sa())
+
+    statuses = ['completed'] * 50 + ['cancelled'] * 20 + ['expired'] * 15 + ['confirmed'] * 13 + ['pending'] * 2
+
+    def bk():
+        for _ in range(rows):
+            st = base + timedelta(minutes=15 * rnd.randint(0, 365 * 96))
+            status = rnd.choice(statuses)
+            yield (rnd.randint(1, n_users), rnd.randint(1, n_spots), st.strftime(FMT),
+                   (st + timedelta(hours=2)).strftime(FMT), 200, status,
+                   'unpaid' if status == 'pending' else 'paid', (st - timedelta(days=1)).strftime(FMT))
+    conn.executemany("""INSERT INTO bookings (customer_id, spot_id, start_time, end_time, total_price,
+                                              status, payment_status, created_at)
+                        VALUES (?,?,?,?,?,?,?,?)""", bk())
+    return n_users, n_spots
+
+
+def _params(n_users, n_spots):
+    now = datetime.now()
+    rnd = random.Random(7)
+    return {
+        'expire_unpaid_bookings': lambda: ((now - timedelta(minutes=15)).strftime(FMT),),
+        'booking_reminders': lambda: ((now + timedelta(hours=1)).strftime(FMT), (now + timedelta(hours=2)).strftime(FMT)),
+        'active_bookings_count': lambda: (rnd.randint(1, n_users),),
+        'spot_availabilities': lambda: (rnd.randint(1, n_spots), now.strftime(FMT)),
+        'available_slots': lambda: ((now + timedelta(days=170)).strftime(FMT),),
+        'nearest_free_slots': lambda: (now.strftime(FMT), (now + timedelta(days=7)).strftime(FMT)),
+    }
+
+
+def _run(conn, params, repeat):
+    out = {}
+    for name, _table, sql, _ in db.HOT_QUERIES:
+        times = []
+        for _ in range(repeat):
+            p = params[name]()
+            t0 = time.perf_counter()
+            conn.execute(sql, p).fetchall()
+            times.append((time.perf_counter() - t0) * 1000)
+        plan = '; '.join(r['detail'] for r in conn.execute('EXPLAIN QUERY PLAN ' + sql, params[name]()))
+        out[name] = (statistics.median(times), plan)
+    return out
+
+
+def _set_indexes(conn, wanted: dict):
+    existing = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'")]
+    for name in existing:
+        conn.execute(f"DROP INDEX {name}")
+    for name, spec in wanted.items():
+        conn.execute(f"CREATE INDEX {name} ON {spec}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=1_000_000)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+    try:
+        db.init_database()
+        db.close_pool()
+        conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+        conn.row_factory = sqlite3.Row
+        t0 = time.perf_counter()
+        n_users, n_spots = _populate(conn, args.rows)
+        conn.commit()
+        print(f"dataset: {args.rows} availability + {args.rows} bookings, "
+              f"{n_users} users, {n_spots} spots ({time.perf_counter() - t0:.1f}s)")
+        params = _params(n_users, n_spots)
+
+        _set_indexes(conn, LEGACY_INDEXES)
+        legacy = _run(conn, params, args.repeat)
+        _set_indexes(conn, db.INDEXES)
+        managed = _run(conn, params, args.repeat)
+
+        print(f"{'query':26} {'legacy ms':>10} {'managed ms':>11} {'speedup':>8}")
+        for name in legacy:
+            a, b = legacy[name][0], managed[name][0]
+            print(f"{name:26} {a:10.3f} {b:11.3f} {a / b if b else float('inf'):7.1f}x")
+        print("\nplans (legacy → managed):")
+        for name in legacy:
+            print(f"  {name}:\n    {legacy[name][1]}\n    {managed[name][1]}")
+        conn.close()
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
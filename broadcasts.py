@@ -0,0 +1,116 @@
+"""
+Рассылки ParkingBot
+
+Рассылка — строка broadcast_jobs в БД: текст, аудитория и курсор по users.id.
+Получатели берутся пачками (keyset: id > cursor ORDER BY id LIMIT n), курсор
+сдвигается до отправки пачки, следующая пачка берётся, когда outbox
+дослал предыдущую. Поэтому в памяти не больше одной пачки, а после рестарта
+рассылка продолжается с курсора без повторных сообщений (resume_all).
+
+Счётчики sent/failed/blocked сбрасываются в БД каждые
+BROADCAST_PROGRESS_SECONDS (после падения — с точностью до последнего
+сброса), у админа — сообщение с живым прогрессом и кнопкой остановки.
+"""
+import asyncio
+import logging
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import db_async as db
+from config import BROADCAST_BATCH, BROADCAST_PROGRESS_SECONDS
+from outbound import outbox
+
+logger = logging.getLogger(__name__)
+
+_running: dict[int, asyncio.Task] = {}
+_jobs: dict = {}   # job_id → OutboundJob текущей пачки (для отмены)
+
+
+def cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⛔ Остановить рассылку", callback_data=f"bcast_cancel_{job_id}")]
+    ])
+
+
+def progress_text(b: dict) -> str:
+    title = {'running': '📢 Рассылка', 'done': '📢 Рассылка завершена',
+             'cancelled': '⛔ Рассылка остановлена'}.get(b['status'], '📢 Рассылка')
+    return (f"{title} #{b['id']}\n"
+            f"Отправлено: {b['sent']} из {b['total']}\n"
+            f"Заблокировали бота: {b['blocked']}, ошибок: {b['failed']}")
+
+
+def start(job_id: int):
+    if job_id not in _running:
+        task = asyncio.create_task(_run(job_id))
+        _running[job_id] = task
+        task.add_done_callback(lambda _t: _running.pop(job_id, None))
+
+
+async def resume_all():
+    """Продолжить рассылки, прерванные рестартом."""
+    for b in await db.get_running_broadcasts():
+        logger.info(f"Resuming broadcast #{b['id']} from user id > {b['cursor']}")
+        start(b['id'])
+
+
+async def cancel(job_id: int) -> bool:
+    ok = await db.cancel_broadcast(job_id)
+    job = _jobs.get(job_id)
+    if job is not None:
+        job.cancel()
+    return ok
+
+
+async def _run(job_id: int):
+    b = await db.get_broadcast(job_id)
+    if not b:
+        return
+    last_shown = None
+    try:
+        while True:
+            batch = await db.claim_broadcast_batch(job_id, BROADCAST_BATCH)
+            if not batch:
+                break
+            job = outbox.job(f"broadcast:{job_id}")
+            _jobs[job_id] = job
+            for u in batch:
+                outbox.send(u['telegram_id'], b['text'], job=job)
+            job.close()
+            flushed = {'sent': 0, 'failed': 0, 'blocked': 0}
+            done = False
+            while not done:
+                try:
+                    await asyncio.wait_for(job.wait(), BROADCAST_PROGRESS_SECONDS)
+                    done = True
+                except asyncio.TimeoutError:
+                    pass
+                delta = {k: getattr(job, k) - flushed[k] for k in flushed}
+                if any(delta.values()):
+                    await db.add_broadcast_counts(job_id, **delta)
+                    flushed = {k: getattr(job, k) for k in flushed}
+                last_shown = await _show_progress(job_id, last_shown)
+            if job.cancelled:
+                break
+        await db.finish_broadcast(job_id)
+    except Exception as e:
+        logger.error(f"broadcast #{job_id}: {e}")
+    finally:
+        _jobs.pop(job_id, None)
+    await _show_progress(job_id, last_shown)
+
+
+async def _show_progress(job_id: int, last_shown: str | None) -> str | None:
+    b = await db.get_broadcast(job_id)
+    if not b or not b['admin_chat_id']:
+        return last_shown
+    text = progress_text(b)
+    if text == last_shown:
+        return last_shown
+    kb = cancel_keyboard(job_id) if b['status'] == 'running' else None
+    if b['message_id']:
+        outbox.enqueue('edit_message_text', b['admin_chat_id'], message_id=b['message_id'],
+                       text=text, reply_markup=kb)
+    else:
+        outbox.send(b['admin_chat_id'], text, reply_markup=kb)
+    return text
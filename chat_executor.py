@@ -0,0 +1,101 @@
+"""
+Исполнение апдейтов: параллельно между чатами, строго по очереди внутри чата
+
+FSM-сценарии (выбор времени брони, создание слота, ...) рассчитаны на то,
+что апдейты одного пользователя обрабатываются по одному: двойной тап не
+должен читать состояние, которое ещё меняет первый. aiogram же запускает
+каждый апдейт отдельной задачей без ограничений.
+
+ChatExecutor держит по очереди на чат (deque ожидающих): апдейт чата
+начинается только после завершения предыдущего апдейта этого чата, разные
+чаты идут параллельно, но одновременно выполняется не больше
+UPDATE_MAX_CONCURRENCY апдейтов. Очередь чата удаляется, как только
+опустеет, поэтому память пропорциональна числу чатов с апдейтами в работе.
+
+Метрики (stats()): глубина очередей, ожидание перед стартом (p50/p95/max
+по последним апдейтам), число выполненных. Подключается middleware
+ChatSerialMiddleware (middlewares.py) первым outer-middleware на update —
+в polling и в вебхуке одинаково.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+from config import UPDATE_MAX_CONCURRENCY
+
+_WAIT_SAMPLES = 1024
+
+
+class ChatExecutor:
+    def __init__(self, max_concurrency: int = UPDATE_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._queues: dict[Hashable, deque] = {}   # чат → ожидающие (Future); голова — выполняется
+        self._waits: deque = deque(maxlen=_WAIT_SAMPLES)
+        self.running = 0
+        self.counters = {'processed': 0, 'queued': 0, 'max_depth': 0, 'max_wait_ms': 0.0}
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[Hashable]):
+        """Выполнение апдейта чата key: ждёт свою очередь в чате и общий лимит.
+
+        Значение блока — сколько ждали, мс.
+        """
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        t0 = time.monotonic()
+        q = None
+        if key is not None:
+            q = self._queues.get(key)
+            if q is None:
+                q = self._queues[key] = deque()
+            gate = asyncio.get_running_loop().create_future()
+            q.append(gate)
+            if len(q) > 1:
+                self.counters['queued'] += 1
+                self.counters['max_depth'] = max(self.counters['max_depth'], len(q))
+            else:
+                gate.set_result(None)
+        try:
+            if q is not None:
+                await gate
+            async with self._sem:
+                wait_ms = (time.monotonic() - t0) * 1000
+                self._waits.append(wait_ms)
+                self.counters['max_wait_ms'] = max(self.counters['max_wait_ms'], wait_ms)
+                self.running += 1
+                try:
+                    yield wait_ms
+                finally:
+                    self.running -= 1
+                    self.counters['processed'] += 1
+        finally:
+            if q is not None:
+                self._release(key, q, gate)
+
+    def _release(self, key, q: deque, gate: asyncio.Future):
+        was_head = q[0] is gate
+        q.remove(gate)
+        if not q:
+            if self._queues.get(key) is q:
+                del self._queues[key]
+        elif was_head and not q[0].done():   # отменённый ожидающий передаст очередь сам
+            q[0].set_result(None)
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        depths = [len(q) for q in self._queues.values()]
+        return {
+            **self.counters,
+            'running': self.running,
+            'chats': len(depths),
+            'waiting': sum(depths) - len(depths),
+            'deepest': max(depths, default=0),
+            'wait_p50_ms': round(waits[len(waits) // 2], 1) if waits else 0.0,
+            'wait_p95_ms': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+        }
+
+
+executor = ChatExecutor()
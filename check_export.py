@@ -0,0 +1,78 @@
+"""
+Проверка фильтра по периоду в выгрузке (export.py) на временной БД.
+
+    python check_export.py [--tz Europe/Moscow]
+
+created_at пишется SQLite как CURRENT_TIMESTAMP (UTC), start_time — по
+локальным часам TIMEZONE. Выгрузка «за сегодня» должна включать
+регистрацию и запись журнала в 00:30 по местному времени (в UTC это ещё
+вчера при положительном смещении) и бронь с началом в 00:30, и не включать
+те же записи в 23:30 вчерашнего дня. Код выхода 1 — фильтр ошибся.
+"""
+import argparse
+import csv
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+ap = argparse.ArgumentParser()
+ap.add_argument('--tz', default='Europe/Moscow')
+args = ap.parse_args()
+
+_tmp = tempfile.mkdtemp(prefix="check_export_")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "check.db")
+os.environ["TIMEZONE"] = args.tz
+
+import database as db  # noqa: E402  (DATABASE_PATH/TIMEZONE должны быть заданы до импорта)
+import export  # noqa: E402
+from utils import now_local  # noqa: E402
+
+FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _utc(local: datetime) -> str:
+    return local.replace(tzinfo=ZoneInfo(args.tz)).astimezone(timezone.utc).strftime(FMT)
+
+
+def main() -> int:
+    db.init_database()
+    midnight = now_local().replace(hour=0, minute=0)
+    inside, outside = midnight + timedelta(minutes=30), midnight - timedelta(minutes=30)
+    with db.get_connection() as conn:
+        for tg, when in ((1, inside), (2, outside)):
+            conn.execute("INSERT INTO users (telegram_id, full_name, phone, created_at) VALUES (?,?,?,?)",
+                         (tg, f"user {tg}", "+70000000000", _utc(when)))
+            conn.execute("INSERT INTO admin_logs (action_type, user_id, created_at) VALUES (?,?,?)",
+                         ('check', tg, _utc(when)))
+            conn.execute("INSERT INTO bookings (spot_id, customer_id, start_time, end_time, total_price, status) "
+                         "VALUES (1, ?, ?, ?, 0, 'confirmed')",
+                         (tg, when.strftime(FMT), (when + timedelta(hours=1)).strftime(FMT)))
+
+    tables = ['users', 'admin_logs', 'bookings']
+    paths, _ = export.build(tables, fmt='csv', days=1)
+    try:
+        bad = 0
+        for table, path in zip(tables, paths):
+            with gzip.open(path, 'rt', encoding='utf-8-sig', newline='') as f:
+                rows = list(csv.DictReader(f, delimiter=';'))
+            ids = [r.get('telegram_id') or r.get('user_id') or r.get('customer_id') for r in rows]
+            ok = ids == ['1']
+            bad += not ok
+            print(f"  {table:<12} {'ok' if ok else 'FAILED'}: exported {ids}, expected ['1']")
+    finally:
+        export.cleanup(paths)
+    print(f"TIMEZONE={args.tz}, local day starts {midnight.strftime(FMT)} = {_utc(midnight)} UTC")
+    print("OK" if not bad else "FAILED")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    try:
+        code = main()
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+    sys.exit(code)
@@ -0,0 +1,229 @@
+"""
+Проверка тарифа: Tariff (utils.py) против прежнего calculate_price
+на случайных интервалах.
+
+    python check_tariff.py [--n 300000] [--seed 1]
+
+Эталон — ref_price ниже: calculate_price в том виде, в каком он был до
+Tariff (разбиение по датам и границам день/ночь, округление каждого куска
+через float-секунды), без изменений, кроме того, что тарифы берутся из
+переданного кортежа Tariff.config_values(), а не из config. С эталоном
+сверяются Tariff.price_us, calculate_price (с кэшем котировок) и
+calculate_prices — пачками меньше _NP_MIN_BATCH (по одной) и больше
+(векторно через Tariff.prices_np, если установлен numpy; иначе эта часть
+пропускается). Кроме тарифа из config проверяются сетки с другими
+границами ночи (не на целый час, ночь из одного куска).
+
+Интервалы: шаг TIME_STEP_MINUTES, произвольные секунды и микросекунды,
+концы в ±2 с от границ день/ночь (куски короче секунды), брони до 10
+суток, e <= s (цена 0). Код выхода 1 — есть расхождения.
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+
+import utils
+from utils import Tariff, calculate_price, calculate_prices, get_tariff
+
+VARIANTS = {
+    'night 22:30-06:15': ('22:30', '06:15'),
+    'night 23:00-07:00': ('23:00', '07:00'),
+    'night 20:00-00:00': ('20:00', '00:00'),
+}
+
+
+def ref_price(values: tuple, start, end):
+    """calculate_price до перехода на Tariff (эталон, не менять)."""
+    if isinstance(start, str):
+        start = datetime.fromisoformat(start)
+    if isinstance(end, str):
+        end = datetime.fromisoformat(end)
+
+    if end <= start:
+        return 0
+
+    (PRICE_TOTAL_BY_HOURS, EXTRA_HOUR_PRICE_AFTER_24,
+     NIGHT_START, NIGHT_END, NIGHT_MIN_PRICE, NIGHT_TOTAL_BY_HOURS) = values
+
+    def _hours_ceil(start: datetime, end: datetime) -> int:
+        seconds = (end - start).total_seconds()
+        if seconds <= 0:
+            return 0
+        return int((seconds + 3600 - 1) // 3600)
+
+    def _day_price(h: int) -> int:
+        h = int(max(0, h))
+        if h <= 0:
+            return 0
+        if h in PRICE_TOTAL_BY_HOURS:
+            return int(PRICE_TOTAL_BY_HOURS[h])
+        days = h // 24
+        rem = h % 24
+        total = days * int(PRICE_TOTAL_BY_HOURS[24])
+        if rem:
+            if rem in PRICE_TOTAL_BY_HOURS:
+                total += int(PRICE_TOTAL_BY_HOURS[rem])
+            else:
+                total += rem * int(EXTRA_HOUR_PRICE_AFTER_24)
+        return int(total)
+
+    def _night_price(h: int) -> int:
+        h = int(max(0, h))
+        if h <= 0:
+            return 0
+        if h <= 10:
+            return int(NIGHT_MIN_PRICE)
+        if h in NIGHT_TOTAL_BY_HOURS:
+            return int(NIGHT_TOTAL_BY_HOURS[h])
+        return int(NIGHT_TOTAL_BY_HOURS.get(12, NIGHT_MIN_PRICE))
+
+    def _parse_hm(s: str):
+        hh, mm = map(int, s.split(":"))
+        return hh, mm
+
+    ns_h, ns_m = _parse_hm(NIGHT_START)
+    ne_h, ne_m = _parse_hm(NIGHT_END)
+
+    boundaries = []
+    start_date = start.date()
+    end_date = end.date()
+    d = start_date
+    while d <= end_date:
+        b1 = datetime(d.year, d.month, d.day, ne_h, ne_m)
+        b2 = datetime(d.year, d.month, d.day, ns_h, ns_m)
+        if start < b1 < end:
+            boundaries.append(b1)
+        if start < b2 < end:
+            boundaries.append(b2)
+        d += timedelta(days=1)
+
+    boundaries.sort()
+    points = [start] + boundaries + [end]
+
+    day_hours = 0
+    night_segments_hours: list[int] = []
+
+    def _is_night(dt: datetime) -> bool:
+        t = dt.time()
+        return (t.hour, t.minute) >= (ns_h, ns_m) or (t.hour, t.minute) < (ne_h, ne_m)
+
+    for a, b in zip(points, points[1:]):
+        if b <= a:
+            continue
+        h = _hours_ceil(a, b)
+        if h <= 0:
+            continue
+        if _is_night(a):
+            night_segments_hours.append(h)
+        else:
+            day_hours += h
+
+    total_night_hours = sum(night_segments_hours)
+    mixed = day_hours > 0 and total_night_hours > 0
+
+    total = _day_price(day_hours)
+    for h in night_segments_hours:
+        p = _night_price(h)
+        if mixed:
+            p = max(int(NIGHT_MIN_PRICE), p)
+        total += p
+
+    return int(total)
+
+
+def _intervals(n: int, rnd: random.Random, bounds: list[int], step: int) -> list[tuple[datetime, datetime]]:
+    base = datetime(2025, 1, 1)
+    out = []
+    for i in range(n):
+        kind = i % 5
+        day = base + timedelta(days=rnd.randrange(730))
+        if kind == 0:       # как в боте: по шагу сетки
+            start = day + timedelta(minutes=rnd.randrange(1440 // step) * step)
+            end = start + timedelta(minutes=rnd.randrange(1, 48 * 60 // step) * step)
+        elif kind == 1:     # произвольные секунды и микросекунды
+            start = day + timedelta(microseconds=rnd.randrange(86_400_000_000))
+            end = start + timedelta(microseconds=rnd.randrange(1, 72 * 3_600_000_000))
+        elif kind == 2:     # концы около границ день/ночь: куски короче секунды
+            b = day + timedelta(minutes=rnd.choice(bounds))
+            start = b + timedelta(microseconds=rnd.randrange(-2_000_000, 2_000_000))
+            b2 = b + timedelta(minutes=rnd.choice(bounds) + 1440 * rnd.randrange(3))
+            end = b2 + timedelta(microseconds=rnd.randrange(-2_000_000, 2_000_000))
+        elif kind == 3:     # длинные брони, больше суток
+            start = day + timedelta(seconds=rnd.randrange(86_400))
+            end = start + timedelta(seconds=rnd.randrange(24 * 3600, 10 * 86_400))
+        else:               # e <= s и почти нулевые
+            start = day + timedelta(microseconds=rnd.randrange(86_400_000_000))
+            end = start + timedelta(microseconds=rnd.randrange(-3_600_000_000, 3))
+        out.append((start, end))
+    return out
+
+
+def _us(start: datetime, end: datetime) -> tuple[int, int, int]:
+    return ((start - utils._EPOCH) // utils._US, (end - utils._EPOCH) // utils._US,
+            start.hour * 60 + start.minute)
+
+
+def _report(name: str, pairs, expected, got) -> int:
+    bad = [(p, x, y) for p, x, y in zip(pairs, expected, got) if x != y]
+    status = "ok" if not bad else f"{len(bad)} MISMATCHES"
+    print(f"  {name:<34} {len(pairs):>8}  {status}")
+    for (s, e), x, y in bad[:5]:
+        print(f"    {s.isoformat()} → {e.isoformat()}: expected {x}, got {y}")
+    return len(bad)
+
+
+def check(values: tuple, pairs, with_cache: bool) -> int:
+    t = Tariff(*values)
+    expected = [ref_price(values, s, e) for s, e in pairs]
+    bad = _report("Tariff.price_us", pairs, expected,
+                  [t.price_us(*_us(s, e)) if e > s else 0 for s, e in pairs])
+    if utils._np is not None:
+        np = utils._np
+        cols = list(zip(*(_us(s, e) for s, e in pairs)))
+        got = t.prices_np(*(np.array(c, dtype=np.int64) for c in cols)).tolist()
+        bad += _report("Tariff.prices_np", pairs, expected, got)
+    if not with_cache:
+        return bad
+    # calculate_price / calculate_prices считают тарифом из config
+    bad += _report("calculate_price", pairs, expected, [calculate_price(s, e) for s, e in pairs])
+    bad += _report("calculate_price (iso strings)", pairs[:2000], expected[:2000],
+                   [calculate_price(s.isoformat(), e.isoformat()) for s, e in pairs[:2000]])
+    small = utils._NP_MIN_BATCH - 1
+    got = []
+    for i in range(0, len(pairs), small):
+        got += calculate_prices(pairs[i:i + small])
+    bad += _report(f"calculate_prices (по {small})", pairs, expected, got)
+    if utils._np is not None:
+        got = []
+        for i in range(0, len(pairs), 500):
+            got += calculate_prices(pairs[i:i + 500])
+        bad += _report("calculate_prices (numpy, по 500)", pairs, expected, got)
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=300_000, help="интервалов на тариф из config")
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    from config import TIME_STEP_MINUTES
+    rnd = random.Random(args.seed)
+    if utils._np is None:
+        print("numpy не установлен — Tariff.prices_np и векторный calculate_prices пропущены")
+
+    values = Tariff.config_values()
+    t = get_tariff()
+    print(f"config: night {values[2]}-{values[3]}")
+    bad = check(values, _intervals(args.n, rnd, t.bounds, TIME_STEP_MINUTES), with_cache=True)
+    for name, (ns, ne) in VARIANTS.items():
+        v = values[:2] + (ns, ne) + values[4:]
+        print(name)
+        bad += check(v, _intervals(args.n // 5, rnd, Tariff(*v).bounds, TIME_STEP_MINUTES), with_cache=False)
+    print("OK" if not bad else f"FAILED: {bad} mismatches")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
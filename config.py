@@ -26,10 +26,97 @@ MIN_BOOKING_MINUTES = int(os.getenv("MIN_BOOKING_MINUTES", "30"))
 AVAILABILITY_LOOKAHEAD_DAYS = int(os.getenv("AVAILABILITY_LOOKAHEAD_DAYS", "7"))
 EXPIRED_CLEANUP_DAYS = int(os.getenv("EXPIRED_CLEANUP_DAYS", "30"))
 EXPIRE_CHECK_INTERVAL_SECONDS = int(os.getenv("EXPIRE_CHECK_INTERVAL_SECONDS", "60"))
+# Планировщик: напоминание за N минут до начала брони; редкая уборка/страховочный
+# проход (истечение, разбан) — дедлайны срабатывают точно, без опроса.
+REMINDER_BEFORE_MINUTES = int(os.getenv("REMINDER_BEFORE_MINUTES", "60"))
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+
+# ===== Доставка апдейтов (webhook.py) =====
+# WEBHOOK_URL задан (https://bot.example.com) — режим вебхука, иначе long polling.
+# Сервер слушает WEBAPP_HOST:WEBAPP_PORT, наружу — через reverse proxy с TLS.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет X-Telegram-Bot-Api-Secret-Token (A-Z a-z 0-9 _ -); пусто — случайный на каждый запуск
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# Параллельных соединений от Telegram; апдейтов в обработке одновременно
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+# Апдейтов в обработке одновременно (разные чаты); внутри чата — строго по одному
+UPDATE_MAX_CONCURRENCY = int(os.getenv("UPDATE_MAX_CONCURRENCY", "64"))
+
+# Метрики (metrics.py): Prometheus-эндпоинт http://METRICS_HOST:METRICS_PORT/metrics, 0 — выключить
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+# Трассировка (tracing.py): апдейт дольше TRACE_SLOW_MS пишется в лог деревом спанов
+# (БД / Telegram / очередь чата / остальное); 0 — выключить. Спанов на апдейт не больше TRACE_MAX_SPANS.
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200"))
+TRACE_KEEP_SLOW = int(os.getenv("TRACE_KEEP_SLOW", "10"))
+
+# ===== Исходящие сообщения (outbound.py) =====
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1 сообщение/с в один чат.
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "30"))
+OUTBOUND_CHAT_INTERVAL = float(os.getenv("OUTBOUND_CHAT_INTERVAL", "1.0"))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+# Повторы при сетевых ошибках/5xx (RetryAfter повторяется всегда)
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+# Рассылки: получателей за одну пачку, как часто обновлять прогресс (сек)
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "200"))
+BROADCAST_PROGRESS_SECONDS = float(os.getenv("BROADCAST_PROGRESS_SECONDS", "5"))
+
+# ===== БД: пул соединений и PRAGMA =====
+# Соединения SQLite переиспользуются, PRAGMA выставляются один раз на соединение.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "30000"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+# cache_size в KiB (в PRAGMA уходит отрицательным числом), mmap_size в байтах
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+# Потоки для чтения в db_async (плюс один поток-писатель). Должно быть < DB_POOL_SIZE.
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "4"))
+# Индекс свободных слотов в памяти (поиск и проверка пересечений без запросов к SQLite).
+AVAILABILITY_INDEX = os.getenv("AVAILABILITY_INDEX", "True").lower() in ("true", "1", "yes")
+# Схема с INTEGER-колонками времени (минуты от эпохи по локальным часам TIMEZONE):
+# init_database добавляет их, заполняет порциями и дальше фильтры идут по ним.
+DB_EPOCH_MINUTES = os.getenv("DB_EPOCH_MINUTES", "False").lower() in ("true", "1", "yes")
+DB_MIGRATION_BATCH = int(os.getenv("DB_MIGRATION_BATCH", "5000"))
+# LRU-кэш пользователей (строки users по id/telegram_id). 0 — выключить.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+# Поиск мест: слотов на одной странице (дальше — кнопки листания)
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+# Выгрузка (export.py): строк за одно чтение курсора
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+# FSM-состояния в SQLite (fsm_storage.py): изменения пишутся пачкой раз в FSM_FLUSH_SECONDS,
+# состояния без изменений дольше FSM_TTL_HOURS удаляются, в памяти — до FSM_CACHE_SIZE ключей
+FSM_FLUSH_SECONDS = float(os.getenv("FSM_FLUSH_SECONDS", "2"))
+FSM_TTL_HOURS = float(os.getenv("FSM_TTL_HOURS", "72"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "5000"))
+# Резервные копии (backup.py): снимок каждые BACKUP_INTERVAL_HOURS (0 — только вручную),
+# хранить последние BACKUP_KEEP. Копирование порциями страниц с паузой между шагами.
+BACKUP_DIR = os.getenv("BACKUP_DIR", "data/backups")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "True").lower() in ("true", "1", "yes")
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.01"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
 
 MAX_SPOTS_PER_USER = 10
 MAX_ACTIVE_BOOKINGS = 5
 MIN_ACTION_INTERVAL = 1
+# Анти-флуд (ThrottlingMiddleware): обычные действия — в среднем раз в MIN_ACTION_INTERVAL с,
+# подряд до THROTTLE_BURST; тяжёлые (поиск, выгрузка, рассылка, статистика) — раз в
+# THROTTLE_EXPENSIVE_INTERVAL с, подряд до THROTTLE_EXPENSIVE_BURST. Повторный тап той же
+# кнопки в течение THROTTLE_DUPLICATE_SECONDS игнорируется. Учёт — для THROTTLE_MAX_USERS
+# последних пользователей.
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+THROTTLE_EXPENSIVE_INTERVAL = float(os.getenv("THROTTLE_EXPENSIVE_INTERVAL", "3"))
+THROTTLE_EXPENSIVE_BURST = int(os.getenv("THROTTLE_EXPENSIVE_BURST", "2"))
+THROTTLE_DUPLICATE_SECONDS = float(os.getenv("THROTTLE_DUPLICATE_SECONDS", "1.5"))
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "10000"))
 
 # ===== ТАРИФЫ: итоговая цена за N часов (как в ТЗ) =====
 # ключ = количество часов, значение = итоговая цена
@@ -79,6 +166,9 @@ NIGHT_TOTAL_BY_HOURS = {
     12: 700,
 }
 
+# Кэш котировок (utils.calculate_price): сколько пар (время начала, длительность) помнить
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "4096"))
+
 # ===== ПРИВЕТСТВИЕ =====
 WELCOME_TEXT = (
     "Привет 👋 Здесь Вы можете арендовать место на паркинге у собственника. "
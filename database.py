@@ -1,36 +1,311 @@
 """
 БД ParkingBot — SQLite + WAL
 """
-import sqlite3, json, logging, os
+import sqlite3, json, logging, os, threading, time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from contextlib import contextmanager
-from config import DATABASE_PATH
-from utils import normalize_dt, now_local, calculate_price
+from config import (DATABASE_PATH, DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS, DB_SYNCHRONOUS,
+                    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, AVAILABILITY_INDEX,
+                    DB_EPOCH_MINUTES, DB_MIGRATION_BATCH, USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS,
+                    SEARCH_PAGE_SIZE)
+from utils import normalize_dt, now_local, calculate_price, to_epoch_min
+from availability_index import index as _avail_index, to_key as _avail_key
 
 logger = logging.getLogger(__name__)
-_wal_set = False
+
+
+# ==================== CONNECTION POOL ====================
+class _Connection(sqlite3.Connection):
+    # TEMP-триггеры (индекс слотов, кэш пользователей) ставятся, когда таблицы уже есть
+    hooks = False
+
+
+class _ConnectionPool:
+    """Ограниченный пул соединений SQLite.
+
+    Соединение создаётся один раз (makedirs, row_factory, PRAGMA) и дальше
+    только выдаётся/возвращается. Если все size соединений заняты — ждём
+    освобождения; время ожидания попадает в статистику.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, int(size))
+        self._idle: list[sqlite3.Connection] = []
+        self._cond = threading.Condition()
+        self._created = 0
+        self._stats = {'checkouts': 0, 'waits': 0, 'wait_total_ms': 0.0,
+                       'wait_max_ms': 0.0, 'discarded': 0}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, factory=_Connection)
+        conn.row_factory = sqlite3.Row
+        conn.create_function('idx_touch', 2, _idx_touch)
+        for pragma in (
+            "PRAGMA journal_mode=WAL",
+            f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}",
+            f"PRAGMA synchronous={DB_SYNCHRONOUS}",
+            f"PRAGMA cache_size={-abs(int(DB_CACHE_SIZE_KB))}",
+            f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}",
+        ):
+            try:
+                conn.execute(pragma)
+            except sqlite3.Error as e:
+                logger.warning(f"{pragma}: {e}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        t0 = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                waited = True
+                self._cond.wait()
+            self._stats['checkouts'] += 1
+            if waited:
+                ms = (time.perf_counter() - t0) * 1000
+                self._stats['waits'] += 1
+                self._stats['wait_total_ms'] += ms
+                self._stats['wait_max_ms'] = max(self._stats['wait_max_ms'], ms)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        with self._cond:
+            if broken:
+                self._created -= 1
+                self._stats['discarded'] += 1
+                try: conn.close()
+                except Exception: pass
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            for conn in self._idle:
+                try: conn.close()
+                except Exception: pass
+            self._created -= len(self._idle)
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        with self._cond:
+            s = dict(self._stats)
+            s.update(size=self.size, created=self._created, idle=len(self._idle),
+                     in_use=self._created - len(self._idle))
+        s['wait_avg_ms'] = s['wait_total_ms'] / s['waits'] if s['waits'] else 0.0
+        return s
+
+
+_pool: _ConnectionPool | None = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_pool() -> _ConnectionPool:
+    global _pool
+    if _pool is None or _pool.path != DATABASE_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DATABASE_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = _ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
+    return _pool
+
 
 @contextmanager
 def get_connection():
-    global _wal_set
-    os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
-    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
-    conn.row_factory = sqlite3.Row
-    if not _wal_set:
-        try:
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA busy_timeout=30000")
-            _wal_set = True
-        except: pass
+    """Соединение из пула; commit при успехе, rollback при ошибке.
+
+    Вложенный get_connection() в том же потоке получает то же соединение и
+    работает в транзакции внешнего блока (commit/rollback делает внешний).
+    Поэтому внутри блока нельзя делать await — иначе другая корутина того же
+    потока попадёт в чужую транзакцию.
+    """
+    held = getattr(_local, 'conn', None)
+    if held is not None:
+        yield held
+        return
+    pool = _get_pool()
+    conn = pool.acquire()
+    if not conn.hooks:
+        _install_hooks(conn)
+    _local.conn = conn
+    _local.touched = set()
+    _local.events = []
+    broken = False
     try:
         yield conn
         conn.commit()
+        if _local.touched:
+            _after_commit(conn, _local.touched)
+        if _local.events:
+            _dispatch(_local.events)
     except Exception as e:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            broken = True
         logger.error(f"DB error: {e}")
         raise
     finally:
-        conn.close()
+        _local.conn = None
+        _local.touched = set()
+        _local.events = []
+        pool.release(conn, broken=broken)
+
+
+def get_pool_stats() -> dict:
+    """Размер пула, занятые/свободные соединения, ожидания (кол-во, среднее/макс. мс)."""
+    return _get_pool().stats()
+
+
+def close_pool():
+    """Закрывает свободные соединения пула (при остановке бота)."""
+    if _pool is not None:
+        _pool.close()
+
+
+# ==================== AFTER-COMMIT HOOKS ====================
+# Любое изменение spot_availability / parking_spots / данных поставщика / броней
+# отмечается TEMP-триггером (idx_touch) в наборе текущего потока; после
+# коммита затронутые места перечитываются в availability_index, а записи
+# кэша пользователей сбрасываются. При откате набор просто выбрасывается.
+_INDEX_TRIGGERS = (
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_sa_ins AFTER INSERT ON main.spot_availability"
+    " BEGIN SELECT idx_touch('s', NEW.spot_id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_sa_upd AFTER UPDATE ON main.spot_availability"
+    " BEGIN SELECT idx_touch('s', OLD.spot_id); SELECT idx_touch('s', NEW.spot_id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_sa_del AFTER DELETE ON main.spot_availability"
+    " BEGIN SELECT idx_touch('s', OLD.spot_id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_ps_ins AFTER INSERT ON main.parking_spots"
+    " BEGIN SELECT idx_touch('s', NEW.id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_ps_upd AFTER UPDATE ON main.parking_spots"
+    " BEGIN SELECT idx_touch('s', OLD.id); SELECT idx_touch('s', NEW.id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_ps_del AFTER DELETE ON main.parking_spots"
+    " BEGIN SELECT idx_touch('s', OLD.id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _idx_u_upd AFTER UPDATE OF full_name, card_number, bank ON main.users"
+    " BEGIN SELECT idx_touch('u', NEW.id); END",
+)
+# Счётчик активных броней в кэше пользователей: статусы броней меняются
+# во многих местах (в т.ч. сырым SQL), поэтому тоже через триггеры.
+_CACHE_TRIGGERS = (
+    "CREATE TEMP TRIGGER IF NOT EXISTS _uc_bk_ins AFTER INSERT ON main.bookings"
+    " BEGIN SELECT idx_touch('ac', NEW.customer_id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _uc_bk_upd AFTER UPDATE OF status, customer_id ON main.bookings"
+    " BEGIN SELECT idx_touch('ac', OLD.customer_id); SELECT idx_touch('ac', NEW.customer_id); END",
+    "CREATE TEMP TRIGGER IF NOT EXISTS _uc_bk_del AFTER DELETE ON main.bookings"
+    " BEGIN SELECT idx_touch('ac', OLD.customer_id); END",
+)
+
+
+def _idx_touch(kind, oid):
+    touched = getattr(_local, 'touched', None)
+    if touched is not None and oid is not None:
+        touched.add((kind, oid))
+
+
+def _install_hooks(conn):
+    """Ставит TEMP-триггеры на соединение (до init_database таблиц ещё нет — пропускаем)."""
+    try:
+        have = {r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+            " AND name IN ('spot_availability','parking_spots','users','bookings')")}
+        if len(have) < 4:
+            return
+        for sql in (_INDEX_TRIGGERS if AVAILABILITY_INDEX else ()) + _CACHE_TRIGGERS:
+            conn.execute(sql)
+        conn.hooks = True
+    except sqlite3.Error as e:
+        logger.warning(f"availability index hooks: {e}")
+
+
+def _touch(kind, oid):
+    """Отметить изменение для обработки после коммита внешней транзакции."""
+    _idx_touch(kind, oid)
+
+
+def _after_commit(conn, touched):
+    users = [i for k, i in touched if k == 'uc']
+    if users:
+        _user_cache.invalidate(users)
+    customers = [i for k, i in touched if k == 'ac']
+    if customers:
+        _user_cache.invalidate_active(customers)
+    if any(k in ('s', 'u') for k, _ in touched):
+        _refresh_index(conn, touched)
+
+
+def _refresh_index(conn, touched):
+    try:
+        _avail_index.refresh(conn,
+                             spot_ids=[i for k, i in touched if k == 's'],
+                             supplier_ids=[i for k, i in touched if k == 'u'])
+    except Exception as e:
+        # Индекс мог разойтись с БД — до пересборки отвечает SQLite
+        logger.error(f"availability index refresh: {e}")
+        _avail_index.reset()
+
+
+def _index_ready() -> bool:
+    """Индекс включён и загружен; при необходимости пересобирает его."""
+    if not AVAILABILITY_INDEX:
+        return False
+    if not _avail_index.ready:
+        try:
+            with get_connection() as conn:
+                if conn.hooks:
+                    _avail_index.rebuild(conn)
+        except Exception as e:
+            logger.error(f"availability index rebuild: {e}")
+    return _avail_index.ready
+
+
+def get_availability_index_stats() -> dict:
+    return _avail_index.stats()
+
+
+# ==================== EVENTS ====================
+# Подписчики узнают о закоммиченных изменениях (планировщик, уведомления).
+# Колбэк вызывается синхронно в потоке, который делал запись, — он должен
+# быть быстрым и сам передавать работу в event loop.
+#   booking_changed(bid)                    — бронь создана/подтверждена/перенесена
+#   user_banned(user_id, banned_until)      — бан с датой окончания
+_subscribers: dict[str, list] = {}
+
+
+def subscribe(event: str, fn):
+    _subscribers.setdefault(event, []).append(fn)
+
+
+def _emit(event: str, *args):
+    """Событие уйдёт подписчикам после коммита внешней транзакции (при откате — нет)."""
+    events = getattr(_local, 'events', None)
+    if events is None:
+        _dispatch([(event, args)])
+    else:
+        events.append((event, args))
+
+
+def _dispatch(events):
+    for event, args in events:
+        for fn in _subscribers.get(event, ()):
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"event {event} subscriber: {e}")
 
 def _log(cursor, action, user_id=None, spot_id=None, booking_id=None, details=None):
     try:
@@ -139,27 +414,312 @@ def init_database():
             created_at TEXT NOT NULL
         )''')
 
-        for idx in [
-            'CREATE INDEX IF NOT EXISTS idx_u_tg ON users(telegram_id)',
-            'CREATE INDEX IF NOT EXISTS idx_sp_sup ON parking_spots(supplier_id)',
-            'CREATE INDEX IF NOT EXISTS idx_sa_sp ON spot_availability(spot_id)',
-            'CREATE INDEX IF NOT EXISTS idx_sa_bk ON spot_availability(is_booked)',
-            'CREATE INDEX IF NOT EXISTS idx_bk_cust ON bookings(customer_id)',
-            'CREATE INDEX IF NOT EXISTS idx_bk_st ON bookings(status)',
-        ]: c.execute(idx)
+        # Рассылки: курсор по users.id, чтобы продолжить после рестарта без повторов
+        c.execute('''CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target TEXT NOT NULL DEFAULT 'all', text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            admin_chat_id INTEGER, message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, finished_at TIMESTAMP)''')
+
+        # FSM-состояния aiogram (fsm_storage.SQLiteStorage): переживают рестарт бота
+        c.execute('''CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL)''')
+
+        _ensure_indexes(c, INDEXES)
+        _install_stats(c)
         logger.info("Database initialized")
+    if DB_EPOCH_MINUTES:
+        _migrate_epoch_minutes()
+    _user_cache.invalidate()
+    for w in check_query_plans():
+        logger.warning(w)
+    if AVAILABILITY_INDEX:
+        _avail_index.reset()
+        if _index_ready():
+            logger.info(f"Availability index loaded: {_avail_index.stats()}")
+
+
+# ==================== INDEXES ====================
+# Управляемый набор индексов под реальные формы запросов. Всё, что в списке
+# OBSOLETE_INDEXES, при старте удаляется: одиночные индексы, перекрытые
+# составными, только замедляют запись.
+INDEXES = {
+    'idx_sp_sup': 'parking_spots(supplier_id)',
+    # слоты места: spot_id=? AND is_booked=? AND end_time>?
+    'idx_sa_spot': 'spot_availability(spot_id, is_booked, end_time)',
+    # общий поиск свободных слотов: по концу (ещё не закончились) и по началу (ближайшие)
+    'idx_sa_free_end': 'spot_availability(end_time) WHERE is_booked=0',
+    'idx_sa_free_start': 'spot_availability(start_time) WHERE is_booked=0',
+    # чистка устаревших FSM-состояний: updated_at < ?
+    'idx_fsm_updated': 'fsm_states(updated_at)',
+    # истечение неоплаченных: status='pending' AND payment_status=? AND created_at<=?
+    'idx_bk_pending': "bookings(payment_status, created_at) WHERE status='pending'",
+    # напоминания и счётчики по статусу: status=? AND start_time BETWEEN ...
+    'idx_bk_status_start': 'bookings(status, start_time)',
+    # активные брони пользователя: customer_id=? AND status IN (...)
+    'idx_bk_cust_status': 'bookings(customer_id, status)',
+}
+EPOCH_INDEXES = {
+    'idx_sa_spot_end_min': 'spot_availability(spot_id, is_booked, end_min)',
+    'idx_sa_free_end_min': 'spot_availability(end_min) WHERE is_booked=0',
+    'idx_sa_free_start_min': 'spot_availability(start_min) WHERE is_booked=0',
+    'idx_bk_status_start_min': 'bookings(status, start_min)',
+}
+OBSOLETE_INDEXES = (
+    'idx_u_tg',         # дублирует UNIQUE(telegram_id)
+    'idx_sa_sp', 'idx_sa_bk', 'idx_bk_cust', 'idx_bk_st',
+    'idx_sa_spot_min', 'idx_sa_start_min', 'idx_bk_start_min',
+)
+
+# Горячие запросы для самопроверки: (имя, таблица, которую нельзя сканировать целиком, SQL, параметры)
+HOT_QUERIES = [
+    ('expire_unpaid_bookings', 'b',
+     """SELECT b.id FROM bookings b JOIN users u ON b.customer_id=u.id
+        WHERE b.status='pending' AND b.payment_status='unpaid' AND b.created_at <= ?""", ('',)),
+    ('booking_reminders', 'b',
+     "SELECT b.id FROM bookings b WHERE b.status = 'confirmed' AND b.start_time BETWEEN ? AND ?", ('', '')),
+    ('active_bookings_count', 'bookings',
+     "SELECT COUNT(*) FROM bookings WHERE customer_id=? AND status IN ('pending','confirmed')", (0,)),
+    ('spot_availabilities', 'spot_availability',
+     "SELECT * FROM spot_availability WHERE spot_id=? AND is_booked=0 AND end_time>? ORDER BY start_time ASC", (0, '')),
+    ('available_slots', 'sa',
+     """SELECT sa.* FROM spot_availability sa JOIN parking_spots ps ON sa.spot_id = ps.id
+        WHERE sa.is_booked = 0 AND ps.is_available = 1 AND sa.end_time > ?""", ('',)),
+    ('nearest_free_slots', 'sa',
+     """SELECT sa.id FROM spot_availability sa JOIN parking_spots ps ON sa.spot_id = ps.id
+        WHERE sa.is_booked=0 AND ps.is_available=1 AND sa.start_time >= ? AND sa.start_time <= ?
+        ORDER BY sa.start_time ASC LIMIT 10""", ('', '')),
+]
+EPOCH_HOT_QUERIES = [
+    ('booking_reminders_min', 'b',
+     "SELECT b.id FROM bookings b WHERE b.status = 'confirmed' AND b.start_min BETWEEN ? AND ?", (0, 0)),
+    ('spot_availabilities_min', 'spot_availability',
+     "SELECT * FROM spot_availability WHERE spot_id=? AND is_booked=0 AND end_min>? ORDER BY start_min ASC", (0, 0)),
+    ('available_slots_min', 'sa',
+     """SELECT sa.* FROM spot_availability sa JOIN parking_spots ps ON sa.spot_id = ps.id
+        WHERE sa.is_booked = 0 AND ps.is_available = 1 AND sa.end_min > ? AND sa.start_min < ?""", (0, 0)),
+]
+
+
+def _ensure_indexes(c, indexes: dict):
+    for name, spec in indexes.items():
+        c.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {spec}")
+    for name in OBSOLETE_INDEXES:
+        if name not in indexes:
+            c.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def explain(sql: str, params=()) -> list[str]:
+    """Строки EXPLAIN QUERY PLAN (поле detail)."""
+    with get_connection() as conn:
+        return [r['detail'] for r in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check_query_plans() -> list[str]:
+    """Проверяет планы горячих запросов; возвращает предупреждения о полном
+    сканировании таблицы (SCAN без USING INDEX)."""
+    warnings = []
+    for name, table, sql, params in HOT_QUERIES + (EPOCH_HOT_QUERIES if _EPOCH_COLS else []):
+        try:
+            plan = explain(sql, params)
+        except sqlite3.Error as e:
+            warnings.append(f"query plan {name}: {e}")
+            continue
+        for detail in plan:
+            if detail == f'SCAN {table}':
+                warnings.append(f"query plan {name}: full scan of {table} ({'; '.join(plan)})")
+    return warnings
+
+
+# ==================== EPOCH MINUTES ====================
+# Версия схемы (PRAGMA user_version), с которой у интервалов есть INTEGER-колонки
+# *_min = минуты от 1970-01-01 по локальным часам. Текстовые колонки остаются
+# источником правды: *_min поддерживаются триггерами на любой INSERT/UPDATE,
+# поэтому старый код и выключение DB_EPOCH_MINUTES их не ломают.
+SCHEMA_EPOCH_MINUTES = 1
+_EPOCH_COLS = False   # колонки заполнены и включены в config — фильтруем по ним
+
+_MIN = "CAST(strftime('%s', {}) AS INTEGER) / 60"
+_EPOCH_MIGRATION = (
+    ('spot_availability', ('start_time', 'end_time')),
+    ('bookings', ('start_time', 'end_time')),
+    ('users', ('banned_until',)),
+)
+
+
+def _min_col(col: str) -> str:
+    return col.replace('_time', '') + '_min' if col.endswith('_time') else col + '_min'
+
+
+def _migrate_epoch_minutes():
+    """Онлайн-миграция на INTEGER-минуты: колонки, триггеры, заполнение порциями."""
+    global _EPOCH_COLS
+    with get_connection() as conn:
+        c = conn.cursor()
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        for table, cols in _EPOCH_MIGRATION:
+            for col in cols:
+                try: c.execute(f"ALTER TABLE {table} ADD COLUMN {_min_col(col)} INTEGER")
+                except sqlite3.OperationalError: pass
+            sets = ', '.join(f"{_min_col(col)} = {_MIN.format('NEW.' + col)}" for col in cols)
+            c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_min_ins AFTER INSERT ON {table}
+                          BEGIN UPDATE {table} SET {sets} WHERE id = NEW.id; END""")
+            c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_min_upd AFTER UPDATE OF {', '.join(cols)} ON {table}
+                          BEGIN UPDATE {table} SET {sets} WHERE id = NEW.id; END""")
+        _ensure_indexes(c, EPOCH_INDEXES)
+
+    if version < SCHEMA_EPOCH_MINUTES:
+        # Заполняем существующие строки короткими транзакциями, чтобы не держать
+        # блокировку записи на всю таблицу.
+        for table, cols in _EPOCH_MIGRATION:
+            sets = ', '.join(f"{_min_col(col)} = {_MIN.format(col)}" for col in cols)
+            last_id, total = 0, 0
+            while True:
+                with get_connection() as conn:
+                    ids = [r[0] for r in conn.execute(
+                        f"SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, DB_MIGRATION_BATCH)).fetchall()]
+                    if not ids:
+                        break
+                    conn.execute(f"UPDATE {table} SET {sets} WHERE id BETWEEN ? AND ?", (ids[0], ids[-1]))
+                last_id, total = ids[-1], total + len(ids)
+            logger.info(f"Epoch minutes: {table} backfilled ({total} rows)")
+        with get_connection() as conn:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_EPOCH_MINUTES}")
+    _EPOCH_COLS = True
+
+
+# ==================== USER CACHE ====================
+class _UserCache:
+    """LRU-кэш строк users с TTL, ключи — id и telegram_id.
+
+    Сбрасывается после коммита изменений пользователя (см. _touch('uc', id)).
+    Чтение, начатое до сброса, свой результат в кэш не кладёт (generation),
+    поэтому старая строка не может «пережить» инвалидацию.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._rows: OrderedDict[int, list] = OrderedDict()   # id → [expires, row, active_bookings]
+        self._by_tid: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, uid=None, tid=None):
+        now = time.monotonic()
+        with self._lock:
+            if uid is None:
+                uid = self._by_tid.get(tid)
+            entry = self._rows.get(uid) if uid is not None else None
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._drop(uid)
+                self._stats['misses'] += 1
+                return None
+            self._rows.move_to_end(uid)
+            self._stats['hits'] += 1
+            return dict(entry[1])
+
+    def get_active(self, uid):
+        """Закэшированное число активных броней пользователя или None."""
+        with self._lock:
+            entry = self._rows.get(uid)
+            if entry is None or entry[2] is None or entry[0] < time.monotonic():
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return entry[2]
+
+    def put_active(self, uid, count: int, generation: int):
+        with self._lock:
+            entry = self._rows.get(uid)
+            if entry is not None and generation == self.generation:
+                entry[2] = count
+
+    def invalidate_active(self, uids):
+        with self._lock:
+            self.generation += 1
+            for uid in uids:
+                entry = self._rows.get(uid)
+                if entry is not None:
+                    entry[2] = None
+
+    def put(self, row: dict, generation: int):
+        if self.size <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._drop(row['id'])
+            self._rows[row['id']] = [time.monotonic() + self.ttl, dict(row), None]
+            self._by_tid[row['telegram_id']] = row['id']
+            while len(self._rows) > self.size:
+                self._drop(next(iter(self._rows)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, uids=('*',)):
+        with self._lock:
+            self.generation += 1
+            self._stats['invalidations'] += 1
+            if '*' in uids:
+                self._rows.clear()
+                self._by_tid.clear()
+                return
+            for uid in uids:
+                self._drop(uid)
+
+    def _drop(self, uid):
+        entry = self._rows.pop(uid, None)
+        if entry is not None:
+            self._by_tid.pop(entry[1]['telegram_id'], None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats, size=len(self._rows), capacity=self.size, ttl=self.ttl)
+        total = s['hits'] + s['misses']
+        s['hit_rate'] = s['hits'] / total if total else 0.0
+        return s
+
+
+_user_cache = _UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+
+def get_user_cache_stats() -> dict:
+    return _user_cache.stats()
+
+
+def _cached_user(sql, key, uid=None, tid=None):
+    # Внутри транзакции кэш не используем: там могут быть ещё не закоммиченные изменения
+    if getattr(_local, 'conn', None) is not None:
+        with get_connection() as conn:
+            r = conn.cursor().execute(sql, (key,)).fetchone()
+            return dict(r) if r else None
+    u = _user_cache.get(uid=uid, tid=tid)
+    if u is not None:
+        return u
+    generation = _user_cache.generation
+    with get_connection() as conn:
+        r = conn.cursor().execute(sql, (key,)).fetchone()
+    if not r:
+        return None
+    u = dict(r)
+    _user_cache.put(u, generation)
+    return u
 
 
 # ==================== USERS ====================
 def get_user_by_telegram_id(tid):
-    with get_connection() as conn:
-        r = conn.cursor().execute('SELECT * FROM users WHERE telegram_id=?',(tid,)).fetchone()
-        return dict(r) if r else None
+    return _cached_user('SELECT * FROM users WHERE telegram_id=?', tid, tid=tid)
 
 def get_user_by_id(uid):
-    with get_connection() as conn:
-        r = conn.cursor().execute('SELECT * FROM users WHERE id=?',(uid,)).fetchone()
-        return dict(r) if r else None
+    return _cached_user('SELECT * FROM users WHERE id=?', uid, uid=uid)
 
 def create_user(telegram_id, username, full_name, phone, card_number='', bank=''):
     with get_connection() as conn:
@@ -167,6 +727,7 @@ def create_user(telegram_id, username, full_name, phone, card_number='', bank=''
         c.execute('INSERT INTO users (telegram_id,username,full_name,phone,card_number,bank) VALUES (?,?,?,?,?,?)',
                   (telegram_id, username, full_name, phone, card_number, bank))
         uid = c.lastrowid
+        _touch('uc', uid)
         _log(c, 'user_registered', user_id=uid, details=json.dumps({'name':full_name,'phone':phone}))
         return uid
 
@@ -177,6 +738,9 @@ def update_user(user_id, **kw):
     if not u: return False
     s = ', '.join(f"{k}=?" for k in u)
     with get_connection() as conn:
+        _touch('uc', user_id)
+        if u.get('banned_until'):
+            _emit('user_banned', user_id, u['banned_until'])
         return conn.cursor().execute(f'UPDATE users SET {s} WHERE id=?', list(u.values())+[user_id]).rowcount > 0
 
 def user_has_car_info(u): return bool(u.get('license_plate') and u.get('car_brand') and u.get('car_color'))
@@ -187,16 +751,41 @@ def is_user_banned(u):
         bu = u.get('banned_until')
         if bu:
             try:
-                until = datetime.fromisoformat(bu)
-                if until > datetime.now():
+                until_min = u.get('banned_until_min')
+                if until_min is None:
+                    until_min = to_epoch_min(bu)
+                if until_min > to_epoch_min(datetime.now()):
                     return True, u.get('ban_reason',''), bu
-                else:
-                    update_user(u['id'], is_active=1, banned_until=None, ban_reason='')
-                    return False, '', None
+                # истёкший бан снимает планировщик (unban:<id>, auto_unban) через поток-писатель
+                return False, '', None
             except: pass
         return True, u.get('ban_reason',''), None
     return False, '', None
 
+def get_user_context(tid):
+    """Всё, что обработчикам нужно о пользователе на один апдейт: строка users,
+    статус бана и число активных броней. Из кэша, иначе одним запросом."""
+    user = _user_cache.get(tid=tid)
+    active = _user_cache.get_active(user['id']) if user else None
+    if user is None or active is None:
+        generation = _user_cache.generation
+        with get_connection() as conn:
+            r = conn.cursor().execute(
+                '''SELECT u.*, (SELECT COUNT(*) FROM bookings b
+                                WHERE b.customer_id=u.id AND b.status IN ('pending','confirmed')) AS _active_bookings
+                   FROM users u WHERE u.telegram_id=?''', (tid,)).fetchone()
+        if not r:
+            return {'user': None, 'banned': False, 'ban_reason': '', 'banned_until': None, 'active_bookings': 0}
+        user = dict(r)
+        active = user.pop('_active_bookings')
+        _user_cache.put(user, generation)
+        _user_cache.put_active(user['id'], active, generation)
+    banned, reason, until = is_user_banned(user)
+    if not banned and not user.get('is_active'):
+        user.update(is_active=1, banned_until=None, ban_reason='')  # бан только что истёк
+    return {'user': user, 'banned': banned, 'ban_reason': reason, 'banned_until': until,
+            'active_bookings': active}
+
 def ban_user(user_id, duration_hours=None, reason=''):
     bu = None
     if duration_hours:
@@ -305,14 +894,22 @@ def create_spot_availability(spot_id, start_time, end_time):
 
 def check_slot_overlap(spot_id, start_time, end_time, exclude_slot_id=None):
     """Проверяет пересечение с существующими слотами. True = есть пересечение."""
+    if _index_ready():
+        return _avail_index.has_overlap(spot_id, start_time, end_time, now_local(),
+                                        exclude_slot_id=exclude_slot_id or None)
     with get_connection() as conn:
         # Не используем SQLite datetime('now','localtime') — на хостинге TZ может быть UTC.
         # Сравниваем относительно нашей локальной TZ (now_local) для консистентной логики.
-        q = '''SELECT COUNT(*) FROM spot_availability
-               WHERE spot_id=? AND start_time < ? AND end_time > ?
-               AND end_time > ?'''
-        now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
-        p = [spot_id, end_time.strftime("%Y-%m-%d %H:%M:%S"), start_time.strftime("%Y-%m-%d %H:%M:%S"), now_str]
+        if _EPOCH_COLS:
+            q = '''SELECT COUNT(*) FROM spot_availability
+                   WHERE spot_id=? AND start_min < ? AND end_min > ? AND end_min > ?'''
+            p = [spot_id, to_epoch_min(end_time), to_epoch_min(start_time), to_epoch_min(now_local())]
+        else:
+            q = '''SELECT COUNT(*) FROM spot_availability
+                   WHERE spot_id=? AND start_time < ? AND end_time > ?
+                   AND end_time > ?'''
+            now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
+            p = [spot_id, end_time.strftime("%Y-%m-%d %H:%M:%S"), start_time.strftime("%Y-%m-%d %H:%M:%S"), now_str]
         if exclude_slot_id:
             q += ' AND id != ?'; p.append(exclude_slot_id)
         return conn.cursor().execute(q, p).fetchone()[0] > 0
@@ -345,6 +942,8 @@ def get_all_spots():
 
 def get_spots_with_free_availabilities(limit: int = 50):
     """Список мест, у которых есть хотя бы один свободный активный слот (end_time > now)."""
+    if _index_ready():
+        return _avail_index.spots_with_free(now_local(), limit)
     now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
     with get_connection() as conn:
         q = '''SELECT DISTINCT ps.*, u.full_name as supplier_name
@@ -357,6 +956,9 @@ def get_spots_with_free_availabilities(limit: int = 50):
                  )
                ORDER BY ps.created_at DESC
                LIMIT ?'''
+        if _EPOCH_COLS:
+            q = q.replace('sa.end_time > ?', 'sa.end_min > ?')
+            return [dict(r) for r in conn.cursor().execute(q, (to_epoch_min(now_local()), limit)).fetchall()]
         return [dict(r) for r in conn.cursor().execute(q, (now_str, limit)).fetchall()]
 def delete_spot(sid):
     with get_connection() as conn:
@@ -366,26 +968,96 @@ def delete_spot(sid):
 
 
 # ==================== AVAILABILITY ====================
-def get_available_slots(date_str=None, exclude_supplier=None):
-    with get_connection() as conn:
-        q = '''SELECT sa.*, ps.spot_number, ps.price_per_hour,
+_SLOTS_SELECT = '''SELECT sa.*, ps.spot_number, ps.price_per_hour,
                ps.address, ps.description, ps.supplier_id, u.full_name as supplier_name,
-               u.card_number, u.bank
+               u.card_number, u.bank'''
+_SLOTS_FROM = '''
                FROM spot_availability sa
                JOIN parking_spots ps ON sa.spot_id = ps.id
                JOIN users u ON ps.supplier_id = u.id
-               WHERE sa.is_booked = 0 AND ps.is_available = 1
-               AND sa.end_time > ?'''
-        now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
-        p = [now_str]
+               WHERE sa.is_booked = 0 AND ps.is_available = 1'''
+
+
+def _available_where(date_str, exclude_supplier):
+    """FROM/WHERE поиска свободных слотов и параметры (общие для списка, страницы и счётчика)."""
+    q = _SLOTS_FROM
+    if _EPOCH_COLS:
+        # Диапазоны по целым минутам вместо DATE() — индекс по start_min работает
+        q += ' AND sa.end_min > ?'
+        p = [to_epoch_min(now_local())]
+        if date_str:
+            day = to_epoch_min(datetime.strptime(date_str, "%Y-%m-%d"))
+            q += ' AND sa.start_min < ? AND sa.end_min >= ?'
+            p.extend([day + 24 * 60, day])
+    else:
+        q += ' AND sa.end_time > ?'
+        p = [now_local().strftime("%Y-%m-%d %H:%M:%S")]
         if date_str:
             q += ' AND DATE(sa.start_time) <= ? AND DATE(sa.end_time) >= ?'
             p.extend([date_str, date_str])
-        if exclude_supplier:
-            q += ' AND ps.supplier_id != ?'; p.append(exclude_supplier)
-        q += ' ORDER BY sa.start_time ASC'
+    if exclude_supplier:
+        q += ' AND ps.supplier_id != ?'; p.append(exclude_supplier)
+    return q, p
+
+
+def get_available_slots(date_str=None, exclude_supplier=None):
+    if _index_ready():
+        day = datetime.strptime(date_str, "%Y-%m-%d") if date_str else None
+        return _avail_index.free_slots(now_local(), day, day + timedelta(days=1) if day else None,
+                                       exclude_supplier=exclude_supplier)
+    with get_connection() as conn:
+        q, p = _available_where(date_str, exclude_supplier)
+        q = _SLOTS_SELECT + q + (' ORDER BY sa.start_min ASC' if _EPOCH_COLS else ' ORDER BY sa.start_time ASC')
         return [dict(r) for r in conn.cursor().execute(q, p).fetchall()]
 
+
+def slot_cursor(slot) -> tuple[int, int]:
+    """Ключ слота для постраничного поиска: (начало в секундах от эпохи, id)."""
+    return _avail_key(slot['start_time']), slot['id']
+
+
+def get_available_slots_page(date_str=None, exclude_supplier=None, after=None, before=None,
+                             limit: int = SEARCH_PAGE_SIZE) -> dict:
+    """Страница поиска свободных слотов: keyset по (start_time, id), LIMIT в запросе.
+
+    after/before — slot_cursor последнего/первого слота соседней страницы.
+    Возвращает {'slots', 'total', 'prev', 'next'}: prev/next — курсоры для
+    кнопок листания (None, если листать некуда). total — число всех слотов
+    по фильтру (в индексе запоминается до следующего изменения слотов).
+    """
+    if _index_ready():
+        day = datetime.strptime(date_str, "%Y-%m-%d") if date_str else None
+        day_end = day + timedelta(days=1) if day else None
+        slots, more = _avail_index.free_page(now_local(), day, day_end, exclude_supplier,
+                                             after=after, before=before, limit=limit)
+        total = _avail_index.count_free(now_local(), day, day_end, exclude_supplier)
+    else:
+        with get_connection() as conn:
+            q, p = _available_where(date_str, exclude_supplier)
+            total = conn.execute('SELECT COUNT(*)' + q, p).fetchone()[0]
+            col = 'sa.start_min' if _EPOCH_COLS else 'sa.start_time'
+            cursor = before if before is not None else after
+            if cursor is not None:
+                start = cursor[0] // 60 if _EPOCH_COLS else \
+                    (datetime(1970, 1, 1) + timedelta(seconds=cursor[0])).strftime("%Y-%m-%d %H:%M:%S")
+                q += f" AND ({col}, sa.id) {'<' if before is not None else '>'} (?, ?)"
+                p += [start, cursor[1]]
+            order = 'DESC' if before is not None else 'ASC'
+            q += f" ORDER BY {col} {order}, sa.id {order} LIMIT ?"
+            slots = [dict(r) for r in conn.execute(_SLOTS_SELECT + q, p + [limit + 1]).fetchall()]
+        more = len(slots) > limit
+        slots = slots[:limit]
+        if before is not None:
+            slots.reverse()
+    if not slots:
+        return {'slots': [], 'total': total, 'prev': None, 'next': None}
+    # в сторону, откуда пришли, страница точно есть; в сторону листания — если more
+    has_prev = more if before is not None else after is not None
+    has_next = more if before is None else True
+    return {'slots': slots, 'total': total,
+            'prev': slot_cursor(slots[0]) if has_prev else None,
+            'next': slot_cursor(slots[-1]) if has_next else None}
+
 def get_availability_by_id(aid):
     with get_connection() as conn:
         r = conn.cursor().execute('''SELECT sa.*, ps.spot_number, ps.price_per_hour,
@@ -404,8 +1076,13 @@ def get_slot_by_id(aid):
 
 def get_spot_availabilities(sid):
     """Возвращает ТОЛЬКО свободные интервалы для места, которые ещё не закончились."""
-    now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
     with get_connection() as conn:
+        if _EPOCH_COLS:
+            return [dict(r) for r in conn.cursor().execute(
+                "SELECT * FROM spot_availability WHERE spot_id=? AND is_booked=0 AND end_min>? ORDER BY start_min ASC",
+                (sid, to_epoch_min(now_local()))
+            ).fetchall()]
+        now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
         return [dict(r) for r in conn.cursor().execute(
             "SELECT * FROM spot_availability WHERE spot_id=? AND is_booked=0 AND end_time>? ORDER BY start_time ASC",
             (sid, now_str)
@@ -414,8 +1091,13 @@ def get_spot_availabilities(sid):
 
 def get_spot_availabilities_all(sid):
     """Для админки: возвращает все интервалы (свободные и забронированные), которые ещё не закончились."""
-    now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
     with get_connection() as conn:
+        if _EPOCH_COLS:
+            return [dict(r) for r in conn.cursor().execute(
+                "SELECT * FROM spot_availability WHERE spot_id=? AND end_min>? ORDER BY start_min ASC",
+                (sid, to_epoch_min(now_local()))
+            ).fetchall()]
+        now_str = now_local().strftime("%Y-%m-%d %H:%M:%S")
         return [dict(r) for r in conn.cursor().execute(
             "SELECT * FROM spot_availability WHERE spot_id=? AND end_time>? ORDER BY start_time ASC",
             (sid, now_str)
@@ -471,19 +1153,14 @@ def admin_update_availability_interval(slot_id: int, start_dt: datetime, end_dt:
             ),
         )
         ok = c.rowcount > 0
-
-    # Если слот свободный — попробуем схлопнуть соседние свободные интервалы
-    if ok:
-        try:
-            merge_free_availability(spot_id)
-        except Exception:
-            pass
+        # Если слот свободный — схлопываем с соседними свободными интервалами
+        if ok:
+            _coalesce_free(c, slot_id)
     return ok
 
 
 def admin_delete_availability(slot_id: int) -> bool:
     """Админ удаляет слот availability (только если booking_id IS NULL)."""
-    spot_id = None
     with get_connection() as conn:
         c = conn.cursor()
         slot = c.execute(
@@ -494,16 +1171,8 @@ def admin_delete_availability(slot_id: int) -> bool:
             return False
         if slot["booking_id"] is not None:
             return False
-        spot_id = slot["spot_id"]
         c.execute("DELETE FROM spot_availability WHERE id=?", (slot_id,))
-        ok = c.rowcount > 0
-
-    if ok and spot_id:
-        try:
-            merge_free_availability(spot_id)
-        except Exception:
-            pass
-    return ok
+        return c.rowcount > 0
 
 
 
@@ -511,12 +1180,12 @@ def create_booking(customer_id, spot_id, availability_id, start_time, end_time,
     """Создаёт бронь (pending).
 
     Важно: в spot_availability храним **реальный** забронированный интервал, а остатки
-    (до/после) — отдельными свободными интервалами. Так не возникает перекрытий
-    между booked/free, и корректно работает проверка пересечений/склейка.
+    (до/после) — отдельными свободными интервалами (_split_slot). Так не возникает
+    перекрытий между booked/free, и корректно работает проверка пересечений/склейка.
     """
     with get_connection() as conn:
         c = conn.cursor()
-        conn.execute('BEGIN IMMEDIATE')
+        _begin_write(conn)
         start_time = normalize_dt(start_time)
         end_time = normalize_dt(end_time)
 
@@ -551,70 +1220,27 @@ def create_booking(customer_id, spot_id, availability_id, start_time, end_time,
         )
         bid = c.lastrowid
 
-        # 1) Текущий availability превращаем в забронированный интервал = времени брони
-        c.execute(
-            'UPDATE spot_availability SET is_booked=1, booked_by=?, booking_id=?, start_time=?, end_time=? WHERE id=?',
-            (
-                customer_id, bid,
-                start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                end_time.strftime("%Y-%m-%d %H:%M:%S"),
-                availability_id
-            )
-        )
-
-        # 2) Остаток ДО
-        if start_time > slot_start:
-            c.execute(
-                'INSERT INTO spot_availability (spot_id,start_time,end_time,is_booked) VALUES (?,?,?,0)',
-                (
-                    spot_id,
-                    slot_start.strftime("%Y-%m-%d %H:%M:%S"),
-                    start_time.strftime("%Y-%m-%d %H:%M:%S")
-                )
-            )
-
-        # 3) Остаток ПОСЛЕ
-        if end_time < slot_end:
-            c.execute(
-                'INSERT INTO spot_availability (spot_id,start_time,end_time,is_booked) VALUES (?,?,?,0)',
-                (
-                    spot_id,
-                    end_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    slot_end.strftime("%Y-%m-%d %H:%M:%S")
-                )
-            )
+        _split_slot(c, slot, start_time, end_time, customer_id, bid)
 
         _log(c, 'booking_created', booking_id=bid, user_id=customer_id, spot_id=spot_id)
+        _emit('booking_changed', bid)
         return bid
 
 
 def cancel_booking(bid):
     """Отменяет бронь. Освобождает забронированный слот с временем = бронь."""
-    spot_id = None
     with get_connection() as conn:
         c = conn.cursor()
+        _begin_write(conn)
         booking = c.execute('SELECT * FROM bookings WHERE id=?',(bid,)).fetchone()
         if not booking:
             return False
-        spot_id = booking['spot_id']
-        aid = booking['availability_id']
-        # Ставим время слота = время брони (не оригинальное!) и освобождаем
-        c.execute(
-            '''UPDATE spot_availability
-               SET is_booked=0, booked_by=NULL, booking_id=NULL, start_time=?, end_time=?
-               WHERE id=?''',
-            (booking['start_time'], booking['end_time'], aid)
-        )
+        if booking['status'] in ('cancelled', 'expired'):
+            return True   # уже отменена — слот давно освобождён, повторно не трогаем
         c.execute("UPDATE bookings SET status='cancelled' WHERE id=?",(bid,))
+        # Освобождаем слот во время брони (не оригинальное!) и склеиваем с соседями
+        _release_slot(c, booking['availability_id'], bid, booking['start_time'], booking['end_time'])
         _log(c, 'booking_cancelled', booking_id=bid)
-
-    # ВАЖНО: merge открывает новое соединение. Делаем его ПОСЛЕ закрытия транзакции,
-    # иначе возможна ошибка SQLite 'database is locked'.
-    if spot_id:
-        try:
-            merge_free_availability(spot_id)
-        except Exception:
-            pass
     return True
 
 def confirm_booking(bid):
@@ -622,7 +1248,9 @@ def confirm_booking(bid):
         c = conn.cursor()
         c.execute("UPDATE bookings SET status='confirmed' WHERE id=? AND status='pending'",(bid,))
         ok = c.rowcount > 0
-        if ok: _log(c, 'booking_confirmed', booking_id=bid)
+        if ok:
+            _log(c, 'booking_confirmed', booking_id=bid)
+            _emit('booking_changed', bid)
         return ok
 
 def reject_booking(bid):
@@ -634,15 +1262,13 @@ def admin_edit_booking_hours(bid, paid_hours):
     Если оплачено меньше полного интервала — остаток превращается в свободный слот.
     Цена пересчитывается по тарифу (utils.calculate_price).
     """
-    spot_id = None
     with get_connection() as conn:
         c = conn.cursor()
+        _begin_write(conn)
         booking = c.execute('SELECT * FROM bookings WHERE id=?', (bid,)).fetchone()
         if not booking:
             return False
 
-        spot_id = booking['spot_id']
-
         book_start = _parse_db_dt(booking['start_time'])
         book_end = _parse_db_dt(booking['end_time'])
 
@@ -670,50 +1296,31 @@ def admin_edit_booking_hours(bid, paid_hours):
 
         new_end = book_start + timedelta(hours=paid_hours)
 
-        # 1) В spot_availability освобождаем хвост [new_end, book_end]
+        try:
+            new_price = calculate_price(book_start, new_end)
+        except ValueError:
+            return False
         # availability_id должен быть строкой/числом
         aid = booking['availability_id']
-        # на всякий случай синхронизируем booked-слот временем брони
+        # 1) на всякий случай синхронизируем booked-слот временем брони
         try:
             normalize_booking_availability(bid)
         except Exception:
             pass
 
-        # создаём свободный остаток, если он ещё не существует
-        if new_end < book_end:
-            c.execute(
-                'INSERT INTO spot_availability (spot_id,start_time,end_time,is_booked) VALUES (?,?,?,0)',
-                (
-                    booking['spot_id'],
-                    new_end.strftime("%Y-%m-%d %H:%M:%S"),
-                    book_end.strftime("%Y-%m-%d %H:%M:%S")
-                )
-            )
-
         # 2) Укорачиваем booked-слот и саму бронь
         c.execute(
             'UPDATE spot_availability SET end_time=? WHERE id=? AND booking_id=?',
             (new_end.strftime("%Y-%m-%d %H:%M:%S"), aid, bid)
         )
-        try:
-            new_price = calculate_price(book_start, new_end)
-        except ValueError:
-            return False
         c.execute(
             'UPDATE bookings SET end_time=?, total_price=? WHERE id=?',
             (new_end.strftime("%Y-%m-%d %H:%M:%S"), new_price, bid)
         )
-
-        # Склейку делаем уже после коммита/закрытия соединения (см. ниже)
+        # 3) Хвост — свободный интервал, сразу склеенный с соседями
+        _release_interval(c, booking['spot_id'], new_end, book_end)
 
         _log(c, 'booking_edited', booking_id=bid, details=f"paid_hours={paid_hours} (split)")
-
-    # Склеиваем свободные куски обратно вне транзакции, чтобы не ловить блокировки
-    if spot_id:
-        try:
-            merge_free_availability(spot_id)
-        except Exception:
-            pass
     return True
 
 
@@ -788,8 +1395,16 @@ def get_supplier_bookings(sid):
                WHERE ps.supplier_id=? AND b.status IN ('pending','confirmed') ORDER BY b.start_time''',(sid,)).fetchall()]
 
 def get_active_bookings_count(uid):
+    in_tx = getattr(_local, 'conn', None) is not None
+    n = None if in_tx else _user_cache.get_active(uid)
+    if n is not None:
+        return n
+    generation = _user_cache.generation
     with get_connection() as conn:
-        return conn.cursor().execute("SELECT COUNT(*) FROM bookings WHERE customer_id=? AND status IN ('pending','confirmed')",(uid,)).fetchone()[0]
+        n = conn.cursor().execute("SELECT COUNT(*) FROM bookings WHERE customer_id=? AND status IN ('pending','confirmed')",(uid,)).fetchone()[0]
+    if not in_tx:
+        _user_cache.put_active(uid, n, generation)
+    return n
 
 
 # ==================== REVIEWS ====================
@@ -895,23 +1510,126 @@ def get_admin_logs(limit=100):
 
 def auto_unban_expired():
     with get_connection() as conn:
+        _touch('uc', '*')
+        if _EPOCH_COLS:
+            return conn.cursor().execute(
+                "UPDATE users SET is_active=1, banned_until=NULL, ban_reason='' WHERE is_active=0 AND banned_until_min <= ?",
+                (to_epoch_min(datetime.now()),)).rowcount
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         return conn.cursor().execute(
             "UPDATE users SET is_active=1, banned_until=NULL, ban_reason='' WHERE is_active=0 AND banned_until IS NOT NULL AND banned_until < ?",
             (now,)).rowcount
 
 # ==================== STATS ====================
+# ==================== STATISTICS ====================
+# Счётчики для админской статистики ведут постоянные триггеры в той же
+# транзакции, что и изменение: статусы броней меняются во многих местах
+# (в т.ч. сырым SQL), а так дашборд читает несколько строк вместо COUNT/SUM
+# по всей таблице.
+#   stats_counters(name)     — зеркало таблиц: удаление строки уменьшает счётчик
+#   stats_daily(day, name)   — ряды по дню начала брони (локальная дата): bookings,
+#                              confirmed, revenue. Удаление старых броней
+#                              (cleanup_old_bookings) историю не стирает.
+_STAT = ("INSERT INTO stats_counters (name, value) VALUES ({}, {}) "
+         "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;")
+_STAT_DAY = ("INSERT INTO stats_daily (day, name, value) VALUES (date({}.start_time), {}, {}) "
+             "ON CONFLICT(day, name) DO UPDATE SET value = value + excluded.value;")
+
+
+def _booking_stats(row: str, sign: str, daily: bool = True) -> str:
+    """Тело триггера: вклад строки bookings (NEW/OLD) в счётчики со знаком sign."""
+    confirmed = f"({row}.status = 'confirmed')"
+    sql = (_STAT.format("'bookings'", f"{sign}1")
+           + _STAT.format(f"'bookings:' || {row}.status", f"{sign}1")
+           + _STAT.format("'revenue'", f"{sign}{confirmed} * {row}.total_price"))
+    if daily:
+        sql += (_STAT_DAY.format(row, "'bookings'", f"{sign}1")
+                + _STAT_DAY.format(row, "'confirmed'", f"{sign}{confirmed}")
+                + _STAT_DAY.format(row, "'revenue'", f"{sign}{confirmed} * {row}.total_price"))
+    return sql
+
+
+_STATS_TRIGGERS = {
+    'trg_stats_u_ins': ("AFTER INSERT ON users",
+                        _STAT.format("'users'", 1) + _STAT.format("'active_users'", "(NEW.is_active = 1)")),
+    'trg_stats_u_upd': ("AFTER UPDATE OF is_active ON users",
+                        _STAT.format("'active_users'", "(NEW.is_active = 1) - (OLD.is_active = 1)")),
+    'trg_stats_u_del': ("AFTER DELETE ON users",
+                        _STAT.format("'users'", -1) + _STAT.format("'active_users'", "-(OLD.is_active = 1)")),
+    'trg_stats_ps_ins': ("AFTER INSERT ON parking_spots",
+                         _STAT.format("'spots'", "(NEW.is_available = 1)")),
+    'trg_stats_ps_upd': ("AFTER UPDATE OF is_available ON parking_spots",
+                         _STAT.format("'spots'", "(NEW.is_available = 1) - (OLD.is_available = 1)")),
+    'trg_stats_ps_del': ("AFTER DELETE ON parking_spots",
+                         _STAT.format("'spots'", "-(OLD.is_available = 1)")),
+    'trg_stats_bk_ins': ("AFTER INSERT ON bookings", _booking_stats('NEW', '+')),
+    'trg_stats_bk_upd': ("AFTER UPDATE OF status, total_price, start_time ON bookings",
+                         _booking_stats('OLD', '-') + _booking_stats('NEW', '+')),
+    'trg_stats_bk_del': ("AFTER DELETE ON bookings", _booking_stats('OLD', '-', daily=False)),
+}
+
+
+def _install_stats(c):
+    c.execute("CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0)")
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT NOT NULL, name TEXT NOT NULL, value REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, name)) WITHOUT ROWID''')
+    for name, (event, body) in _STATS_TRIGGERS.items():
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    if c.execute("SELECT 1 FROM stats_counters LIMIT 1").fetchone() is None:
+        # первый запуск с триггерами — заполняем по существующим данным
+        rebuild_statistics(daily=True)
+
+
+def rebuild_statistics(daily: bool = False):
+    """Пересчитывает stats_counters по таблицам (починка после ручных правок БД).
+
+    daily=True — заново строит и stats_daily, но только по оставшимся броням.
+    """
+    with get_connection() as conn:
+        c = conn.cursor()
+        _begin_write(conn)
+        c.execute("DELETE FROM stats_counters")
+        c.execute('''INSERT INTO stats_counters (name, value)
+                     SELECT 'users', COUNT(*) FROM users
+                     UNION ALL SELECT 'active_users', COUNT(*) FROM users WHERE is_active=1
+                     UNION ALL SELECT 'spots', COUNT(*) FROM parking_spots WHERE is_available=1
+                     UNION ALL SELECT 'bookings', COUNT(*) FROM bookings
+                     UNION ALL SELECT 'revenue', COALESCE(SUM(total_price), 0) FROM bookings WHERE status='confirmed'
+                     UNION ALL SELECT 'bookings:' || status, COUNT(*) FROM bookings GROUP BY status''')
+        if daily:
+            c.execute("DELETE FROM stats_daily")
+            c.execute('''INSERT INTO stats_daily (day, name, value)
+                         SELECT date(start_time), 'bookings', COUNT(*) FROM bookings GROUP BY 1
+                         UNION ALL SELECT date(start_time), 'confirmed', COUNT(*) FROM bookings
+                                   WHERE status='confirmed' GROUP BY 1
+                         UNION ALL SELECT date(start_time), 'revenue', SUM(total_price) FROM bookings
+                                   WHERE status='confirmed' GROUP BY 1''')
+
+
 def get_statistics():
     with get_connection() as conn:
-        c = conn.cursor(); s = {}
-        s['total_users'] = c.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-        s['active_users'] = c.execute('SELECT COUNT(*) FROM users WHERE is_active=1').fetchone()[0]
-        s['total_spots'] = c.execute('SELECT COUNT(*) FROM parking_spots WHERE is_available=1').fetchone()[0]
-        s['total_bookings'] = c.execute('SELECT COUNT(*) FROM bookings').fetchone()[0]
-        s['pending_bookings'] = c.execute("SELECT COUNT(*) FROM bookings WHERE status='pending'").fetchone()[0]
-        s['confirmed_bookings'] = c.execute("SELECT COUNT(*) FROM bookings WHERE status='confirmed'").fetchone()[0]
-        s['total_revenue'] = c.execute("SELECT COALESCE(SUM(total_price),0) FROM bookings WHERE status='confirmed'").fetchone()[0]
-        return s
+        v = {r['name']: r['value'] for r in conn.execute('SELECT name, value FROM stats_counters')}
+    s = {key: int(v.get(name, 0)) for key, name in (
+        ('total_users', 'users'), ('active_users', 'active_users'), ('total_spots', 'spots'),
+        ('total_bookings', 'bookings'), ('pending_bookings', 'bookings:pending'),
+        ('confirmed_bookings', 'bookings:confirmed'))}
+    s['total_revenue'] = v.get('revenue', 0)
+    return s
+
+
+def get_daily_statistics(days: int = 7) -> list[dict]:
+    """Брони/подтверждённые/выручка по дням начала брони за последние days дней (включая сегодня)."""
+    today = now_local().date()
+    first = (today - timedelta(days=days - 1)).isoformat()
+    out = {(today - timedelta(days=i)).isoformat(): {'bookings': 0, 'confirmed': 0, 'revenue': 0}
+           for i in range(days)}
+    with get_connection() as conn:
+        for r in conn.execute("SELECT day, name, value FROM stats_daily WHERE day BETWEEN ? AND ?",
+                              (first, today.isoformat())):
+            out[r['day']][r['name']] = r['value']
+    return [{'day': d, 'bookings': int(out[d]['bookings']), 'confirmed': int(out[d]['confirmed']),
+             'revenue': out[d]['revenue']} for d in sorted(out)]
 
 def get_user_statistics(uid):
     with get_connection() as conn:
@@ -950,6 +1668,8 @@ def update_booking_time(booking_id: int, start_time: str, end_time: str) -> bool
             "UPDATE bookings SET start_time=?, end_time=? WHERE id=? AND status='pending'",
             (start_time, end_time, booking_id),
         )
+        if c.rowcount > 0:
+            _emit('booking_changed', booking_id)
         return c.rowcount > 0
 
 
@@ -970,6 +1690,8 @@ def merge_free_availability(spot_id: int) -> int:
     merges = 0
     with get_connection() as conn:
         c = conn.cursor()
+        if _EPOCH_COLS:
+            return _merge_free_minutes(c, spot_id)
         rows = c.execute(
             """SELECT id, start_time, end_time
                  FROM spot_availability
@@ -1008,6 +1730,179 @@ def merge_free_availability(spot_id: int) -> int:
     return merges
 
 
+# ==================== INTERVAL ENGINE ====================
+# Все изменения интервалов брони — внутри транзакции вызывающего (после
+# _begin_write): разрезать свободный слот под бронь (_split_slot), вернуть
+# интервал в свободные (_release_slot/_release_interval) и сразу склеить с
+# соседями (_coalesce_free). Конкурентный поиск видит либо состояние до, либо
+# уже склеенное — промежуточных обрывков свободных интервалов не бывает.
+# Каждая операция — ограниченное число запросов, независимо от истории места.
+
+def _begin_write(conn):
+    """BEGIN IMMEDIATE, если транзакция ещё не открыта (вложенный get_connection — уже в ней)."""
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def _split_slot(c, slot, start_time: datetime, end_time: datetime, customer_id, bid):
+    """Свободный слот → забронированный [start_time, end_time) + свободные остатки до/после.
+
+    Два запроса: UPDATE слота и один INSERT остатков (если они есть).
+    """
+    fmt = "%Y-%m-%d %H:%M:%S"
+    slot_start = _parse_db_dt(slot['start_time'])
+    slot_end = _parse_db_dt(slot['end_time'])
+    c.execute(
+        'UPDATE spot_availability SET is_booked=1, booked_by=?, booking_id=?, start_time=?, end_time=? WHERE id=?',
+        (customer_id, bid, start_time.strftime(fmt), end_time.strftime(fmt), slot['id'])
+    )
+    rest = []
+    if start_time > slot_start:
+        rest.append((slot['spot_id'], slot_start.strftime(fmt), start_time.strftime(fmt)))
+    if end_time < slot_end:
+        rest.append((slot['spot_id'], end_time.strftime(fmt), slot_end.strftime(fmt)))
+    if rest:
+        c.execute('INSERT INTO spot_availability (spot_id,start_time,end_time,is_booked) VALUES '
+                  + ','.join(['(?,?,?,0)'] * len(rest)), [v for row in rest for v in row])
+
+
+def _release_slot(c, aid, bid, start_time, end_time) -> bool:
+    """Освобождает слот брони bid (время слота = время брони) и склеивает с соседями.
+
+    Трогаем только слот, который сейчас занят именно этой бронью: ни чужая
+    бронь, ни блокировка админом (booking_id NULL), ни уже освобождённый и
+    склеенный с соседями интервал повторной отменой не перезаписываются.
+    """
+    c.execute(
+        '''UPDATE spot_availability
+           SET is_booked=0, booked_by=NULL, booking_id=NULL, start_time=?, end_time=?
+           WHERE id=? AND is_booked=1 AND booking_id=?''',
+        (str(start_time), str(end_time), aid, bid)
+    )
+    if c.rowcount == 0:
+        return False
+    _coalesce_free(c, aid)
+    return True
+
+
+def _release_interval(c, spot_id, start_time: datetime, end_time: datetime) -> int:
+    """Новый свободный интервал места (например, неоплаченный хвост брони), сразу склеенный."""
+    fmt = "%Y-%m-%d %H:%M:%S"
+    if end_time <= start_time:
+        return 0
+    slot_id = c.execute(
+        'INSERT INTO spot_availability (spot_id,start_time,end_time,is_booked) VALUES (?,?,?,0)',
+        (spot_id, start_time.strftime(fmt), end_time.strftime(fmt))
+    ).lastrowid
+    _coalesce_free(c, slot_id)
+    return slot_id
+
+
+_COALESCE_BATCH = 8
+
+
+def _coalesce_free(c, slot_id: int) -> int:
+    """Склеивает только что освобождённый слот slot_id с соседними свободными — в той же транзакции.
+
+    Остальные свободные интервалы места между собой не пересекаются (их уже
+    склеили), поэтому в порядке end_time у них и start_time по возрастанию:
+    кандидаты — первые строки индекса idx_sa_spot (spot_id, is_booked=0, end_time)
+    с концом не раньше начала слота. Берём их пачкой, пока начало кандидата
+    не уйдёт за конец склеенного интервала: O(log n) на запрос, сколько бы
+    исторических интервалов ни было у места. Выживает строка с самым ранним
+    началом (как в merge_free_availability). Возвращает число склеек.
+    """
+    cur = c.execute('SELECT * FROM spot_availability WHERE id=? AND is_booked=0', (slot_id,)).fetchone()
+    if not cur:
+        return 0
+    spot_id = cur['spot_id']
+    minutes = _EPOCH_COLS and cur['start_min'] is not None
+    if minutes:
+        keep, s, e, end_time = cur['id'], cur['start_min'], cur['end_min'], cur['end_time']
+        start_time = cur['start_time']
+    else:
+        keep = cur['id']
+        s, e = _parse_db_dt(cur['start_time']), _parse_db_dt(cur['end_time'])
+    merged = []
+    scan_from = None
+    while scan_from != s:
+        # начало склейки сдвинулось влево — там могут быть ещё касающиеся интервалы
+        scan_from = s
+        done = False
+        while not done:
+            if minutes:
+                rows = c.execute(
+                    """SELECT id, start_min AS s, end_min AS e, start_time, end_time FROM spot_availability
+                         WHERE spot_id=? AND is_booked=0 AND end_min>=? AND id<>? ORDER BY end_min LIMIT ?""",
+                    (spot_id, s, keep, _COALESCE_BATCH)).fetchall()
+            else:
+                # нижняя граница без секунд: 'YYYY-MM-DD HH:MM' не больше любой записи той же минуты
+                rows = c.execute(
+                    """SELECT id, start_time, end_time FROM spot_availability
+                         WHERE spot_id=? AND is_booked=0 AND end_time>=? AND id<>? ORDER BY end_time LIMIT ?""",
+                    (spot_id, s.strftime("%Y-%m-%d %H:%M"), keep, _COALESCE_BATCH)).fetchall()
+            if len(rows) < _COALESCE_BATCH:
+                done = True
+            before = len(merged)
+            for r in rows:
+                if minutes:
+                    rs, re_ = r['s'], r['e']
+                else:
+                    try:
+                        rs, re_ = _parse_db_dt(r['start_time']), _parse_db_dt(r['end_time'])
+                    except ValueError:
+                        continue
+                if re_ < s:
+                    continue
+                if rs > e:
+                    done = True
+                    break
+                # пересекается или касается — забираем в склейку
+                if rs < s:
+                    c.execute("DELETE FROM spot_availability WHERE id=?", (keep,))
+                    keep, s = r['id'], rs
+                    if minutes:
+                        start_time = r['start_time']
+                else:
+                    c.execute("DELETE FROM spot_availability WHERE id=?", (r['id'],))
+                if re_ > e:
+                    e = re_
+                    if minutes:
+                        end_time = r['end_time']
+                merged.append(r['id'])
+            if len(merged) == before:
+                break
+    if merged:
+        if minutes:
+            c.execute("UPDATE spot_availability SET start_time=?, end_time=? WHERE id=?", (start_time, end_time, keep))
+        else:
+            c.execute("UPDATE spot_availability SET start_time=?, end_time=? WHERE id=?",
+                      (s.strftime("%Y-%m-%d %H:%M:%S"), e.strftime("%Y-%m-%d %H:%M:%S"), keep))
+    return len(merged)
+
+
+def _merge_free_minutes(c, spot_id: int) -> int:
+    """merge_free_availability по INTEGER-колонкам: без разбора строк в цикле."""
+    rows = c.execute(
+        """SELECT id, start_min, end_min, end_time
+             FROM spot_availability
+             WHERE spot_id=? AND is_booked=0 AND start_min IS NOT NULL
+             ORDER BY start_min ASC""",
+        (spot_id,)
+    ).fetchall()
+    merges = 0
+    cur = None
+    for r in rows:
+        if cur is not None and cur['end_min'] >= r['start_min']:
+            if r['end_min'] > cur['end_min']:
+                cur['end_min'], cur['end_time'] = r['end_min'], r['end_time']
+            c.execute("UPDATE spot_availability SET end_time=? WHERE id=?", (cur['end_time'], cur['id']))
+            c.execute("DELETE FROM spot_availability WHERE id=?", (r['id'],))
+            merges += 1
+            continue
+        cur = dict(r)
+    return merges
+
 
 
 
@@ -1073,6 +1968,7 @@ def confirm_booking_idempotent(bid: int):
         c.execute("UPDATE bookings SET status='confirmed' WHERE id=? AND status='paid_wait_admin'", (bid,))
         if c.rowcount > 0:
             _log(c, 'booking_confirmed', booking_id=bid)
+            _emit('booking_changed', bid)
             try:
                 normalize_booking_availability(bid)
             except Exception:
@@ -1085,27 +1981,32 @@ def confirm_booking_idempotent(bid: int):
         return False, 'invalid'
 
 
-def expire_unpaid_bookings(timeout_minutes: int = 30):
+def expire_unpaid_bookings(timeout_minutes: int = 30, booking_id: int | None = None):
     """Истекает неоплаченные брони pending/unpaid старше timeout_minutes.
 
+    booking_id — истечь только эту бронь (планировщик вызывает точно в срок,
+    поэтому срок сравнивается с точностью до секунды).
     Возвращает список dict: {booking_id, customer_telegram_id}
     """
     expired = []
     # created_at в SQLite задаётся CURRENT_TIMESTAMP (UTC). Поэтому сравниваем в UTC,
     # иначе при локальной TZ (например UTC+3) брони будут "истекать" сразу.
-    cutoff = (datetime.utcnow().replace(second=0, microsecond=0) - timedelta(minutes=timeout_minutes)).strftime("%Y-%m-%d %H:%M:%S")
-    spot_ids_to_merge = set()
+    now_utc = datetime.utcnow().replace(microsecond=0)
+    if booking_id is None:
+        now_utc = now_utc.replace(second=0)
+    cutoff = (now_utc - timedelta(minutes=timeout_minutes)).strftime("%Y-%m-%d %H:%M:%S")
     with get_connection() as conn:
         c = conn.cursor()
         # Блокируем запись, чтобы не было гонок с оплатой/отменой
-        conn.execute("BEGIN IMMEDIATE")
+        _begin_write(conn)
         rows = c.execute(
             '''SELECT b.id, b.availability_id, b.spot_id, b.start_time, b.end_time,
                       u.telegram_id as customer_telegram_id
                FROM bookings b
                JOIN users u ON b.customer_id=u.id
-               WHERE b.status='pending' AND b.payment_status='unpaid' AND b.created_at <= ?''',
-            (cutoff,)
+               WHERE b.status='pending' AND b.payment_status='unpaid' AND b.created_at <= ?'''
+            + (' AND b.id=?' if booking_id is not None else ''),
+            (cutoff,) if booking_id is None else (cutoff, booking_id)
         ).fetchall()
 
         for r in rows:
@@ -1115,30 +2016,52 @@ def expire_unpaid_bookings(timeout_minutes: int = 30):
             if c.rowcount == 0:
                 continue
             # освобождаем availability до времени брони и чистим привязку
-            c.execute(
-                '''UPDATE spot_availability
-                   SET is_booked=0, booked_by=NULL, booking_id=NULL, start_time=?, end_time=?
-                   WHERE id=?''',
-                (r['start_time'], r['end_time'], r['availability_id'])
-            )
+            _release_slot(c, r['availability_id'], bid, r['start_time'], r['end_time'])
             _log(c, 'booking_expired', booking_id=bid, spot_id=r['spot_id'])
-            spot_ids_to_merge.add(r['spot_id'])
             expired.append({'booking_id': bid, 'customer_telegram_id': r['customer_telegram_id']})
-    # Склеиваем свободные интервалы уже после транзакции
-    for sid in spot_ids_to_merge:
-        try:
-            merge_free_availability(sid)
-        except Exception:
-            pass
     return expired
 
 
+def get_schedule_snapshot(since: str):
+    """Всё, у чего есть дедлайн, — для восстановления планировщика при старте.
+
+    since — локальное время 'YYYY-MM-DD HH:MM:SS': брони, начинающиеся раньше, не нужны.
+    """
+    with get_connection() as conn:
+        c = conn.cursor()
+        return {
+            'unpaid': [dict(r) for r in c.execute(
+                "SELECT id, created_at FROM bookings WHERE status='pending' AND payment_status='unpaid'")],
+            'upcoming': [dict(r) for r in c.execute(
+                "SELECT id, status, start_time FROM bookings WHERE status IN ('pending','paid_wait_admin','confirmed') AND start_time > ?",
+                (since,))],
+            'banned': [dict(r) for r in c.execute(
+                "SELECT id, banned_until FROM users WHERE is_active=0 AND banned_until IS NOT NULL")],
+        }
+
+
 def get_nearest_free_slots(limit: int = 10, days: int = 7):
     """Возвращает ближайшие свободные интервалы на ближайшие days дней.
     Адрес возвращаем, но UI может скрыть до подтверждения.
     """
+    if _index_ready():
+        return _avail_index.nearest_free(now_local(), now_local() + timedelta(days=days), limit)
     with get_connection() as conn:
         c = conn.cursor()
+        if _EPOCH_COLS:
+            now = to_epoch_min(now_local())
+            rows = c.execute(
+                '''SELECT sa.id as availability_id, sa.spot_id, sa.start_time, sa.end_time,
+                          ps.spot_number, ps.price_per_hour, ps.address, ps.supplier_id
+                   FROM spot_availability sa
+                   JOIN parking_spots ps ON sa.spot_id = ps.id
+                   WHERE sa.is_booked=0 AND ps.is_available=1
+                     AND sa.start_min >= ? AND sa.start_min <= ?
+                   ORDER BY sa.start_min ASC
+                   LIMIT ?''',
+                (now, now + days * 24 * 60, limit)
+            ).fetchall()
+            return [dict(r) for r in rows]
         now = now_local().strftime("%Y-%m-%d %H:%M:%S")
         to = (now_local() + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
         rows = c.execute(
@@ -1170,6 +2093,65 @@ def cleanup_old_bookings(days: int = 30) -> int:
         return c.rowcount
 
 
+def cleanup_old_data(days: int = 30) -> None:
+    """Фоновая очистка: завершает старые подтверждённые брони, удаляет старые
+    свободные слоты и гасит устаревшие подписки на уведомления."""
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    with get_connection() as conn:
+        c = conn.cursor()
+        if _EPOCH_COLS:
+            m = to_epoch_min(cutoff)
+            c.execute("UPDATE bookings SET status='completed' WHERE status='confirmed' AND end_min < ?", (m,))
+            c.execute("DELETE FROM spot_availability WHERE end_min < ? AND is_booked=0", (m,))
+        else:
+            c.execute("UPDATE bookings SET status='completed' WHERE status='confirmed' AND end_time < ?", (cutoff,))
+            c.execute("DELETE FROM spot_availability WHERE end_time < ? AND is_booked=0", (cutoff,))
+        c.execute("UPDATE spot_notifications SET is_active=0 WHERE desired_date < DATE('now', '-7 days')")
+
+
+def cancel_stale_pending_bookings(hours: int = 24):
+    """Отменяет pending-брони старше hours часов и освобождает их слоты.
+
+    Возвращает список dict: {id, customer_telegram_id, spot_number}
+    """
+    cutoff = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    with get_connection() as conn:
+        c = conn.cursor()
+        _begin_write(conn)
+        rows = c.execute(
+            '''SELECT b.id, b.availability_id, b.start_time, b.end_time,
+                      u.telegram_id as customer_telegram_id, ps.spot_number
+               FROM bookings b
+               JOIN users u ON b.customer_id = u.id
+               JOIN parking_spots ps ON b.spot_id = ps.id
+               WHERE b.status = 'pending' AND b.created_at < ?''',
+            (cutoff,)
+        ).fetchall()
+        for r in rows:
+            c.execute("UPDATE bookings SET status='cancelled' WHERE id=?", (r['id'],))
+            _release_slot(c, r['availability_id'], r['id'], r['start_time'], r['end_time'])
+        return [dict(r) for r in rows]
+
+
+def get_upcoming_bookings(from_time: str, to_time: str):
+    """Подтверждённые брони, начинающиеся в [from_time, to_time] (для напоминаний)."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            '''SELECT b.id, b.start_time, b.end_time, b.total_price,
+                      u.telegram_id as customer_telegram_id,
+                      ps.spot_number,
+                      supplier.full_name as supplier_name
+               FROM bookings b
+               JOIN users u ON b.customer_id = u.id
+               JOIN parking_spots ps ON b.spot_id = ps.id
+               JOIN users supplier ON ps.supplier_id = supplier.id
+               WHERE b.status = 'confirmed' AND ''' + (
+                   'b.start_min BETWEEN ? AND ?' if _EPOCH_COLS else 'b.start_time BETWEEN ? AND ?'),
+            (to_epoch_min(from_time), to_epoch_min(to_time)) if _EPOCH_COLS else (from_time, to_time)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
 def get_booking_full(bid: int):
     """Бронь с данными места, адреса, клиента и поставщика."""
     with get_connection() as conn:
@@ -1246,6 +2228,108 @@ def delete_slot_confirm(cid: str):
         conn.cursor().execute("DELETE FROM slot_confirms WHERE id=?", (cid,))
 
 
+# ==================== FSM STORAGE ====================
+def fsm_load(key: str):
+    """(state, data_json, updated_at) FSM-ключа или None."""
+    with get_connection() as conn:
+        r = conn.execute("SELECT state, data, updated_at FROM fsm_states WHERE key=?", (key,)).fetchone()
+        return (r['state'], r['data'], r['updated_at']) if r else None
+
+
+def fsm_store(rows: list[tuple]) -> int:
+    """Пачка изменений одной транзакцией: [(key, state, data_json, updated_at)].
+
+    Пустое состояние (state None и data '{}') удаляет строку.
+    """
+    empty = [(k,) for k, st, data, _ in rows if st is None and data == '{}']
+    keep = [r for r in rows if not (r[1] is None and r[2] == '{}')]
+    with get_connection() as conn:
+        if empty:
+            conn.executemany("DELETE FROM fsm_states WHERE key=?", empty)
+        if keep:
+            conn.executemany(
+                """INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?,?,?,?)
+                   ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data,
+                                                  updated_at=excluded.updated_at""", keep)
+    return len(rows)
+
+
+def fsm_purge(before: float) -> int:
+    """Удаляет FSM-состояния, не менявшиеся с before (unix time)."""
+    with get_connection() as conn:
+        return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,)).rowcount
+
+
+# ==================== BROADCASTS ====================
+_BROADCAST_WHERE = {'all': '', 'active': ' AND is_active=1'}
+
+
+def create_broadcast(text: str, target: str = 'all', admin_chat_id: int | None = None) -> int:
+    where = _BROADCAST_WHERE.get(target, '')
+    with get_connection() as conn:
+        c = conn.cursor()
+        total = c.execute('SELECT COUNT(*) FROM users WHERE 1=1' + where).fetchone()[0]
+        c.execute('INSERT INTO broadcast_jobs (target, text, total, admin_chat_id) VALUES (?,?,?,?)',
+                  (target, text, total, admin_chat_id))
+        return c.lastrowid
+
+
+def claim_broadcast_batch(job_id: int, limit: int = 200) -> list[dict]:
+    """Следующая пачка получателей (id, telegram_id) по ключу users.id > cursor.
+
+    Курсор сдвигается в той же транзакции ДО отправки: пачка, взятая перед
+    падением, не будет отправлена повторно (лучше недослать, чем задвоить).
+    Пустой список — рассылка закончена или отменена.
+    """
+    with get_connection() as conn:
+        c = conn.cursor()
+        _begin_write(conn)
+        job = c.execute('SELECT status, target, cursor FROM broadcast_jobs WHERE id=?', (job_id,)).fetchone()
+        if not job or job['status'] != 'running':
+            return []
+        rows = [dict(r) for r in c.execute(
+            'SELECT id, telegram_id FROM users WHERE id>?' + _BROADCAST_WHERE.get(job['target'], '')
+            + ' ORDER BY id LIMIT ?', (job['cursor'], limit))]
+        if rows:
+            c.execute('UPDATE broadcast_jobs SET cursor=? WHERE id=?', (rows[-1]['id'], job_id))
+        return rows
+
+
+def add_broadcast_counts(job_id: int, sent: int = 0, failed: int = 0, blocked: int = 0):
+    with get_connection() as conn:
+        conn.cursor().execute('UPDATE broadcast_jobs SET sent=sent+?, failed=failed+?, blocked=blocked+? WHERE id=?',
+                              (sent, failed, blocked, job_id))
+
+
+def set_broadcast_message(job_id: int, message_id: int):
+    with get_connection() as conn:
+        conn.cursor().execute('UPDATE broadcast_jobs SET message_id=? WHERE id=?', (message_id, job_id))
+
+
+def finish_broadcast(job_id: int, status: str = 'done') -> bool:
+    """running → done/cancelled. False — рассылка уже не выполнялась."""
+    with get_connection() as conn:
+        return conn.cursor().execute(
+            "UPDATE broadcast_jobs SET status=?, finished_at=CURRENT_TIMESTAMP WHERE id=? AND status='running'",
+            (status, job_id)).rowcount > 0
+
+
+def cancel_broadcast(job_id: int) -> bool:
+    return finish_broadcast(job_id, 'cancelled')
+
+
+def get_broadcast(job_id: int):
+    with get_connection() as conn:
+        r = conn.cursor().execute('SELECT * FROM broadcast_jobs WHERE id=?', (job_id,)).fetchone()
+        return dict(r) if r else None
+
+
+def get_running_broadcasts() -> list[dict]:
+    with get_connection() as conn:
+        return [dict(r) for r in conn.cursor().execute(
+            "SELECT * FROM broadcast_jobs WHERE status='running' ORDER BY id")]
+
+
 # ==================== COMPAT HELPERS FOR OLD UI ====================
 def create_spot(user_telegram_id: int, spot_number: str, address: str | None = None) -> int:
     """Создаёт/находит место по spot_number для пользователя по telegram_id."""
@@ -0,0 +1,133 @@
+"""
+Асинхронный фасад над database.py
+
+Каждая публичная функция database.py доступна здесь корутиной с тем же именем
+и сигнатурой: `await db_async.get_user_by_telegram_id(tid)`.
+
+- чтения выполняются в небольшом пуле потоков (DB_READ_WORKERS);
+- все изменения идут в единственный поток-писатель — это FIFO-очередь, поэтому
+  медленная запись (BEGIN IMMEDIATE + busy_timeout) не блокирует ни event loop,
+  ни параллельные чтения, а записи не толкаются друг с другом за блокировку.
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database as _db
+import metrics
+import tracing
+from config import DB_READ_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Функции database.py, которые пишут в БД → очередь писателя.
+WRITE_FUNCS = frozenset({
+    'init_database', 'init_db',
+    'create_user', 'update_user', 'ban_user', 'unban_user', 'set_user_role',
+    'block_user', 'unblock_user', 'auto_unban_expired',
+    'create_parking_spot', 'get_or_create_spot', 'delete_spot', 'set_slot_address',
+    'create_spot', 'add_availability',
+    'create_spot_availability', 'update_slot_times', 'delete_slot',
+    'admin_update_availability_interval', 'admin_delete_availability', 'admin_toggle_slot',
+    'merge_free_availability', 'normalize_booking_availability',
+    'create_booking', 'cancel_booking', 'confirm_booking', 'reject_booking',
+    'admin_edit_booking_hours', 'update_booking_time', 'mark_booking_paid',
+    'confirm_booking_idempotent', 'decline_payment', 'expire_unpaid_bookings',
+    'cancel_stale_pending_bookings', 'cleanup_old_bookings', 'cleanup_old_data',
+    'create_review', 'add_to_blacklist', 'remove_from_blacklist',
+    'create_spot_notification', 'deactivate_notification',
+    'create_admin_session', 'delete_admin_session', 'log_admin_action',
+    'create_slot_confirm', 'create_spot_confirm', 'delete_slot_confirm',
+    'create_broadcast', 'claim_broadcast_batch', 'add_broadcast_counts', 'set_broadcast_message',
+    'finish_broadcast', 'cancel_broadcast', 'rebuild_statistics',
+    'fsm_store', 'fsm_purge',
+})
+
+# Не ходят в БД (или не должны уходить в поток) — отдаём синхронно как есть.
+SYNC_FUNCS = frozenset({
+    'get_connection', 'get_pool_stats', 'close_pool', 'subscribe',
+    'user_has_car_info', 'user_has_card_info', 'slot_cursor',
+})
+
+# Колбэки после каждой записи через фасад (вызываются в контексте вызывающей корутины)
+after_write: list = []
+
+_read_executor: ThreadPoolExecutor | None = None
+_write_executor: ThreadPoolExecutor | None = None
+
+
+def _executor(write: bool) -> ThreadPoolExecutor:
+    global _read_executor, _write_executor
+    if write:
+        if _write_executor is None:
+            _write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        return _write_executor
+    if _read_executor is None:
+        _read_executor = ThreadPoolExecutor(max_workers=max(1, DB_READ_WORKERS),
+                                            thread_name_prefix="db-reader")
+    return _read_executor
+
+
+async def run(fn, *args, write: bool = False, **kwargs):
+    """Выполняет произвольную синхронную функцию работы с БД вне event loop.
+
+    write=True — через очередь писателя. contextvars копируются в поток.
+    Время ожидания потока и выполнения пишется в metrics (parking_db_*) и в трассу апдейта.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    kind = 'write' if write else 'read'
+    name = getattr(fn, '__name__', 'fn')
+    submitted = time.perf_counter()
+    started = [None]
+
+    def call():
+        start = started[0] = time.perf_counter()
+        metrics.db_wait_seconds.observe(start - submitted, kind)
+        try:
+            return ctx.run(fn, *args, **kwargs)
+        finally:
+            metrics.db_seconds.observe(time.perf_counter() - start, name, kind)
+    try:
+        return await loop.run_in_executor(_executor(write), call)
+    finally:
+        wait_ms = ((started[0] or submitted) - submitted) * 1000
+        tracing.record(f"db.{name}", submitted, time.perf_counter(), kind=kind, wait_ms=f"{wait_ms:.1f}")
+
+
+def _wrap(name: str, fn, write: bool):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await run(fn, *args, write=write, **kwargs)
+        finally:
+            if write:
+                for cb in after_write:
+                    cb()
+    return wrapper
+
+
+def _export():
+    for name, fn in inspect.getmembers(_db, inspect.isfunction):
+        if name.startswith('_') or fn.__module__ != _db.__name__:
+            continue
+        if name in SYNC_FUNCS:
+            globals()[name] = fn
+        else:
+            globals()[name] = _wrap(name, fn, name in WRITE_FUNCS)
+
+
+_export()
+
+
+def shutdown(wait: bool = True):
+    """Останавливает потоки БД (при остановке бота). Очередь записей дописывается."""
+    global _read_executor, _write_executor
+    for ex in (_write_executor, _read_executor):
+        if ex is not None:
+            ex.shutdown(wait=wait)
+    _read_executor = _write_executor = None
@@ -0,0 +1,149 @@
+"""
+Выгрузка таблиц ParkingBot в Excel / CSV
+
+Строки читаются курсором порциями по EXPORT_CHUNK_ROWS и сразу пишутся в файл:
+  - xlsx — openpyxl в режиме write_only (строки уходят во временный XML,
+    объектной модели листа в памяти нет); лист длиннее лимита Excel
+    продолжается на следующем («bookings (2)»);
+  - csv — по файлу .csv.gz на таблицу (UTF-8 с BOM, открывается в Excel).
+Всё чтение идёт в одной транзакции, поэтому таблицы выгружаются согласованно
+на один момент. build() синхронная — обработчик запускает её в потоке.
+"""
+import csv
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from config import EXPORT_CHUNK_ROWS, TIMEZONE
+from database import get_connection
+from utils import now_local
+
+logger = logging.getLogger(__name__)
+
+# Таблица → колонка для фильтра по периоду
+TABLES = {
+    'bookings': 'start_time',
+    'users': 'created_at',
+    'parking_spots': 'created_at',
+    'spot_availability': 'start_time',
+    'admin_logs': 'created_at',
+}
+# Колонки с CURRENT_TIMESTAMP SQLite — это UTC; start_time — локальное время TIMEZONE
+UTC_TABLES = {'users', 'parking_spots', 'admin_logs'}
+TITLES = {
+    'bookings': 'Брони',
+    'users': 'Пользователи',
+    'parking_spots': 'Места',
+    'spot_availability': 'Слоты',
+    'admin_logs': 'Журнал',
+}
+FORMATS = ('xlsx', 'csv')
+_XLSX_MAX_ROWS = 1_048_576
+
+
+def _rows(conn, table: str, since: datetime | None):
+    """(заголовки, итератор порций строк) для таблицы с фильтром по периоду."""
+    sql, params = f"SELECT * FROM {table}", ()
+    if since is not None:
+        if table in UTC_TABLES:
+            since = since.replace(tzinfo=ZoneInfo(TIMEZONE)).astimezone(timezone.utc)
+        sql += f" WHERE {TABLES[table]} >= ?"
+        params = (since.strftime("%Y-%m-%d %H:%M:%S"),)
+    cur = conn.execute(sql + " ORDER BY id", params)
+    headers = [d[0] for d in cur.description]
+
+    def chunks():
+        while True:
+            batch = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not batch:
+                return
+            yield batch
+    return headers, chunks()
+
+
+def _cell(v):
+    if isinstance(v, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', v)
+    return v
+
+
+def _write_xlsx(conn, tables, since, path) -> dict:
+    wb = Workbook(write_only=True)
+    counts = {}
+    for table in tables:
+        headers, chunks = _rows(conn, table, since)
+        part, n, in_sheet = 1, 0, _XLSX_MAX_ROWS
+        for batch in chunks:
+            for r in batch:
+                if in_sheet >= _XLSX_MAX_ROWS:
+                    ws = wb.create_sheet(title=table[:27] if part == 1 else f"{table[:24]} ({part})")
+                    ws.append(headers)
+                    part, in_sheet = part + 1, 1
+                ws.append([_cell(v) for v in r])
+                in_sheet += 1
+                n += 1
+        if n == 0:
+            wb.create_sheet(title=table[:31]).append(headers)
+        counts[table] = n
+    wb.save(path)
+    return counts
+
+
+def _write_csv(conn, table, since, path) -> int:
+    headers, chunks = _rows(conn, table, since)
+    n = 0
+    with gzip.open(path, 'wt', encoding='utf-8-sig', newline='') as f:
+        w = csv.writer(f, delimiter=';')
+        w.writerow(headers)
+        for batch in chunks:
+            w.writerows(batch)
+            n += len(batch)
+    return n
+
+
+def build(tables: list[str], fmt: str = 'xlsx', days: int | None = None) -> tuple[list[str], dict]:
+    """Пишет выгрузку во временные файлы. Возвращает (пути файлов, {таблица: строк}).
+
+    days — только записи за последние days дней (по колонке из TABLES, с полуночи
+    по TIMEZONE), None — всё.
+    Файлы удаляет вызывающий (cleanup).
+    """
+    tables = [t for t in tables if t in TABLES]
+    if fmt not in FORMATS or not tables:
+        raise ValueError("Unknown export format or tables")
+    since = None
+    if days:
+        since = now_local().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    stamp = now_local().strftime("%Y%m%d_%H%M")
+    tmp = tempfile.mkdtemp(prefix="export_")
+    paths, counts = [], {}
+    try:
+        with get_connection() as conn:
+            conn.execute("BEGIN")   # один снимок на все таблицы
+            if fmt == 'xlsx':
+                path = os.path.join(tmp, f"parking_{stamp}.xlsx")
+                counts = _write_xlsx(conn, tables, since, path)
+                paths.append(path)
+            else:
+                for table in tables:
+                    path = os.path.join(tmp, f"{table}_{stamp}.csv.gz")
+                    counts[table] = _write_csv(conn, table, since, path)
+                    paths.append(path)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    logger.info(f"export {fmt} {counts}")
+    return paths, counts
+
+
+def cleanup(paths):
+    """Удаляет файлы build() вместе с их временной папкой."""
+    for d in {os.path.dirname(p) for p in paths}:
+        shutil.rmtree(d, ignore_errors=True)
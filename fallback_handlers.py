@@ -11,7 +11,7 @@ import logging
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
-import database as db
+from middlewares import current_user
 from keyboards import get_main_menu_keyboard
 
 logger = logging.getLogger(__name__)
@@ -38,7 +38,7 @@ async def fallback_any_callback(callback: CallbackQuery):
         pass
 
     try:
-        user = db.get_user_by_telegram_id(callback.from_user.id)
+        user = await current_user(callback.from_user.id)
         is_admin = bool(user and user.get("role") == "admin")
         await callback.message.answer(
             "⚠️ Эта кнопка устарела. Я обновил меню.",
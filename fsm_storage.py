@@ -0,0 +1,230 @@
+"""
+FSM-хранилище aiogram в SQLite
+
+Состояние и данные диалогов (бронирование, добавление места, ...) хранятся
+в таблице fsm_states и переживают рестарт бота. Чтобы не писать в БД на
+каждое нажатие кнопки:
+  - чтение и запись идут через кэш в памяти (LRU на FSM_CACHE_SIZE ключей,
+    вытесняются только уже сохранённые записи);
+  - изменённые ключи копятся и раз в FSM_FLUSH_SECONDS уходят в БД одной
+    транзакцией через поток-писатель (write-behind); при падении процесса
+    теряются изменения только за последний интервал;
+  - состояния без изменений дольше FSM_TTL_HOURS считаются пустыми и
+    периодически удаляются из БД.
+close() (вызывается Dispatcher при остановке) дописывает всё несохранённое.
+
+Данные сериализуются в JSON; datetime/date/time сохраняются как
+{"__dt__": iso} и т.п. и восстанавливаются при чтении.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime, time as dtime
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import db_async as db
+from config import FSM_FLUSH_SECONDS, FSM_TTL_HOURS, FSM_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_PURGE_EVERY_SECONDS = 3600
+
+
+def _encode(o):
+    if isinstance(o, datetime):
+        return {'__dt__': o.isoformat()}
+    if isinstance(o, date):
+        return {'__d__': o.isoformat()}
+    if isinstance(o, dtime):
+        return {'__t__': o.isoformat()}
+    raise TypeError(f"FSM data: {type(o).__name__} is not JSON serializable")
+
+
+def _decode(d: dict):
+    if len(d) == 1:
+        if '__dt__' in d:
+            return datetime.fromisoformat(d['__dt__'])
+        if '__d__' in d:
+            return date.fromisoformat(d['__d__'])
+        if '__t__' in d:
+            return dtime.fromisoformat(d['__t__'])
+    return d
+
+
+def dumps(data: dict) -> str:
+    return json.dumps(data, default=_encode, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(raw: str) -> dict:
+    return json.loads(raw, object_hook=_decode) if raw else {}
+
+
+def key_str(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+
+class _Entry:
+    __slots__ = ('state', 'data', 'updated_at')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[dict] = None, updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """BaseStorage поверх fsm_states: кэш в памяти + отложенная пакетная запись."""
+
+    def __init__(self, flush_seconds: float = FSM_FLUSH_SECONDS, ttl_hours: float = FSM_TTL_HOURS,
+                 cache_size: int = FSM_CACHE_SIZE):
+        self.flush_seconds = flush_seconds
+        self.ttl = ttl_hours * 3600 if ttl_hours > 0 else None
+        self.cache_size = max(1, cache_size)
+        self._cache: OrderedDict[str, _Entry] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._last_purge = 0.0
+        self._closed = False
+        self.stats = {'hits': 0, 'misses': 0, 'flushes': 0, 'written': 0, 'purged': 0}
+
+    # ---------- кэш ----------
+    def _expired(self, e: _Entry, now: float) -> bool:
+        return self.ttl is not None and e.updated_at and now - e.updated_at > self.ttl
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        k = key_str(key)
+        now = time.time()
+        e = self._cache.get(k)
+        if e is None:
+            self.stats['misses'] += 1
+            row = await db.fsm_load(k)
+            e = self._cache.get(k)   # пока читали, ключ мог появиться (параллельный апдейт)
+            if e is None:
+                e = _Entry()
+                if row is not None:
+                    state, raw, updated_at = row
+                    try:
+                        e = _Entry(state, loads(raw), updated_at)
+                    except ValueError as err:
+                        logger.warning(f"fsm {k}: bad stored data ({err}), reset")
+                self._cache[k] = e
+                self._evict(keep=k)
+        else:
+            self.stats['hits'] += 1
+            self._cache.move_to_end(k)
+        if self._expired(e, now):
+            e.state, e.data = None, {}
+        return e
+
+    def _evict(self, keep: Optional[str] = None):
+        if len(self._cache) <= self.cache_size:
+            return
+        for k in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if k not in self._dirty and k != keep:
+                del self._cache[k]
+
+    def _touch(self, key: StorageKey, e: _Entry):
+        e.updated_at = time.time()
+        self._dirty.add(key_str(key))
+        self._ensure_flusher()
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        e = await self._entry(key)
+        e.state = state.state if isinstance(state, State) else state
+        self._touch(key, e)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        e = await self._entry(key)
+        e.data = data.copy()
+        self._touch(key, e)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key)).data.copy()
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и дописывает несохранённые изменения."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # ---------- запись ----------
+    def pending(self) -> int:
+        """Число изменённых ключей, ещё не записанных в БД."""
+        return len(self._dirty)
+
+    def _ensure_flusher(self):
+        if self._closed:
+            return
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            # Отдельный контекст: записи фоновой задачи не должны помечать
+            # контекст пользователя текущего апдейта устаревшим (after_write)
+            self._task = asyncio.get_running_loop().create_task(self._loop(), context=contextvars.Context())
+        self._wake.set()
+
+    async def _loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+                await self._purge()
+            except Exception as e:
+                logger.error(f"fsm flush: {e}")
+
+    async def flush(self) -> int:
+        """Пишет накопленные изменения одной транзакцией. Возвращает число ключей."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            rows = []
+            for k in keys:
+                e = self._cache.get(k)
+                if e is None:
+                    continue
+                try:
+                    rows.append((k, e.state, dumps(e.data), e.updated_at))
+                except (TypeError, ValueError) as err:
+                    logger.error(f"fsm {k}: data not saved ({err})")
+            try:
+                await db.fsm_store(rows)
+            except BaseException:
+                self._dirty |= keys   # повторим в следующий раз (или в close())
+                raise
+            self.stats['flushes'] += 1
+            self.stats['written'] += len(rows)
+            self._evict()
+            return len(rows)
+
+    async def _purge(self):
+        now = time.time()
+        if self.ttl is None or now - self._last_purge < _PURGE_EVERY_SECONDS:
+            return
+        self._last_purge = now
+        self.stats['purged'] += await db.fsm_purge(now - self.ttl)
@@ -5,7 +5,7 @@ from datetime import datetime, timedelta
 from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton,
                            InlineKeyboardMarkup, InlineKeyboardButton,
                            ReplyKeyboardRemove)
-from utils import get_next_days, now_local
+from utils import get_next_days, now_local, calculate_prices
 from config import FIXED_ADDRESS
 
 # ==================== MAIN MENU ====================
@@ -80,9 +80,11 @@ def get_time_slots_keyboard(prefix, min_dt=None):
 
 
 # ==================== SLOTS ====================
-def get_available_slots_keyboard(slots):
+def get_available_slots_keyboard(slots, prev_cursor=None, next_cursor=None):
+    """Слоты поиска; prev_cursor/next_cursor — (start, id) для кнопок листания страниц."""
     buttons = []
-    for slot in slots[:20]:
+    prices = calculate_prices([(s['start_time'], s['end_time']) for s in slots])
+    for slot, price in zip(slots, prices):
         start = datetime.fromisoformat(slot['start_time'])
         end = datetime.fromisoformat(slot['end_time'])
         sd = start.strftime('%d.%m')
@@ -95,8 +97,15 @@ def get_available_slots_keyboard(slots):
         addr = FIXED_ADDRESS
         if len(addr) > 26:
             addr = addr[:25] + "…"
-        text = f"📍 {addr} | {date_text}"
+        text = f"📍 {addr} | {date_text} | {price}₽"
         buttons.append([InlineKeyboardButton(text=text, callback_data=f"slot_{slot['id']}")])
+    nav = []
+    if prev_cursor:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"slots_prev_{prev_cursor[0]}_{prev_cursor[1]}"))
+    if next_cursor:
+        nav.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"slots_next_{next_cursor[0]}_{next_cursor[1]}"))
+    if nav:
+        buttons.append(nav)
     buttons.append([InlineKeyboardButton(text="📅 Фильтр по дате", callback_data="search_filter")])
     buttons.append([InlineKeyboardButton(text="🔔 Уведомить", callback_data="notify_available")])
     buttons.append([InlineKeyboardButton(text="🔙 Меню", callback_data="main_menu")])
@@ -196,6 +205,7 @@ def get_admin_panel_keyboard():
         [InlineKeyboardButton(text="🏠 Управление слотами", callback_data="admin_slots")],
         [InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users")],
         [InlineKeyboardButton(text="📈 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="⏱ Метрики", callback_data="admin_metrics")],
         [InlineKeyboardButton(text="📢 Рассылка", callback_data="admin_broadcast")],
         [InlineKeyboardButton(text="💾 Выгрузить базу", callback_data="admin_export_db")],
         [InlineKeyboardButton(text="📊 Выгрузить Excel", callback_data="admin_export_excel")],
@@ -4,10 +4,11 @@ ParkingBot - Telegram-бот для аренды парковочных мест
 """
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
 # python-dotenv is optional at runtime; BotHost usually provides env vars.
 try:
@@ -16,8 +17,20 @@ try:
 except Exception:
     pass
 
-from config import APP_VERSION, BOT_TOKEN, LOG_LEVEL, LOG_FORMAT, DATABASE_PATH
-import database as db
+from config import (APP_VERSION, BOT_TOKEN, LOG_LEVEL, LOG_FORMAT, DATABASE_PATH, TIMEZONE,
+                    BOOKING_TIMEOUT_MINUTES, REMINDER_BEFORE_MINUTES, MAINTENANCE_INTERVAL_SECONDS,
+                    BACKUP_INTERVAL_HOURS, WEBHOOK_URL)
+import db_async as db
+import backup
+from fsm_storage import SQLiteStorage
+from scheduler import scheduler
+from outbound import outbox
+import broadcasts
+import webhook
+import metrics
+import tracing
+from chat_executor import executor
+from utils import now_local
 import os
 
 # Создаём директорию для БД если нет
@@ -25,6 +38,7 @@ os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
 from user_handlers import router as user_router
 from admin_handlers import router as admin_router
 from fallback_handlers import router as fallback_router
+from middlewares import ChatSerialMiddleware, HandlerMetricsMiddleware, ThrottlingMiddleware, UserContextMiddleware
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,38 +47,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для бота (для фоновых задач)
-bot_instance: Bot = None
-
-
 async def cleanup_old_data():
     """Очистка старых данных (бронирования старше 30 дней)"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Помечаем старые бронирования как завершённые
-            cutoff = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute('''
-                UPDATE bookings 
-                SET status = 'completed' 
-                WHERE status = 'confirmed' AND end_time < ?
-            ''', (cutoff,))
-            
-            # Удаляем старые слоты доступности
-            cursor.execute('''
-                DELETE FROM spot_availability 
-                WHERE end_time < ? AND is_booked = 0
-            ''', (cutoff,))
-            
-            # Деактивируем старые уведомления
-            cursor.execute('''
-                UPDATE spot_notifications 
-                SET is_active = 0 
-                WHERE desired_date < DATE('now', '-7 days')
-            ''')
-            
-            logger.info("Old data cleanup completed")
+        await db.cleanup_old_data(30)
+        logger.info("Old data cleanup completed")
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
 
@@ -72,179 +59,205 @@ async def cleanup_old_data():
 async def check_pending_bookings():
     """Проверка просроченных бронирований (не оплачены за 24 часа)"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Находим бронирования старше 24 часов в статусе pending
-            cutoff = (datetime.now() - timedelta(hours=24)).strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute('''
-                SELECT b.id, b.availability_id, b.customer_id, b.spot_id,
-                       u.telegram_id as customer_telegram_id,
-                       ps.spot_number
-                FROM bookings b
-                JOIN users u ON b.customer_id = u.id
-                JOIN parking_spots ps ON b.spot_id = ps.id
-                WHERE b.status = 'pending' AND b.created_at < ?
-            ''', (cutoff,))
-            
-            expired_bookings = cursor.fetchall()
-            
-            for booking in expired_bookings:
-                # Отменяем бронирование
-                cursor.execute('''
-                    UPDATE bookings SET status = 'cancelled' WHERE id = ?
-                ''', (booking['id'],))
-                
-                # Освобождаем слот
-                cursor.execute('''
-                    UPDATE spot_availability 
-                    SET is_booked = 0, booked_by = NULL, booking_id = NULL
-                    WHERE id = ?
-                ''', (booking['availability_id'],))
-                
-                # Уведомляем пользователя
-                if bot_instance:
-                    try:
-                        await bot_instance.send_message(
-                            booking['customer_telegram_id'],
-                            f"❌ <b>Бронирование отменено</b>\n\n"
-                            f"Ваше бронирование места {booking['spot_number']} "
-                            f"было автоматически отменено из-за отсутствия оплаты в течение 24 часов.",
-                            parse_mode="HTML"
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to notify about expired booking: {e}")
-            
-            if expired_bookings:
-                logger.info(f"Cancelled {len(expired_bookings)} expired bookings")
+        expired_bookings = await db.cancel_stale_pending_bookings(24)
+        
+        for booking in expired_bookings:
+            outbox.send(
+                booking['customer_telegram_id'],
+                f"❌ <b>Бронирование отменено</b>\n\n"
+                f"Ваше бронирование места {booking['spot_number']} "
+                f"было автоматически отменено из-за отсутствия оплаты в течение 24 часов.",
+                parse_mode="HTML"
+            )
+        
+        if expired_bookings:
+            logger.info(f"Cancelled {len(expired_bookings)} expired bookings")
                 
     except Exception as e:
         logger.error(f"Pending bookings check error: {e}")
 
 
-async def send_booking_reminders():
-    """Отправка напоминаний о предстоящих бронированиях (за 1 час)"""
+async def send_booking_reminder(bid: int):
+    """Напоминание о подтверждённой брони (за REMINDER_BEFORE_MINUTES до начала)"""
+    booking = await db.get_booking_full(bid)
+    if not booking or booking['status'] != 'confirmed':
+        return
+    start = datetime.fromisoformat(booking['start_time'])
+    if start <= now_local():
+        return
+    outbox.send(
+        booking['customer_telegram_id'],
+        f"⏰ <b>Напоминание!</b>\n\n"
+        f"Ваше бронирование места {booking['spot_number']} "
+        f"начнётся через ~1 час ({start.strftime('%H:%M')}).",
+        parse_mode="HTML"
+    )
+
+
+async def expire_unpaid(bid: int | None = None):
+    """Истечение неоплаченных броней: одной (точно в срок) или всех просроченных."""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Находим бронирования, которые начнутся через 1-2 часа
-            now = datetime.now()
-            in_1_hour = (now + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
-            in_2_hours = (now + timedelta(hours=2)).strftime("%Y-%m-%d %H:%M:%S")
-            
-            cursor.execute('''
-                SELECT b.id, b.start_time, b.end_time, b.total_price,
-                       u.telegram_id as customer_telegram_id,
-                       ps.spot_number,
-                       supplier.full_name as supplier_name
-                FROM bookings b
-                JOIN users u ON b.customer_id = u.id
-                JOIN parking_spots ps ON b.spot_id = ps.id
-                JOIN users supplier ON ps.supplier_id = supplier.id
-                WHERE b.status = 'confirmed' 
-                AND b.start_time BETWEEN ? AND ?
-            ''', (in_1_hour, in_2_hours))
-            
-            upcoming = cursor.fetchall()
-            
-            for booking in upcoming:
-                if bot_instance:
-                    try:
-                        start = datetime.fromisoformat(booking['start_time'])
-                        await bot_instance.send_message(
-                            booking['customer_telegram_id'],
-                            f"⏰ <b>Напоминание!</b>\n\n"
-                            f"Ваше бронирование места {booking['spot_number']} "
-                            f"начнётся через ~1 час ({start.strftime('%H:%M')}).",
-                            parse_mode="HTML"
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to send reminder: {e}")
-                        
+        expired = await db.expire_unpaid_bookings(BOOKING_TIMEOUT_MINUTES, booking_id=bid)
     except Exception as e:
-        logger.error(f"Reminders error: {e}")
+        logger.error(f"expire unpaid: {e}")
+        return
+    for item in expired:
+        outbox.send(
+            item['customer_telegram_id'],
+            f"⌛️ Бронь #{item['booking_id']} истекла (не оплачено в течение {BOOKING_TIMEOUT_MINUTES} минут).\n"
+            f"Если нужно — создайте бронь заново."
+        )
+
+
+async def auto_unban():
+    unbanned = await db.auto_unban_expired()
+    if unbanned:
+        logger.info(f"Auto-unbanned {unbanned} users")
+
+
+async def maintenance():
+    """Редкая периодическая уборка + страховочный проход по дедлайнам"""
+    await cleanup_old_data()
+    await check_pending_bookings()
+    await expire_unpaid()
+    await auto_unban()
+
+
+# ==================== ПЛАНИРОВАНИЕ ДЕДЛАЙНОВ ====================
+def _utc_ts(s: str) -> float:
+    return datetime.fromisoformat(str(s)).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _local_ts(s: str) -> float:
+    return datetime.fromisoformat(str(s)).replace(tzinfo=ZoneInfo(TIMEZONE)).timestamp()
+
 
+def plan_booking(b: dict):
+    """Ставит дедлайны брони: истечение неоплаченной и напоминание перед началом."""
+    bid = b['id']
+    if b.get('status') == 'pending' and b.get('payment_status', 'unpaid') == 'unpaid' and b.get('created_at'):
+        scheduler.schedule(f"expire:{bid}", _utc_ts(b['created_at']) + BOOKING_TIMEOUT_MINUTES * 60, expire_unpaid, bid)
+    if b.get('status') in ('pending', 'paid_wait_admin', 'confirmed') and b.get('start_time'):
+        remind_at = _local_ts(b['start_time']) - REMINDER_BEFORE_MINUTES * 60
+        # напоминание, проспанное больше чем на 10 минут (бот был выключен), уже не к месту
+        if remind_at > time.time() - 600:
+            scheduler.schedule(f"remind:{bid}", remind_at, send_booking_reminder, bid)
 
-async def background_tasks():
-    """Фоновые задачи"""
-    while True:
+
+async def _plan_booking_by_id(bid: int):
+    b = await db.get_booking_by_id(bid)
+    if b:
+        plan_booking(b)
+
+
+def plan_unban(user_id: int, banned_until: str):
+    # banned_until пишется через datetime.now() — локальное время сервера
+    scheduler.schedule(f"unban:{user_id}", datetime.fromisoformat(banned_until).timestamp() + 1, auto_unban)
+
+
+async def restore_schedule():
+    """Восстанавливает дедлайны из БД после рестарта"""
+    since = (now_local() - timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S")
+    snap = await db.get_schedule_snapshot(since)
+    for b in snap['unpaid']:
+        plan_booking(dict(b, status='pending', payment_status='unpaid'))
+    for b in snap['upcoming']:
+        plan_booking(b)
+    for u in snap['banned']:
         try:
-            await asyncio.sleep(300)  # Каждые 5 минут
-            
-            await cleanup_old_data()
-            await check_pending_bookings()
-            await send_booking_reminders()
-            
-            # Авто-разбан
-            unbanned = db.auto_unban_expired()
-            if unbanned:
-                logger.info(f"Auto-unbanned {unbanned} users")
-            
-        except asyncio.CancelledError:
-            logger.info("Background tasks cancelled")
-            break
-        except Exception as e:
-            logger.error(f"Background task error: {e}")
-            await asyncio.sleep(60)
+            plan_unban(u['id'], u['banned_until'])
+        except ValueError:
+            pass
+    logger.info(f"Scheduler restored: {scheduler.pending()} jobs")
+
+
+# Записи в БД сообщают о новых дедлайнах (колбэки идут из потока БД)
+db.subscribe('booking_changed', lambda bid: scheduler.submit(_plan_booking_by_id, bid))
+db.subscribe('user_banned', lambda uid, until: plan_unban(uid, until))
+
+
+def _register_collectors(storage: SQLiteStorage, throttling: ThrottlingMiddleware):
+    """Очереди и счётчики модулей — в /metrics (снимаются в момент запроса)."""
+    metrics.collect('parking_outbound_queued', "Outgoing messages waiting to be sent", outbox.queued)
+    metrics.collect('parking_scheduler_pending', "Scheduled jobs", scheduler.pending)
+    metrics.collect('parking_updates_running', "Updates being handled", lambda: executor.stats()['running'])
+    metrics.collect('parking_updates_waiting', "Updates queued behind their chat",
+                    lambda: executor.stats()['waiting'])
+    metrics.collect('parking_fsm_dirty', "FSM keys not yet flushed to SQLite", storage.pending)
+    metrics.collect('parking_throttled_total', "Updates dropped by throttling",
+                    lambda: throttling.stats['throttled'] + throttling.stats['duplicates'], kind='counter')
+    metrics.collect('parking_outbound_sent_total', "Messages sent by outbox",
+                    lambda: outbox.stats['sent'], kind='counter')
+
+
+_metrics_runner = None
 
 
 async def on_startup(bot: Bot):
     """Действия при запуске бота"""
-    global bot_instance
-    bot_instance = bot
-    
     logger.info("Bot is starting...")
     
     # Инициализация БД
-    db.init_database()
+    await db.init_database()
     logger.info("Database initialized")
     
     # Получаем информацию о боте
     bot_info = await bot.get_me()
     logger.info(f"Bot started: @{bot_info.username}")
     
-    # Запускаем фоновые задачи
-    asyncio.create_task(background_tasks())
-    logger.info("Background tasks started")
+    # Очередь исходящих сообщений (лимиты Telegram)
+    outbox.start(bot)
+    await broadcasts.resume_all()
+
+    # Планировщик: точные дедлайны из БД + редкая уборка
+    scheduler.start()
+    await restore_schedule()
+    scheduler.every("maintenance", MAINTENANCE_INTERVAL_SECONDS, maintenance, first=time.time())
+    if BACKUP_INTERVAL_HOURS > 0:
+        scheduler.every("backup", BACKUP_INTERVAL_HOURS * 3600, backup.scheduled_snapshot)
+    logger.info("Scheduler started")
+
+    # Prometheus-метрики на localhost (METRICS_PORT=0 — выключено)
+    global _metrics_runner
+    _metrics_runner = await metrics.start_server()
 
 
 async def on_shutdown(bot: Bot):
     """Действия при остановке бота"""
     logger.info("Bot is shutting down...")
+    await scheduler.stop()
+    await outbox.stop()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+    db.shutdown()
+    db.close_pool()
 
 
 
-async def expire_unpaid_loop(bot: Bot):
-    """Каждую минуту истекаем неоплаченные брони (таймаут берём из config)."""
-    from config import APP_VERSION, BOOKING_TIMEOUT_MINUTES
-    while True:
-        try:
-            expired = db.expire_unpaid_bookings(BOOKING_TIMEOUT_MINUTES)
-            for item in expired:
-                bid = item['booking_id']
-                tid = item['customer_telegram_id']
-                try:
-                    await bot.send_message(
-                        tid,
-                        f"⌛️ Бронь #{bid} истекла (не оплачено в течение {BOOKING_TIMEOUT_MINUTES} минут).\n"
-                        f"Если нужно — создайте бронь заново."
-                    )
-                except:
-                    pass
-        except Exception as e:
-            logger.error(f"expire loop: {e}")
-        await asyncio.sleep(60)
-
 async def main():
     # Инициализация БД до старта polling (на случай запуска без startup-hook)
-    db.init_database()
+    await db.init_database()
 
     bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-    # Фоновая задача: истечение неоплаченных броней
-    asyncio.create_task(expire_unpaid_loop(bot))
-    storage = MemoryStorage()
+    # FSM в SQLite: диалоги переживают рестарт. Dispatcher закрывает хранилище
+    # (дописывает изменения) до on_shutdown, то есть до остановки потоков БД.
+    storage = SQLiteStorage()
     dp = Dispatcher(storage=storage)
+    # Трасса апдейта: БД / Telegram / ожидание, медленные — в лог
+    dp.update.outer_middleware(tracing.TracingMiddleware())
+    # Анти-флуд: лишние апдейты отбрасываются до очереди чата
+    throttling = ThrottlingMiddleware()
+    dp.update.outer_middleware(throttling)
+    # Апдейты одного чата — строго по очереди, разных чатов — параллельно
+    dp.update.outer_middleware(ChatSerialMiddleware())
+    # Пользователь, бан и активные брони — одним запросом на апдейт
+    dp.update.outer_middleware(UserContextMiddleware())
+    # Метрики: время обработчиков и вызовов Bot API, очереди
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(metrics.TelegramMetricsMiddleware())
+    bot.session.middleware(tracing.TracingRequestMiddleware())
+    _register_collectors(storage, throttling)
     
     # Регистрируем роутеры
     # Важно: fallback_router ДОЛЖЕН быть последним, иначе он перехватит чужие callback'и.
@@ -257,6 +270,11 @@ async def main():
     dp.shutdown.register(on_shutdown)
     
     try:
+        if WEBHOOK_URL:
+            logger.info("Starting webhook...")
+            await webhook.run_webhook(dp, bot)
+            return
+
         # Удаляем вебхук если был
         await bot.delete_webhook(drop_pending_updates=True)
         
@@ -0,0 +1,243 @@
+"""
+Метрики ParkingBot
+
+Небольшой реестр в памяти (счётчики, гистограммы) и HTTP-эндпоинт
+METRICS_HOST:METRICS_PORT/metrics в текстовом формате Prometheus.
+Что измеряется:
+  - parking_handler_seconds{handler} — время обработчиков aiogram
+    (HandlerMetricsMiddleware в middlewares.py), ошибки — parking_handler_errors_total;
+  - parking_db_seconds{fn,kind} — выполнение функций database.py в потоке БД,
+    parking_db_wait_seconds{kind} — ожидание в очереди потоков (db_async);
+  - parking_telegram_seconds{method} / parking_telegram_errors_total — вызовы
+    Bot API (TelegramMetricsMiddleware на сессии бота);
+  - parking_job_seconds{job} — задачи планировщика (scheduler.py);
+  - очереди (outbox, планировщик, апдейты по чатам) — снимаются в момент
+    запроса через collect().
+observe() потокобезопасен: БД-метрики пишутся из потоков db_async.
+summary() — короткая сводка для админ-панели.
+"""
+import bisect
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, value: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def values(self) -> Dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for lv, v in sorted(self.values().items()):
+            out.append(f"{self.name}{_labels(self.labels, lv)} {v:g}")
+        return out
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как в Prometheus."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}   # метки → [counts по корзинам + +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += seconds
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def snapshot(self) -> Dict[tuple, dict]:
+        """{метки: {'count', 'sum', 'avg', 'p50', 'p95'}} (квантили — по корзинам)."""
+        with self._lock:
+            series = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        out = {}
+        for lv, (counts, total) in series.items():
+            n = sum(counts)
+            out[lv] = {'count': n, 'sum': total, 'avg': total / n if n else 0.0,
+                       'p50': self._quantile(counts, n, 0.5), 'p95': self._quantile(counts, n, 0.95)}
+        return out
+
+    def _quantile(self, counts, n, q) -> float:
+        if not n:
+            return 0.0
+        rank, seen = q * n, 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(v[0]), v[1]) for k, v in self._series.items())
+        for lv, counts, total in series:
+            acc = 0
+            for le, c in zip(self.buckets + (float('inf'),), counts):
+                acc += c
+                le_s = '+Inf' if le == float('inf') else f"{le:g}"
+                out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), lv + (le_s,))} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labels, lv)} {total:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labels, lv)} {acc}")
+        return out
+
+
+class _Timer:
+    __slots__ = ('hist', 'labels', 't0')
+
+    def __init__(self, hist: Histogram, labels: tuple):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+
+
+def _escape(v) -> str:
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+# ---------- реестр ----------
+handler_seconds = Histogram('parking_handler_seconds', "Handler execution time", ('handler',))
+handler_errors = Counter('parking_handler_errors_total', "Handler exceptions", ('handler', 'error'))
+db_seconds = Histogram('parking_db_seconds', "database.py call execution time", ('fn', 'kind'))
+db_wait_seconds = Histogram('parking_db_wait_seconds', "Wait for a DB thread", ('kind',))
+telegram_seconds = Histogram('parking_telegram_seconds', "Bot API call latency", ('method',))
+telegram_errors = Counter('parking_telegram_errors_total', "Bot API call errors", ('method', 'error'))
+job_seconds = Histogram('parking_job_seconds', "Scheduler job duration", ('job',))
+job_failures = Counter('parking_job_failures_total', "Scheduler job failures", ('job',))
+
+_METRICS = [handler_seconds, handler_errors, db_seconds, db_wait_seconds,
+            telegram_seconds, telegram_errors, job_seconds, job_failures]
+_collectors: list[tuple[str, str, str, Callable[[], float]]] = []
+
+
+def collect(name: str, help: str, fn: Callable[[], float], kind: str = 'gauge'):
+    """Значение, снимаемое в момент запроса /metrics (глубина очереди, счётчик модуля)."""
+    _collectors.append((name, help, kind, fn))
+
+
+def render() -> str:
+    lines = []
+    for m in _METRICS:
+        lines += m.render()
+    for name, help, kind, fn in _collectors:
+        try:
+            value = fn()
+        except Exception as e:
+            logger.warning(f"metric {name}: {e}")
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value:g}"]
+    return "\n".join(lines) + "\n"
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки каждого вызова Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, '__api_method__', type(method).__name__)
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - t0, name)
+
+
+# ---------- сводка и HTTP ----------
+def _top(hist: Histogram, n: int, key: str) -> list[tuple[tuple, dict]]:
+    return sorted(hist.snapshot().items(), key=lambda kv: kv[1][key], reverse=True)[:n]
+
+
+def _ms(s: float) -> str:
+    return f"{s * 1000:.0f}" if s >= 0.01 else f"{s * 1000:.1f}"
+
+
+def summary(n: int = 5) -> str:
+    """Текст для админ-панели: самые медленные обработчики, запросы к БД, вызовы API, очереди."""
+    parts = ["⏱ <b>Метрики</b> (с запуска; avg/p95, мс)"]
+
+    def section(title, rows, fmt):
+        if rows:
+            parts.append(f"\n<b>{title}</b>")
+            parts.extend(fmt(lv, s) for lv, s in rows)
+
+    section("Обработчики (по p95)", _top(handler_seconds, n, 'p95'),
+            lambda lv, s: f"{lv[0]}: {s['count']}× {_ms(s['avg'])}/{_ms(s['p95'])}")
+    section("БД (по суммарному времени)", _top(db_seconds, n, 'sum'),
+            lambda lv, s: f"{lv[0]}: {s['count']}× {_ms(s['avg'])}/{_ms(s['p95'])}")
+    tg_err = telegram_errors.values()
+    section("Telegram API", _top(telegram_seconds, n, 'sum'),
+            lambda lv, s: f"{lv[0]}: {s['count']}× {_ms(s['avg'])}/{_ms(s['p95'])}, "
+                          f"ошибок {sum(v for k, v in tg_err.items() if k[0] == lv[0]):g}")
+    section("Фоновые задачи", _top(job_seconds, n, 'sum'),
+            lambda lv, s: f"{lv[0]}: {s['count']}× {_ms(s['avg'])}/{_ms(s['p95'])}")
+    gauges = []
+    for name, _help, kind, fn in _collectors:
+        if kind == 'gauge':
+            try:
+                gauges.append(f"{name.replace('parking_', '')}={fn():g}")
+            except Exception:
+                pass
+    if gauges:
+        parts.append("\n<b>Очереди</b>\n" + ", ".join(gauges))
+    return "\n".join(parts)
+
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={
+        "Content-Type": "text/plain; version=0.0.4; charset=utf-8", "Cache-Control": "no-cache"})
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """HTTP /metrics; port 0 — выключено."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,225 @@
+"""
+Middleware ParkingBot
+"""
+import contextvars
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update, User
+
+import db_async as db
+import metrics
+import tracing
+from chat_executor import executor
+from config import (MIN_ACTION_INTERVAL, THROTTLE_BURST, THROTTLE_EXPENSIVE_INTERVAL, THROTTLE_EXPENSIVE_BURST,
+                    THROTTLE_DUPLICATE_SECONDS, THROTTLE_MAX_USERS)
+from outbound import outbox
+
+
+class UserContext:
+    """Пользователь текущего апдейта: строка users, бан, админ-флаг, активные брони.
+
+    Любая запись в БД через db_async в этом апдейте помечает контекст
+    устаревшим (stale) — дальше хелперы перечитывают пользователя из БД.
+    """
+    __slots__ = ('telegram_id', 'user', 'banned', 'ban_reason', 'banned_until',
+                 'active_bookings', 'stale')
+
+    def __init__(self, telegram_id: int, data: dict):
+        self.telegram_id = telegram_id
+        self.user = data['user']
+        self.banned = data['banned']
+        self.ban_reason = data['ban_reason']
+        self.banned_until = data['banned_until']
+        self.active_bookings = data['active_bookings']
+        self.stale = False
+
+    @property
+    def is_admin(self) -> bool:
+        return bool(self.user and self.user['role'] == 'admin')
+
+
+_current: contextvars.ContextVar[UserContext | None] = contextvars.ContextVar('user_ctx', default=None)
+
+
+def get_user_ctx(telegram_id: int | None = None) -> UserContext | None:
+    """Актуальный контекст текущего апдейта (для telegram_id, если указан) или None."""
+    ctx = _current.get()
+    if ctx is None or ctx.stale or (telegram_id is not None and ctx.telegram_id != telegram_id):
+        return None
+    return ctx
+
+
+async def current_user(telegram_id: int):
+    """Пользователь по telegram_id: из контекста апдейта, иначе из БД."""
+    ctx = get_user_ctx(telegram_id)
+    if ctx is not None:
+        return ctx.user
+    return await db.get_user_by_telegram_id(telegram_id)
+
+
+def _mark_stale():
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.stale = True
+
+
+db.after_write.append(_mark_stale)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Outer-middleware на update: один запрос к БД на апдейт вместо 5–8.
+
+    Кладёт UserContext в data['user_ctx'] (обработчик может принять его
+    аргументом user_ctx) и в contextvar для хелперов (_adm, _check_ban, ...).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user: User | None = data.get('event_from_user')
+        if from_user is None:
+            return await handler(event, data)
+        ctx = UserContext(from_user.id, await db.get_user_context(from_user.id))
+        data['user_ctx'] = ctx
+        token = _current.set(ctx)
+        try:
+            return await handler(event, data)
+        finally:
+            _current.reset(token)
+
+
+class ChatSerialMiddleware(BaseMiddleware):
+    """Outer-middleware на update: апдейты одного чата — по одному, разных — параллельно.
+
+    Регистрируется до UserContextMiddleware, чтобы контекст пользователя
+    читался уже в своей очереди (после завершения предыдущего апдейта).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get('event_chat')
+        from_user: User | None = data.get('event_from_user')
+        key = chat.id if chat is not None else (from_user.id if from_user is not None else None)
+        t0 = time.perf_counter()
+        async with executor.slot(key) as wait_ms:
+            tracing.record('chat_wait', t0, t0 + wait_ms / 1000)
+            return await handler(event, data)
+
+
+# Тяжёлые действия (скан слотов, выгрузка, рассылка, агрегаты) — отдельный, более строгий бюджет
+EXPENSIVE_TEXTS = frozenset({"📅 Найти место", "⏱ Ближайшие слоты"})
+EXPENSIVE_CALLBACKS = ("search_date_", "slots_prev_", "slots_next_", "admin_export", "exp_f_",
+                       "admin_broadcast", "admin_stats")
+
+
+class _Budget:
+    """Два token bucket пользователя (обычный и тяжёлый) + последний тап кнопки."""
+    __slots__ = ('cheap', 'expensive', 'ts', 'last_tap', 'last_tap_ts', 'warned')
+
+    def __init__(self, now: float):
+        self.cheap = float(THROTTLE_BURST)
+        self.expensive = float(THROTTLE_EXPENSIVE_BURST)
+        self.ts = now
+        self.last_tap = None
+        self.last_tap_ts = 0.0
+        self.warned = False
+
+    def take(self, now: float, expensive: bool) -> bool:
+        dt, self.ts = now - self.ts, now
+        self.cheap = min(THROTTLE_BURST, self.cheap + dt / MIN_ACTION_INTERVAL)
+        self.expensive = min(THROTTLE_EXPENSIVE_BURST, self.expensive + dt / THROTTLE_EXPENSIVE_INTERVAL)
+        if self.cheap < 1 or (expensive and self.expensive < 1):
+            return False
+        self.cheap -= 1
+        if expensive:
+            self.expensive -= 1
+        self.warned = False
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer-middleware на update: анти-флуд до постановки апдейта в очередь чата.
+
+    Лишние апдейты отбрасываются: повторный тап той же кнопки — молча,
+    сверх бюджета — с одним предупреждением на серию.
+    """
+
+    def __init__(self, max_users: int = THROTTLE_MAX_USERS):
+        self.max_users = max_users
+        self._users: OrderedDict[int, _Budget] = OrderedDict()
+        self.stats = {'passed': 0, 'throttled': 0, 'duplicates': 0}
+
+    def _budget(self, user_id: int, now: float) -> _Budget:
+        b = self._users.get(user_id)
+        if b is None:
+            b = self._users[user_id] = _Budget(now)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return b
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user: User | None = data.get('event_from_user')
+        if from_user is None or not isinstance(event, Update) or not (event.message or event.callback_query):
+            return await handler(event, data)
+        now = time.monotonic()
+        b = self._budget(from_user.id, now)
+        cq = event.callback_query
+        if cq is not None:
+            tap = (cq.message.message_id if cq.message else None, cq.data)
+            if tap == b.last_tap and now - b.last_tap_ts < THROTTLE_DUPLICATE_SECONDS:
+                self.stats['duplicates'] += 1
+                await cq.answer()
+                return None
+            b.last_tap, b.last_tap_ts = tap, now
+            expensive = bool(cq.data) and cq.data.startswith(EXPENSIVE_CALLBACKS)
+        else:
+            expensive = event.message.text in EXPENSIVE_TEXTS
+        if b.take(now, expensive):
+            self.stats['passed'] += 1
+            return await handler(event, data)
+        self.stats['throttled'] += 1
+        if cq is not None:
+            await cq.answer("⏳ Слишком часто, подождите пару секунд")
+        elif not b.warned:
+            b.warned = True
+            outbox.send(event.message.chat.id, "⏳ Слишком часто, подождите пару секунд.")
+        return None
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware (message, callback_query): время и ошибки каждого обработчика, спан в трассе."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        h = data.get('handler')
+        name = getattr(getattr(h, 'callback', None), '__name__', 'unknown')
+        t0 = time.perf_counter()
+        try:
+            with tracing.span(f"handler {name}"):
+                return await handler(event, data)
+        except Exception as e:
+            metrics.handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - t0, name)
@@ -0,0 +1,274 @@
+"""
+Очередь исходящих сообщений ParkingBot
+
+Все уведомления и рассылки идут через outbox: обработчик ставит сообщение
+в очередь и сразу отвечает, отправляют воркеры с учётом лимитов Telegram:
+  - общий token bucket (OUTBOUND_RATE сообщений/с на бота);
+  - не чаще одного сообщения в OUTBOUND_CHAT_INTERVAL секунд в один чат;
+  - RetryAfter (flood control) — пауза всей отправки на retry_after и повтор;
+  - Forbidden (бот заблокирован) — без повторов, считается отдельно.
+
+Сообщения одного чата уходят строго по порядку: у каждого чата своя
+очередь (deque), в общую очередь готовых попадает id чата, а не сообщение.
+Счётчики доставки ведутся по заданию (OutboundJob) — например, на рассылку.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.exceptions import (TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter,
+                                TelegramServerError)
+
+from config import OUTBOUND_RATE, OUTBOUND_CHAT_INTERVAL, OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """rate токенов в секунду, запас не больше burst. pause() — глобальный стоп (RetryAfter).
+
+    burst=1 — без всплесков: в любом окне в 1 с не больше rate+1 отправок.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = self.burst
+        self._ts = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboundJob:
+    """Счётчики доставки группы сообщений (рассылка, уведомления одного события)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+        self.skipped = 0
+        self.cancelled = False
+        self.closed = False
+        self.started = time.time()
+        self.finished: float | None = None
+        self._done = asyncio.Event()
+
+    @property
+    def pending(self) -> int:
+        return self.queued - self.sent - self.failed - self.blocked - self.skipped
+
+    def close(self):
+        """Больше сообщений в задание добавлять не будут."""
+        self.closed = True
+        self._check()
+
+    def cancel(self):
+        """Ещё не отправленные сообщения задания будут пропущены."""
+        self.cancelled = True
+
+    async def wait(self):
+        await self._done.wait()
+
+    def counts(self) -> dict:
+        return {'queued': self.queued, 'sent': self.sent, 'failed': self.failed, 'blocked': self.blocked,
+                'retried': self.retried, 'skipped': self.skipped, 'pending': self.pending}
+
+    def _check(self):
+        if self.closed and self.pending <= 0 and not self._done.is_set():
+            self.finished = time.time()
+            self._done.set()
+
+
+class _Msg:
+    __slots__ = ('method', 'chat_id', 'kwargs', 'job', 'on_sent', 'on_blocked', 'attempts')
+
+    def __init__(self, method, chat_id, kwargs, job, on_sent, on_blocked):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.job = job
+        self.on_sent = on_sent
+        self.on_blocked = on_blocked
+        self.attempts = 0
+
+
+class Outbox:
+    def __init__(self, rate: float = OUTBOUND_RATE, chat_interval: float = OUTBOUND_CHAT_INTERVAL,
+                 workers: int = OUTBOUND_WORKERS, max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bot = None
+        self._chats: dict[int, deque] = {}       # chat_id → очередь сообщений чата
+        self._next: dict[int, float] = {}        # chat_id → когда можно следующее (monotonic)
+        self._ready: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._backlog: list[int] = []            # чаты, поставленные до start()
+        self.stats = {'sent': 0, 'failed': 0, 'blocked': 0, 'retry_after': 0, 'retried': 0}
+
+    # ---------- запуск/остановка ----------
+    def start(self, bot):
+        self.bot = bot
+        self._ready = asyncio.Queue()
+        for chat_id in self._backlog:
+            self._ready.put_nowait(chat_id)
+        self._backlog.clear()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0):
+        """Даёт очереди дослаться (не дольше timeout), затем останавливает воркеров."""
+        deadline = time.monotonic() + timeout
+        while self._chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- API ----------
+    def job(self, name: str) -> OutboundJob:
+        return OutboundJob(name)
+
+    def send(self, chat_id: int, text: str, *, job: OutboundJob | None = None,
+             on_sent=None, on_blocked=None, **kwargs):
+        """Поставить send_message в очередь. Не ждёт отправки."""
+        self.enqueue('send_message', chat_id, job=job, on_sent=on_sent, on_blocked=on_blocked,
+                     text=text, **kwargs)
+
+    def enqueue(self, method: str, chat_id: int, *, job: OutboundJob | None = None,
+                on_sent=None, on_blocked=None, **kwargs):
+        """Любой метод бота с chat_id (send_photo, send_document, ...).
+
+        on_sent/on_blocked — корутины без аргументов, вызываются после доставки /
+        если пользователь заблокировал бота.
+        """
+        if not chat_id:
+            return
+        msg = _Msg(method, chat_id, kwargs, job, on_sent, on_blocked)
+        if job is not None:
+            job.queued += 1
+        q = self._chats.get(chat_id)
+        if q is not None:
+            q.append(msg)
+            return
+        self._chats[chat_id] = deque([msg])
+        self._wake(chat_id)
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self._chats.values())
+
+    # ---------- внутреннее ----------
+    def _wake(self, chat_id, delay: float | None = None):
+        if self._ready is None:
+            self._backlog.append(chat_id)
+            return
+        if delay is None:
+            delay = self._next.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    def _finish(self, chat_id):
+        self._next[chat_id] = time.monotonic() + self.chat_interval
+        q = self._chats.get(chat_id)
+        if q:
+            self._wake(chat_id, self.chat_interval)
+        else:
+            self._chats.pop(chat_id, None)
+            if len(self._next) > 10000:
+                now = time.monotonic()
+                self._next = {k: v for k, v in self._next.items() if v > now}
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            q = self._chats.get(chat_id)
+            if not q:
+                self._chats.pop(chat_id, None)
+                continue
+            msg = q[0]
+            job = msg.job
+            if job is not None and job.cancelled:
+                q.popleft()
+                job.skipped += 1
+                job._check()
+                if q:
+                    self._wake(chat_id, 0)
+                else:
+                    self._chats.pop(chat_id, None)
+                continue
+            await self.bucket.acquire()
+            try:
+                await getattr(self.bot, msg.method)(chat_id=chat_id, **msg.kwargs)
+            except TelegramRetryAfter as e:
+                self.stats['retry_after'] += 1
+                logger.warning(f"outbound: flood control, pause {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+                self._wake(chat_id, e.retry_after)
+                continue
+            except TelegramForbiddenError:
+                q.popleft()
+                self._done(msg, 'blocked')
+                if msg.on_blocked:
+                    await self._callback(msg.on_blocked)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                msg.attempts += 1
+                if msg.attempts <= self.max_retries:
+                    self.stats['retried'] += 1
+                    if job is not None:
+                        job.retried += 1
+                    self._wake(chat_id, 2 ** msg.attempts)
+                    continue
+                q.popleft()
+                logger.error(f"outbound {msg.method} to {chat_id}: {e}")
+                self._done(msg, 'failed')
+            except Exception as e:   # TelegramBadRequest и прочее — повтор не поможет
+                q.popleft()
+                logger.error(f"outbound {msg.method} to {chat_id}: {e}")
+                self._done(msg, 'failed')
+            else:
+                q.popleft()
+                self._done(msg, 'sent')
+                if msg.on_sent:
+                    await self._callback(msg.on_sent)
+            self._finish(chat_id)
+
+    def _done(self, msg: _Msg, outcome: str):
+        self.stats[outcome] += 1
+        if msg.job is not None:
+            setattr(msg.job, outcome, getattr(msg.job, outcome) + 1)
+            msg.job._check()
+
+    @staticmethod
+    async def _callback(fn):
+        try:
+            await fn()
+        except Exception as e:
+            logger.error(f"outbound callback: {e}")
+
+
+outbox = Outbox()
@@ -0,0 +1,144 @@
+"""
+Планировщик отложенных задач ParkingBot
+
+Одна корутина и куча (heapq) дедлайнов: спим ровно до ближайшего дедлайна
+или до добавления более раннего. Пока задач нет — никаких пробуждений.
+
+Задача идентифицируется ключом ("expire:15", "remind:15"): повторный
+schedule с тем же ключом переносит её, cancel — отменяет. Из куч записи
+удаляются лениво (по номеру версии), поэтому перенос стоит O(log n).
+schedule/cancel/submit можно вызывать из любого потока (например, из
+подписчиков database.subscribe, которые работают в потоке БД).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, int, str]] = []
+        self._jobs: dict[str, tuple[int, float, object, tuple]] = {}   # key → (seq, when, fn, args)
+        self._seq = itertools.count()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+        self.stats = {'scheduled': 0, 'fired': 0, 'failed': 0, 'cancelled': 0}
+
+    # ---------- запуск/остановка ----------
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._wake = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for t in list(self._running):
+            t.cancel()
+
+    # ---------- API ----------
+    def schedule(self, key: str, when: float, fn, *args):
+        """Запустить корутину fn(*args) в момент when (unix time). Заменяет задачу с тем же ключом."""
+        self._call(self._add, key, when, fn, args)
+
+    def every(self, key: str, interval: float, fn, *args, first: float | None = None):
+        """Периодическая задача: fn(*args) каждые interval секунд."""
+        async def periodic():
+            try:
+                await fn(*args)
+            finally:
+                self.schedule(key, time.time() + interval, periodic)
+        self.schedule(key, first if first is not None else time.time() + interval, periodic)
+
+    def cancel(self, key: str):
+        self._call(self._cancel, key)
+
+    def submit(self, fn, *args):
+        """Выполнить корутину fn(*args) как можно скорее (потокобезопасно)."""
+        self.schedule(f"submit:{next(self._seq)}", 0, fn, *args)
+
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def next_deadline(self) -> float | None:
+        return min((j[1] for j in self._jobs.values()), default=None)
+
+    # ---------- внутреннее ----------
+    def _call(self, fn, *args):
+        if self._loop is None or threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _add(self, key, when, fn, args):
+        seq = next(self._seq)
+        self._jobs[key] = (seq, when, fn, args)
+        heapq.heappush(self._heap, (when, seq, key))
+        self.stats['scheduled'] += 1
+        if self._wake is not None and self._heap[0][1] == seq:
+            self._wake.set()
+
+    def _cancel(self, key):
+        if self._jobs.pop(key, None) is not None:
+            self.stats['cancelled'] += 1
+
+    def _pop_due(self, now: float):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, seq, key = heapq.heappop(self._heap)
+            job = self._jobs.get(key)
+            if job is None or job[0] != seq:
+                continue  # отменена или перенесена
+            del self._jobs[key]
+            due.append((key, job[2], job[3]))
+        # выбрасываем устаревшие записи с вершины, чтобы не просыпаться зря
+        while self._heap and (self._jobs.get(self._heap[0][2], (None,))[0] != self._heap[0][1]):
+            heapq.heappop(self._heap)
+        return due
+
+    async def _fire(self, key, fn, args):
+        job = getattr(fn, '__name__', 'job') if key.startswith('submit:') else key.split(':')[0]
+        t0 = time.perf_counter()
+        try:
+            await fn(*args)
+            self.stats['fired'] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats['failed'] += 1
+            metrics.job_failures.inc(job)
+            logger.error(f"scheduled job {key}: {e}")
+        finally:
+            metrics.job_seconds.observe(time.perf_counter() - t0, job)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            for key, fn, args in self._pop_due(time.time()):
+                t = asyncio.create_task(self._fire(key, fn, args))
+                self._running.add(t)
+                t.add_done_callback(self._running.discard)
+            timeout = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = Scheduler()
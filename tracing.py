@@ -0,0 +1,184 @@
+"""
+Трассировка апдейтов ParkingBot
+
+На каждый апдейт TracingMiddleware (первый outer-middleware на update)
+открывает корневой спан; внутри него записываются дочерние:
+  - chat_wait — ожидание своей очереди в чате (chat_executor);
+  - handler <имя> — обработчик aiogram;
+  - db.<функция> — каждый вызов database.py через db_async (с ожиданием
+    потока БД, wait_ms — там видно busy_timeout и очередь писателя);
+  - tg.<метод> — каждый вызов Bot API из обработчика (answer, edit_text, ...).
+Текущий спан — в contextvar, поэтому без трассы (фоновые задачи, outbox)
+span()/record() ничего не делают.
+
+Апдейт дольше TRACE_SLOW_MS пишется в лог WARNING деревом спанов с итогом
+«БД / Telegram / очередь чата / остальное»; последние TRACE_KEEP_SLOW таких деревьев — в
+recent_slow. В одной трассе не больше TRACE_MAX_SPANS спанов (остальные
+только считаются).
+"""
+import contextvars
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import TRACE_SLOW_MS, TRACE_MAX_SPANS, TRACE_KEEP_SLOW
+
+logger = logging.getLogger(__name__)
+
+
+class _Trace:
+    __slots__ = ('spans', 'dropped', 'done')
+
+    def __init__(self):
+        self.spans = 1
+        self.dropped = 0
+        self.done = False   # задачи, запущенные из обработчика, переживают апдейт — их не пишем
+
+
+class Span:
+    __slots__ = ('name', 'start', 'end', 'attrs', 'children', 'trace')
+
+    def __init__(self, name: str, start: float, trace: _Trace, attrs: Optional[dict] = None):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.attrs = attrs or {}
+        self.children: list[Span] = []
+        self.trace = trace
+
+    @property
+    def ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def _child(self, name: str, start: float, attrs: dict) -> Optional['Span']:
+        if self.trace.done:
+            return None
+        if self.trace.spans >= TRACE_MAX_SPANS:
+            self.trace.dropped += 1
+            return None
+        self.trace.spans += 1
+        s = Span(name, start, self.trace, attrs)
+        self.children.append(s)
+        return s
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('trace_span', default=None)
+recent_slow: deque = deque(maxlen=max(1, TRACE_KEEP_SLOW))
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Дочерний спан текущей трассы на время блока (вне трассы — ничего)."""
+    parent = _current.get()
+    s = parent._child(name, time.perf_counter(), attrs) if parent is not None else None
+    if s is None:
+        yield None
+        return
+    token = _current.set(s)
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+
+
+def record(name: str, start: float, end: float, **attrs):
+    """Уже завершённый дочерний спан (времена — time.perf_counter())."""
+    parent = _current.get()
+    if parent is not None:
+        s = parent._child(name, start, attrs)
+        if s is not None:
+            s.end = end
+
+
+def _describe(update: Update) -> str:
+    # Только тип и данные кнопок: текст сообщений может содержать телефон, карту и т.п.
+    if update.callback_query is not None:
+        return f"callback_query {update.callback_query.data!r}"
+    if update.message is not None:
+        text = update.message.text or ''
+        ct = update.message.content_type
+        return f"message {text.split()[0]!r}" if text.startswith('/') else f"message {getattr(ct, 'value', ct)}"
+    try:
+        return update.event_type
+    except Exception:
+        return "update"
+
+
+def _totals(root: Span) -> tuple[float, float, float]:
+    db = tg = wait = 0.0
+    stack = list(root.children)
+    while stack:
+        s = stack.pop()
+        if s.name.startswith('db.'):
+            db += s.ms
+        elif s.name.startswith('tg.'):
+            tg += s.ms
+        elif s.name == 'chat_wait':
+            wait += s.ms
+        else:
+            stack.extend(s.children)
+    return db, tg, wait
+
+
+def render(root: Span) -> str:
+    """Дерево спанов: смещение от начала апдейта, длительность, атрибуты."""
+    lines = []
+
+    def walk(s: Span, depth: int):
+        attrs = "".join(f" {k}={v}" for k, v in s.attrs.items())
+        lines.append(f"{'  ' * depth}+{(s.start - root.start) * 1000:.1f} {s.name} {s.ms:.1f} ms{attrs}")
+        for c in s.children:
+            walk(c, depth + 1)
+
+    walk(root, 0)
+    db, tg, wait = _totals(root)
+    total = root.ms
+    lines.append(f"total {total:.1f} ms: db {db:.1f}, telegram {tg:.1f}, chat wait {wait:.1f}, "
+                 f"other {max(0.0, total - db - tg - wait):.1f}"
+                 + (f" ({root.trace.dropped} spans dropped)" if root.trace.dropped else ""))
+    return "\n".join(lines)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer-middleware на update: корневой спан и лог медленных апдейтов."""
+
+    def __init__(self, slow_ms: float = TRACE_SLOW_MS):
+        self.slow_ms = slow_ms
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.slow_ms <= 0 or not isinstance(event, Update):
+            return await handler(event, data)
+        from_user = data.get('event_from_user')
+        attrs = {'user': from_user.id} if from_user is not None else {}
+        root = Span(f"update {event.update_id} {_describe(event)}", time.perf_counter(), _Trace(), attrs)
+        token = _current.set(root)
+        try:
+            return await handler(event, data)
+        finally:
+            root.end = time.perf_counter()
+            root.trace.done = True
+            _current.reset(token)
+            if root.ms >= self.slow_ms:
+                tree = render(root)
+                recent_slow.append(tree)
+                logger.warning(f"slow update ({root.ms:.0f} ms):\n{tree}")
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: спан tg.<метод> на каждый вызов Bot API внутри апдейта."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"tg.{getattr(method, '__api_method__', type(method).__name__)}"):
+            return await make_request(bot, method)
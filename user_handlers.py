@@ -3,6 +3,7 @@
 """
 import logging
 import re
+from functools import partial
 from datetime import datetime, timedelta
 
 from datetime import datetime
@@ -17,7 +18,9 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-import database as db
+import db_async as db
+from middlewares import current_user, get_user_ctx
+from outbound import outbox
 from config import BANKS, MAX_ACTIVE_BOOKINGS, MAX_SPOTS_PER_USER, ABOUT_TEXT, RULES_TEXT, TIME_STEP_MINUTES, WORKING_HOURS_START, WORKING_HOURS_END, MIN_BOOKING_MINUTES, AVAILABILITY_LOOKAHEAD_DAYS, ADMIN_CHECK_USERNAME, CARD_NUMBER, TIMEZONE, FIXED_ADDRESS, PRICE_TOTAL_BY_HOURS, WELCOME_TEXT
 from keyboards import *
 from utils import *
@@ -106,18 +109,32 @@ class EditSlotStates(StatesGroup):
     waiting_end_time = State()
 
 # ==================== HELPERS ====================
-def _adm(tid):
-    u = db.get_user_by_telegram_id(tid)
+async def _adm(tid):
+    ctx = get_user_ctx(tid)
+    if ctx is not None:
+        return ctx.is_admin
+    u = await db.get_user_by_telegram_id(tid)
     return u and u['role'] == 'admin'
 
+async def _active_bookings(tid, uid):
+    ctx = get_user_ctx(tid)
+    if ctx is not None:
+        return ctx.active_bookings
+    return await db.get_active_bookings_count(uid)
+
 def _cancel_check(text):
     return text and text in ["❌ Отмена", "🔙 Главное меню"]
 
 async def _check_ban(msg_or_cb):
     tid = msg_or_cb.from_user.id
-    user = db.get_user_by_telegram_id(tid)
-    if not user: return False
-    banned, reason, until = db.is_user_banned(user)
+    ctx = get_user_ctx(tid)
+    if ctx is not None:
+        if not ctx.user: return False
+        banned, reason, until = ctx.banned, ctx.ban_reason, ctx.banned_until
+    else:
+        user = await db.get_user_by_telegram_id(tid)
+        if not user: return False
+        banned, reason, until = await db.is_user_banned(user)
     if banned:
         t = "🚫 Вы заблокированы"
         if until: t += f" до {format_datetime(datetime.fromisoformat(until))}"
@@ -135,16 +152,16 @@ async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
     # Синхронизируем username из Telegram всегда, чтобы он "притягивался" независимо от телефона.
     tg_username = message.from_user.username or ""
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if user:
         # Если пользователь поменял username или он был пустым — обновляем.
         try:
             if tg_username and tg_username != (user.get('username') or ""):
-                db.update_user(user['id'], username=tg_username)
+                await db.update_user(user['id'], username=tg_username)
                 user['username'] = tg_username
         except Exception:
             pass
-        banned, reason, until = db.is_user_banned(user)
+        banned, reason, until = await db.is_user_banned(user)
         if banned:
             t = "🚫 Вы заблокированы"
             if until: t += f" до {format_datetime(datetime.fromisoformat(until))}"
@@ -158,7 +175,7 @@ async def cmd_start(message: Message, state: FSMContext):
 
         await message.answer(f"👋 <b>{user['full_name']}</b>, выберите действие:",
             reply_markup=get_main_menu_keyboard(user['role']=='admin'), parse_mode="HTML")
-        unreviewed = db.get_completed_unreviewed_bookings(user['id'])
+        unreviewed = await db.get_completed_unreviewed_bookings(user['id'])
         if unreviewed:
             b = unreviewed[0]
             await message.answer(
@@ -204,7 +221,7 @@ async def reg_phone(message: Message, state: FSMContext):
         if not ok: await message.answer(r); return
     data = await state.get_data()
     tg_username = message.from_user.username or data.get('tg_username', "") or ""
-    db.create_user(
+    await db.create_user(
         telegram_id=message.from_user.id,
         username=tg_username,
         full_name=data['full_name'],
@@ -220,26 +237,26 @@ async def reg_phone(message: Message, state: FSMContext):
 @router.message(F.text == "🔙 Главное меню")
 async def go_menu(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("🏠", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+    await message.answer("🏠", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 @router.message(F.text == "❌ Отмена")
 async def cancel_msg(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("❌ Отменено.", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+    await message.answer("❌ Отменено.", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 @router.callback_query(F.data == "cancel")
 async def cancel_cb(callback: CallbackQuery, state: FSMContext):
     await callback.answer(); await state.clear()
     try: await callback.message.edit_text("❌ Отменено.")
     except: pass
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.callback_query(F.data == "main_menu")
 async def menu_cb(callback: CallbackQuery, state: FSMContext):
     await callback.answer(); await state.clear()
     try: await callback.message.edit_text("🏠")
     except: pass
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 
 # ==================== О СЕРВИСЕ / ПРАВИЛА ====================
@@ -289,24 +306,29 @@ async def rules(message: Message):
 
 
 # ==================== SEARCH ====================
+def _slots_kb(page: dict):
+    """Клавиатура страницы поиска (db.get_available_slots_page) с кнопками листания."""
+    return get_available_slots_keyboard(page['slots'], page['prev'], page['next'])
+
+
 @router.message(F.text == "📅 Найти место")
 async def search_start(message: Message, state: FSMContext):
     if await _check_ban(message): return
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user: await message.answer("❌ /start"); return
     if not db.user_has_car_info(user):
         await state.update_data(pending_action='search')
         await message.answer("🚗 <b>Нужны данные авто</b>\n\nГос. номер:",
             reply_markup=get_cancel_menu_keyboard(), parse_mode="HTML")
         await state.set_state(CarInfoStates.waiting_license_plate); return
-    await state.update_data(user_id=user['id'])
-    slots = db.get_available_slots(None, exclude_supplier=user['id'])
-    if not slots:
+    await state.update_data(user_id=user['id'], search_date=None)
+    page = await db.get_available_slots_page(None, exclude_supplier=user['id'])
+    if not page['slots']:
         await message.answer("😔 Нет доступных мест.", reply_markup=get_no_slots_keyboard(), parse_mode="HTML")
     else:
         await message.answer(
-            f"🏠 <b>Доступные места ({len(slots)})</b>",
-            reply_markup=get_available_slots_keyboard(slots),
+            f"🏠 <b>Доступные места ({page['total']})</b>",
+            reply_markup=_slots_kb(page),
             parse_mode="HTML",
         )
     await state.set_state(SearchStates.selecting_slot)
@@ -337,28 +359,28 @@ async def car_color(message: Message, state: FSMContext):
     ok, r = validate_car_color(message.text)
     if not ok: await message.answer(r); return
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(message.from_user.id)
-    db.update_user(user['id'], license_plate=data['license_plate'], car_brand=data['car_brand'], car_color=r)
+    user = await current_user(message.from_user.id)
+    await db.update_user(user['id'], license_plate=data['license_plate'], car_brand=data['car_brand'], car_color=r)
     pending = data.get('pending_action')
     await state.clear()
     if pending == 'search':
-        await state.update_data(user_id=user['id'])
-        slots = db.get_available_slots(None, exclude_supplier=user['id'])
-        if not slots:
+        await state.update_data(user_id=user['id'], search_date=None)
+        page = await db.get_available_slots_page(None, exclude_supplier=user['id'])
+        if not page['slots']:
             await message.answer("✅ Авто сохранено!\n\n😔 Нет мест.", reply_markup=get_no_slots_keyboard())
         else:
-            await message.answer(f"✅ Авто!\n\n🏠 <b>Места ({len(slots)})</b>\n\n",
-                reply_markup=get_available_slots_keyboard(slots), parse_mode="HTML")
+            await message.answer(f"✅ Авто!\n\n🏠 <b>Места ({page['total']})</b>\n\n",
+                reply_markup=_slots_kb(page), parse_mode="HTML")
         await state.set_state(SearchStates.selecting_slot)
     else:
-        await message.answer("✅ Авто обновлено!", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+        await message.answer("✅ Авто обновлено!", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 
 # SEARCH FILTER
 @router.callback_query(F.data == "search_filter")
 async def search_filter(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
+    user = await current_user(callback.from_user.id)
     if user: await state.update_data(user_id=user['id'])
     await callback.message.edit_text("📅 <b>Фильтр по дате</b>:",
         reply_markup=get_dates_keyboard("search_date"), parse_mode="HTML")
@@ -374,27 +396,30 @@ async def search_date(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("📅 <b>ДД.ММ.ГГГГ</b>:", parse_mode="HTML")
         await state.set_state(SearchStates.waiting_date_manual); return
     if dv == "all":
-        slots = db.get_available_slots(None, exclude_supplier=uid)
-        if not slots:
+        await state.update_data(search_date=None)
+        page = await db.get_available_slots_page(None, exclude_supplier=uid)
+        if not page['slots']:
             await callback.message.edit_text("😔 Нет мест.", reply_markup=get_no_slots_keyboard())
         else:
-            await callback.message.edit_text(f"🏠 <b>Все ({len(slots)})</b>\n\n",
-                reply_markup=get_available_slots_keyboard(slots), parse_mode="HTML")
+            await callback.message.edit_text(f"🏠 <b>Все ({page['total']})</b>\n\n",
+                reply_markup=_slots_kb(page), parse_mode="HTML")
         await state.set_state(SearchStates.selecting_slot); return
     ok, _ = validate_date(dv)
     if not ok: return
     date_obj = datetime.strptime(dv, "%d.%m.%Y")
-    slots = db.get_available_slots(date_obj.strftime("%Y-%m-%d"), exclude_supplier=uid)
-    if not slots:
-        all_s = db.get_available_slots(None, exclude_supplier=uid)
-        if all_s:
-            await callback.message.edit_text(f"😔 На {dv} нет.\n\n🏠 <b>Все ({len(all_s)})</b>:",
-                reply_markup=get_available_slots_keyboard(all_s), parse_mode="HTML")
+    page = await db.get_available_slots_page(date_obj.strftime("%Y-%m-%d"), exclude_supplier=uid)
+    if not page['slots']:
+        await state.update_data(search_date=None)
+        page = await db.get_available_slots_page(None, exclude_supplier=uid)
+        if page['slots']:
+            await callback.message.edit_text(f"😔 На {dv} нет.\n\n🏠 <b>Все ({page['total']})</b>:",
+                reply_markup=_slots_kb(page), parse_mode="HTML")
         else:
             await callback.message.edit_text("😔 Нет мест.", reply_markup=get_no_slots_keyboard())
     else:
-        await callback.message.edit_text(f"🏠 <b>На {dv} ({len(slots)})</b>\n\n",
-            reply_markup=get_available_slots_keyboard(slots), parse_mode="HTML")
+        await state.update_data(search_date=date_obj.strftime("%Y-%m-%d"))
+        await callback.message.edit_text(f"🏠 <b>На {dv} ({page['total']})</b>\n\n",
+            reply_markup=_slots_kb(page), parse_mode="HTML")
     await state.set_state(SearchStates.selecting_slot)
 
 @router.message(SearchStates.waiting_date_manual)
@@ -405,19 +430,43 @@ async def search_date_m(message: Message, state: FSMContext):
     data = await state.get_data()
     uid = data.get('user_id')
     date_obj = datetime.strptime(message.text, "%d.%m.%Y")
-    slots = db.get_available_slots(date_obj.strftime("%Y-%m-%d"), exclude_supplier=uid)
-    if not slots:
-        all_s = db.get_available_slots(None, exclude_supplier=uid)
-        if all_s:
-            await message.answer(f"😔 Нет на {message.text}.\n\n🏠 <b>Все ({len(all_s)})</b>:",
-                reply_markup=get_available_slots_keyboard(all_s), parse_mode="HTML")
+    page = await db.get_available_slots_page(date_obj.strftime("%Y-%m-%d"), exclude_supplier=uid)
+    if not page['slots']:
+        await state.update_data(search_date=None)
+        page = await db.get_available_slots_page(None, exclude_supplier=uid)
+        if page['slots']:
+            await message.answer(f"😔 Нет на {message.text}.\n\n🏠 <b>Все ({page['total']})</b>:",
+                reply_markup=_slots_kb(page), parse_mode="HTML")
         else: await message.answer("😔 Нет мест.", reply_markup=get_no_slots_keyboard())
     else:
-        await message.answer(f"🏠 <b>На {message.text} ({len(slots)})</b>\n\n",
-            reply_markup=get_available_slots_keyboard(slots), parse_mode="HTML")
+        await state.update_data(search_date=date_obj.strftime("%Y-%m-%d"))
+        await message.answer(f"🏠 <b>На {message.text} ({page['total']})</b>\n\n",
+            reply_markup=_slots_kb(page), parse_mode="HTML")
     await state.set_state(SearchStates.selecting_slot)
 
 
+@router.callback_query(SearchStates.selecting_slot, F.data.startswith("slots_prev_") | F.data.startswith("slots_next_"))
+async def search_page(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    _, direction, start, sid = callback.data.split("_")
+    cursor = (int(start), int(sid))
+    data = await state.get_data()
+    date_str = data.get('search_date')
+    page = await db.get_available_slots_page(
+        date_str, exclude_supplier=data.get('user_id'),
+        after=cursor if direction == "next" else None,
+        before=cursor if direction == "prev" else None)
+    if not page['slots']:
+        # страницу успели разобрать — начинаем с первой
+        page = await db.get_available_slots_page(date_str, exclude_supplier=data.get('user_id'))
+    if not page['slots']:
+        await callback.message.edit_text("😔 Нет мест.", reply_markup=get_no_slots_keyboard())
+        return
+    title = f"На {datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')}" if date_str else "Доступные места"
+    await callback.message.edit_text(f"🏠 <b>{title} ({page['total']})</b>",
+        reply_markup=_slots_kb(page), parse_mode="HTML")
+
+
 # ==================== SLOT SELECTION & BOOKING ====================
 def _date_range_kb(slot_start, slot_end, prefix):
     buttons = []; dates = []; d = slot_start.date()
@@ -430,15 +479,20 @@ def _date_range_kb(slot_start, slot_end, prefix):
     buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def _time_range_kb(start_dt, end_dt, prefix, include_end: bool = False):
-    buttons = []; times = []; t = start_dt.replace(minute=0, second=0)
+def _time_range_kb(start_dt, end_dt, prefix, include_end: bool = False, price_from=None):
+    """Кнопки времени с шагом в час. price_from — начало брони: на кнопках окончания показываем итоговую цену."""
+    buttons = []; points = []; t = start_dt.replace(minute=0, second=0)
     if t < start_dt: t += timedelta(hours=1)
     while t < end_dt or (include_end and t == end_dt):
-        times.append(t.strftime("%H:%M")); t += timedelta(hours=1)
-    if not times and start_dt < end_dt:
-        times.append(start_dt.strftime("%H:%M"))
+        points.append(t); t += timedelta(hours=1)
+    if not points and start_dt < end_dt:
+        points.append(start_dt)
+    times = [p.strftime("%H:%M") for p in points]
+    labels = times
+    if price_from is not None:
+        labels = [f"{tm} · {p}₽" for tm, p in zip(times, calculate_prices([(price_from, p) for p in points]))]
     for i in range(0, len(times), 3):
-        buttons.append([InlineKeyboardButton(text=times[j], callback_data=f"{prefix}_{times[j]}")
+        buttons.append([InlineKeyboardButton(text=labels[j], callback_data=f"{prefix}_{times[j]}")
                for j in range(i, min(i+3, len(times)))])
     buttons.append([InlineKeyboardButton(text="📅 Весь слот", callback_data=f"{prefix}_full")])
     buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")])
@@ -464,23 +518,23 @@ async def select_slot(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     if await _check_ban(callback): return
     slot_id = int(callback.data.replace("slot_",""))
-    slot = db.get_availability_by_id(slot_id)
+    slot = await db.get_availability_by_id(slot_id)
     if not slot or slot['is_booked']:
         await callback.message.edit_text("❌ Слот уже занят или не найден."); return
-    user = db.get_user_by_telegram_id(callback.from_user.id)
+    user = await current_user(callback.from_user.id)
     if not user: return
     uid = user['id']
     await state.update_data(user_id=uid)
     if slot['supplier_id'] == uid:
         await callback.message.answer("❌ Нельзя бронировать своё место."); return
-    if db.is_blacklisted_either(uid, slot['supplier_id']):
+    if await db.is_blacklisted_either(uid, slot['supplier_id']):
         await callback.message.answer("❌ Бронирование невозможно."); return
-    if db.get_active_bookings_count(uid) >= MAX_ACTIVE_BOOKINGS:
+    if await _active_bookings(callback.from_user.id, uid) >= MAX_ACTIVE_BOOKINGS:
         await callback.message.answer(f"❌ Лимит бронирований ({MAX_ACTIVE_BOOKINGS})."); return
     sdt = datetime.fromisoformat(slot['start_time'])
     edt = datetime.fromisoformat(slot['end_time'])
     hours = (edt - sdt).total_seconds() / 3600
-    avg_r, cnt_r = db.get_spot_rating(slot['spot_id'])
+    avg_r, cnt_r = await db.get_spot_rating(slot['spot_id'])
     rating = f" | ⭐ {avg_r}/5 ({cnt_r})" if cnt_r else ""
     try:
         full_price = calculate_price(sdt, edt)
@@ -579,7 +633,7 @@ async def bk_start_time(callback: CallbackQuery, state: FSMContext):
         await state.set_state(SearchStates.selecting_end_date)
     else:
         await callback.message.edit_text(f"📅 Начало: <b>{format_datetime(bs)}</b>\n\n⏰ <b>Время окончания</b>:",
-            reply_markup=_time_range_kb(bs + timedelta(hours=1), edt, "bket", include_end=True), parse_mode="HTML")
+            reply_markup=_time_range_kb(bs + timedelta(hours=1), edt, "bket", include_end=True, price_from=bs), parse_mode="HTML")
         await state.set_state(SearchStates.selecting_end_time)
 
 # Booking: End Date
@@ -605,7 +659,7 @@ async def bk_end_date(callback: CallbackQuery, state: FSMContext):
     t_from = bs + timedelta(hours=1) if picked == bs.date() else datetime.combine(picked, datetime.min.time().replace(hour=1))
     t_to = edt if picked == edt.date() else datetime.combine(picked, datetime.max.time().replace(hour=23, minute=0, second=0, microsecond=0))
     await callback.message.edit_text(f"📅 {format_datetime(bs)} — <b>{picked.strftime('%d.%m.%Y')}</b>\n\n⏰ <b>Время окончания</b>:",
-        reply_markup=_time_range_kb(t_from, t_to, "bket", include_end=True), parse_mode="HTML")
+        reply_markup=_time_range_kb(t_from, t_to, "bket", include_end=True, price_from=bs), parse_mode="HTML")
     await state.set_state(SearchStates.selecting_end_time)
 
 # Booking: End Time
@@ -641,13 +695,13 @@ async def confirm_booking(callback: CallbackQuery, state: FSMContext):
     if callback.data == "booking_confirm_no":
         await state.clear()
         await callback.message.edit_text("❌ Отменено.")
-        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id))); return
+        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id))); return
     data = await state.get_data()
     needed = ('user_id','spot_id','selected_slot_id','start_time','end_time','total_price')
     if not all(k in data for k in needed):
         await state.clear(); await callback.message.edit_text("❌ Данные потеряны."); return
     try:
-        bid = db.create_booking(data['user_id'], data['spot_id'], data['selected_slot_id'],
+        bid = await db.create_booking(data['user_id'], data['spot_id'], data['selected_slot_id'],
                                 data['start_time'], data['end_time'], data['total_price'])
     except Exception as e:
         logger.error(f"Booking: {e}")
@@ -665,11 +719,11 @@ async def confirm_booking(callback: CallbackQuery, state: FSMContext):
         await state.clear()
         await callback.message.edit_text(text)
         return
-    user = db.get_user_by_telegram_id(callback.from_user.id)
+    user = await current_user(callback.from_user.id)
     await state.clear()
     h = (data['end_time'] - data['start_time']).total_seconds() / 3600
     rate = get_price_per_hour(h)
-    supplier = db.get_user_by_id(data.get('supplier_id')) if data.get('supplier_id') else None
+    supplier = await db.get_user_by_id(data.get('supplier_id')) if data.get('supplier_id') else None
     card_number = ""
     bank_name = ""
     if supplier and supplier.get('card_number'):
@@ -719,7 +773,7 @@ async def confirm_booking(callback: CallbackQuery, state: FSMContext):
         except Exception:
             pass
 
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
     # Админам
     try:
         car = ""
@@ -727,8 +781,8 @@ async def confirm_booking(callback: CallbackQuery, state: FSMContext):
             car = f"\n🚗 {user['car_brand']} {user['car_color']} ({user['license_plate']})"
         cust_info = f"👤 {user['full_name']}\n📞 {user['phone']}"
         if user.get('username'): cust_info += f"\n📱 @{user['username']}"
-        supplier = db.get_user_by_id(data.get('supplier_id'))
-        await callback.bot.send_message(data.get('supplier_telegram_id'),
+        supplier = await db.get_user_by_id(data.get('supplier_id'))
+        outbox.send(data.get('supplier_telegram_id'),
             f"📋 <b>Новая заявка #{bid}!</b>\n🏠 {data.get('spot_number','')}\n"
             f"📅 {format_datetime(data['start_time'])} — {format_datetime(data['end_time'])}\n"
             f"⏳ Ожидает подтверждения.", parse_mode="HTML")
@@ -739,7 +793,7 @@ async def confirm_booking(callback: CallbackQuery, state: FSMContext):
 @router.message(F.text == "➕ Добавить место")
 async def add_spot_start(message: Message, state: FSMContext):
     if await _check_ban(message): return
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user: await message.answer("❌ /start"); return
     if not db.user_has_card_info(user):
         await state.update_data(pending_action='add_spot', supplier_id=user['id'])
@@ -747,7 +801,7 @@ async def add_spot_start(message: Message, state: FSMContext):
             reply_markup=get_cancel_menu_keyboard(), parse_mode="HTML")
         await state.set_state(CardInfoStates.waiting_card); return
     # Если есть места — показать их + кнопку "Новое место"
-    existing = db.get_user_spots(user['id'])
+    existing = await db.get_user_spots(user['id'])
     await state.update_data(supplier_id=user['id'])
     if existing:
         buttons = []
@@ -784,8 +838,8 @@ async def card_bank(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("🏦 Введите название банка:")
         await state.set_state(CardInfoStates.waiting_bank_name); return
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
-    db.update_user(user['id'], card_number=data['card_number'], bank=bank)
+    user = await current_user(callback.from_user.id)
+    await db.update_user(user['id'], card_number=data['card_number'], bank=bank)
     pending = data.get('pending_action')
     await state.clear()
     if pending == 'add_spot':
@@ -795,7 +849,7 @@ async def card_bank(callback: CallbackQuery, state: FSMContext):
         await state.set_state(AddSpotStates.waiting_spot_number)
     else:
         await callback.message.edit_text(f"✅ Карта: {bank}")
-        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.message(CardInfoStates.waiting_bank_name)
 async def card_bank_manual(message: Message, state: FSMContext):
@@ -803,8 +857,8 @@ async def card_bank_manual(message: Message, state: FSMContext):
     bank = message.text.strip()
     if len(bank) < 2 or len(bank) > 30: await message.answer("❌ 2-30 символов"); return
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(message.from_user.id)
-    db.update_user(user['id'], card_number=data['card_number'], bank=bank)
+    user = await current_user(message.from_user.id)
+    await db.update_user(user['id'], card_number=data['card_number'], bank=bank)
     pending = data.get('pending_action')
     await state.clear()
     if pending == 'add_spot':
@@ -813,7 +867,7 @@ async def card_bank_manual(message: Message, state: FSMContext):
             reply_markup=get_cancel_menu_keyboard(), parse_mode="HTML")
         await state.set_state(AddSpotStates.waiting_spot_number)
     else:
-        await message.answer(f"✅ Карта: {bank}", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+        await message.answer(f"✅ Карта: {bank}", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 @router.message(CardInfoStates.waiting_card)
 async def card_number(message: Message, state: FSMContext):
@@ -948,7 +1002,7 @@ async def spot_confirm(callback: CallbackQuery, state: FSMContext):
     if callback.data == "spot_confirm_no":
         await state.clear()
         await callback.message.edit_text("❌ Отменено.")
-        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
         return
 
     # YES
@@ -989,21 +1043,21 @@ async def spot_confirm(callback: CallbackQuery, state: FSMContext):
         )
         if not ok:
             await callback.message.edit_text(msg)
-            await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+            await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
             await state.clear()
             return
 
         # Save spot (remember place)
-        spot_id = db.get_or_create_spot(data['supplier_id'], data['spot_number'], address=FIXED_ADDRESS)
+        spot_id = await db.get_or_create_spot(data['supplier_id'], data['spot_number'], address=FIXED_ADDRESS)
 
         # Overlap check
-        if db.check_slot_overlap(spot_id, sdt, edt):
+        if await db.check_slot_overlap(spot_id, sdt, edt):
             await callback.message.edit_text("❌ Слот пересекается с существующим!")
-            await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+            await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
             await state.clear()
             return
 
-        db.create_spot_availability(spot_id, sdt, edt)
+        await db.create_spot_availability(spot_id, sdt, edt)
 
         await state.clear()
         await callback.message.edit_text(
@@ -1011,15 +1065,12 @@ async def spot_confirm(callback: CallbackQuery, state: FSMContext):
             f"📅 {format_datetime(sdt)} — {format_datetime(edt)}",
             parse_mode="HTML"
         )
-        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
         # Notify subscribers (optional)
-        for n in db.get_matching_notifications(spot_id, sdt, edt):
-            try:
-                await callback.bot.send_message(n['telegram_id'], f"🔔 Место {data['spot_number']} освободилось!")
-                db.deactivate_notification(n['id'])
-            except Exception:
-                pass
+        for n in await db.get_matching_notifications(spot_id, sdt, edt):
+            outbox.send(n['telegram_id'], f"🔔 Место {data['spot_number']} освободилось!",
+                        on_sent=partial(db.deactivate_notification, n['id']))
 
     except Exception as e:
         try:
@@ -1030,9 +1081,9 @@ async def spot_confirm(callback: CallbackQuery, state: FSMContext):
         return
 @router.message(F.text == "🏠 Мои слоты")
 async def my_spots(message: Message, state: FSMContext):
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user: await message.answer("❌ /start"); return
-    spots = db.get_user_spots(user['id'])
+    spots = await db.get_user_spots(user['id'])
     if not spots:
         await message.answer("😔 У вас нет мест.\nДобавьте через «➕ Добавить место»"); return
     await message.answer("🏠 <b>Ваши места:</b>", reply_markup=get_my_spots_keyboard(spots), parse_mode="HTML")
@@ -1041,10 +1092,10 @@ async def my_spots(message: Message, state: FSMContext):
 async def spot_detail(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     sid = int(callback.data.replace("myspot_",""))
-    spot = db.get_spot_by_id(sid)
+    spot = await db.get_spot_by_id(sid)
     if not spot: await callback.message.edit_text("❌ Не найдено."); return
     await state.update_data(current_spot_id=sid)
-    avails = db.get_spot_availabilities(sid)
+    avails = await db.get_spot_availabilities(sid)
     at = ""
     for a in avails:
         s = datetime.fromisoformat(a['start_time'])
@@ -1072,7 +1123,7 @@ async def spot_detail(callback: CallbackQuery, state: FSMContext):
 async def myslot_actions(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     aid = int(callback.data.replace("myslot_",""))
-    slot = db.get_slot_by_id(aid)
+    slot = await db.get_slot_by_id(aid)
     if not slot or slot['is_booked']:
         await callback.message.edit_text("❌ Слот занят или не найден."); return
     s = datetime.fromisoformat(slot['start_time'])
@@ -1087,17 +1138,17 @@ async def myslot_actions(callback: CallbackQuery, state: FSMContext):
 async def del_slot(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     aid = int(callback.data.replace("delslot_",""))
-    ok = db.delete_slot(aid)
+    ok = await db.delete_slot(aid)
     if ok: await callback.message.edit_text("✅ Слот удалён.")
     else: await callback.message.edit_text("❌ Не удалось удалить (возможно забронирован).")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 # Редактировать слот — выбор что менять
 @router.callback_query(F.data.startswith("editslot_"))
 async def edit_slot_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     aid = int(callback.data.replace("editslot_",""))
-    slot = db.get_slot_by_id(aid)
+    slot = await db.get_slot_by_id(aid)
     if not slot or slot['is_booked']:
         await callback.message.edit_text("❌ Слот занят."); return
     await state.update_data(edit_slot_id=aid, edit_slot_spot_id=slot['spot_id'],
@@ -1153,14 +1204,14 @@ async def es_st(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Начало должно быть раньше конца.", show_alert=True)
         return
     aid = data['edit_slot_id']; spot_id = data['edit_slot_spot_id']
-    if db.check_slot_overlap(spot_id, new_start, old_end, exclude_slot_id=aid):
+    if await db.check_slot_overlap(spot_id, new_start, old_end, exclude_slot_id=aid):
         await callback.message.edit_text("❌ Пересечение с другим слотом!")
         await state.clear()
         return
-    db.update_slot_times(aid, new_start, old_end)
+    await db.update_slot_times(aid, new_start, old_end)
     await state.clear()
     await callback.message.edit_text(f"✅ Слот обновлён!\n📅 {format_datetime(new_start)} — {format_datetime(old_end)}")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.message(EditSlotStates.waiting_start_date)
 async def es_start_date(message: Message, state: FSMContext):
@@ -1208,14 +1259,14 @@ async def es_et(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Конец должен быть позже начала.", show_alert=True)
         return
     aid = data['edit_slot_id']; spot_id = data['edit_slot_spot_id']
-    if db.check_slot_overlap(spot_id, old_start, new_end, exclude_slot_id=aid):
+    if await db.check_slot_overlap(spot_id, old_start, new_end, exclude_slot_id=aid):
         await callback.message.edit_text("❌ Пересечение с другим слотом!")
         await state.clear()
         return
-    db.update_slot_times(aid, old_start, new_end)
+    await db.update_slot_times(aid, old_start, new_end)
     await state.clear()
     await callback.message.edit_text(f"✅ Слот обновлён!\n📅 {format_datetime(old_start)} — {format_datetime(new_end)}")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.message(EditSlotStates.waiting_end_date)
 async def es_end_date(message: Message, state: FSMContext):
@@ -1232,9 +1283,9 @@ async def back_spot_detail(callback: CallbackQuery, state: FSMContext):
     sid = data.get('current_spot_id') or data.get('edit_slot_spot_id')
     if not sid:
         await callback.message.edit_text("🔙"); return
-    spot = db.get_spot_by_id(sid)
+    spot = await db.get_spot_by_id(sid)
     if not spot: return
-    avails = db.get_spot_availabilities(sid)
+    avails = await db.get_spot_availabilities(sid)
     buttons = []
     for a in avails:
         if not a['is_booked']:
@@ -1258,8 +1309,8 @@ async def back_spot_detail(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "back_spots")
 async def back_spots(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
-    spots = db.get_user_spots(user['id'])
+    user = await current_user(callback.from_user.id)
+    spots = await db.get_user_spots(user['id'])
     if not spots: await callback.message.edit_text("😔 Нет мест.")
     else: await callback.message.edit_text("🏠 <b>Ваши места:</b>",
         reply_markup=get_my_spots_keyboard(spots), parse_mode="HTML")
@@ -1349,14 +1400,14 @@ async def aslot_et(callback: CallbackQuery, state: FSMContext):
     edt = parse_datetime(data['aslot_end_date'], tv)
     if not edt or edt <= sdt: return
     sid = data['addslot_spot_id']
-    if db.check_slot_overlap(sid, sdt, edt):
+    if await db.check_slot_overlap(sid, sdt, edt):
         await callback.message.edit_text("❌ Пересечение с существующим слотом!")
-        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+        await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
         await state.clear(); return
-    db.create_spot_availability(sid, sdt, edt)
+    await db.create_spot_availability(sid, sdt, edt)
     await state.clear()
     await callback.message.edit_text(f"✅ Слот добавлен!\n📅 {format_datetime(sdt)} — {format_datetime(edt)}")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.message(AddSlotStates.waiting_end_time_manual)
 async def aslot_et_m(message: Message, state: FSMContext):
@@ -1368,30 +1419,30 @@ async def aslot_et_m(message: Message, state: FSMContext):
     edt = parse_datetime(data['aslot_end_date'], r)
     if not edt or edt <= sdt: await message.answer("❌"); return
     sid = data['addslot_spot_id']
-    if db.check_slot_overlap(sid, sdt, edt):
+    if await db.check_slot_overlap(sid, sdt, edt):
         await message.answer("❌ Пересечение с существующим слотом!")
         await state.clear(); return
-    db.create_spot_availability(sid, sdt, edt)
+    await db.create_spot_availability(sid, sdt, edt)
     await state.clear()
     await message.answer(f"✅ Слот!\n📅 {format_datetime(sdt)} — {format_datetime(edt)}",
-        reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+        reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 # Удалить место
 @router.callback_query(F.data.startswith("delspot_"))
 async def delspot(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     sid = int(callback.data.replace("delspot_",""))
-    db.delete_spot(sid)
+    await db.delete_spot(sid)
     await callback.message.edit_text("✅ Место удалено.")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 
 # ==================== MY BOOKINGS ====================
 @router.message(F.text == "📋 Мои бронирования")
 async def my_bookings(message: Message, state: FSMContext):
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user: await message.answer("❌ /start"); return
-    bookings = db.get_user_bookings(user['id'])
+    bookings = await db.get_user_bookings(user['id'])
     if not bookings: await message.answer("😔 Нет бронирований."); return
     buttons = []
     for b in bookings[:15]:
@@ -1417,7 +1468,7 @@ async def my_bookings(message: Message, state: FSMContext):
 async def booking_detail(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("mybk_",""))
-    b = db.get_booking_by_id(bid)
+    b = await db.get_booking_by_id(bid)
     if not b: await callback.message.edit_text("❌ Не найдена."); return
     s = datetime.fromisoformat(b['start_time'])
     e = datetime.fromisoformat(b['end_time'])
@@ -1445,8 +1496,8 @@ async def booking_detail(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "back_bookings")
 async def back_bk(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
-    bookings = db.get_user_bookings(user['id'])
+    user = await current_user(callback.from_user.id)
+    bookings = await db.get_user_bookings(user['id'])
     buttons = []
     for b in bookings[:15]:
         s = datetime.fromisoformat(b['start_time'])
@@ -1471,9 +1522,9 @@ async def back_bk(callback: CallbackQuery, state: FSMContext):
 async def cancel_bk(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("cancel_booking_",""))
-    db.cancel_booking(bid)
+    await db.cancel_booking(bid)
     await callback.message.edit_text(f"❌ Бронь #{bid} отменена.")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 
 # ==================== REVIEWS ====================
@@ -1481,7 +1532,7 @@ async def cancel_bk(callback: CallbackQuery, state: FSMContext):
 async def review_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("review_start_",""))
-    booking = db.get_booking_by_id(bid)
+    booking = await db.get_booking_by_id(bid)
     if not booking or booking.get('reviewed'):
         await callback.message.answer("❌ Отзыв уже оставлен."); return
     await state.update_data(review_booking_id=bid, review_spot_id=booking['spot_id'],
@@ -1503,27 +1554,27 @@ async def review_rate(callback: CallbackQuery, state: FSMContext):
 async def review_nocomment(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
-    db.create_review(data['review_booking_id'], user['id'], data['review_spot_id'],
+    user = await current_user(callback.from_user.id)
+    await db.create_review(data['review_booking_id'], user['id'], data['review_spot_id'],
                      data['review_supplier_id'], data['review_rating'])
     await state.clear()
     await callback.message.edit_text("✅ Отзыв!")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.message(ReviewStates.waiting_comment)
 async def review_comment(message: Message, state: FSMContext):
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(message.from_user.id)
-    db.create_review(data['review_booking_id'], user['id'], data['review_spot_id'],
+    user = await current_user(message.from_user.id)
+    await db.create_review(data['review_booking_id'], user['id'], data['review_spot_id'],
                      data['review_supplier_id'], data['review_rating'], message.text[:500])
     await state.clear()
-    await message.answer("✅ Отзыв!", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+    await message.answer("✅ Отзыв!", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 
 # ==================== PROFILE ====================
 @router.message(F.text == "👤 Профиль")
 async def profile(message: Message, state: FSMContext):
-    user = db.get_user_by_telegram_id(message.from_user.id)
+    user = await current_user(message.from_user.id)
     if not user: await message.answer("❌ /start"); return
     card = f"\n💳 {user['bank']}: {mask_card(user['card_number'])}" if user.get('card_number') else ""
     car = ""
@@ -1543,9 +1594,9 @@ async def edit_name(callback: CallbackQuery, state: FSMContext):
 async def save_name(message: Message, state: FSMContext):
     ok, r = validate_name(message.text)
     if not ok: await message.answer(r); return
-    user = db.get_user_by_telegram_id(message.from_user.id)
-    db.update_user(user['id'], full_name=r); await state.clear()
-    await message.answer(f"✅ Имя: {r}", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+    user = await current_user(message.from_user.id)
+    await db.update_user(user['id'], full_name=r); await state.clear()
+    await message.answer(f"✅ Имя: {r}", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 @router.callback_query(F.data == "edit_phone")
 async def edit_phone(callback: CallbackQuery, state: FSMContext):
@@ -1563,9 +1614,9 @@ async def save_phone(message: Message, state: FSMContext):
     else:
         ok, r = validate_phone(message.text)
         if not ok: await message.answer(r); return
-    user = db.get_user_by_telegram_id(message.from_user.id)
-    db.update_user(user['id'], phone=r); await state.clear()
-    await message.answer(f"✅ Телефон: {r}", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+    user = await current_user(message.from_user.id)
+    await db.update_user(user['id'], phone=r); await state.clear()
+    await message.answer(f"✅ Телефон: {r}", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 @router.callback_query(F.data == "edit_car")
 async def edit_car(callback: CallbackQuery, state: FSMContext):
@@ -1587,21 +1638,21 @@ async def edit_bank(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("🏦 Введите название банка:")
         await state.set_state(EditProfileStates.waiting_bank_name); return
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
-    db.update_user(user['id'], card_number=data['card_number'], bank=bank)
+    user = await current_user(callback.from_user.id)
+    await db.update_user(user['id'], card_number=data['card_number'], bank=bank)
     await state.clear()
     await callback.message.edit_text(f"✅ Карта: {bank}")
-    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(_adm(callback.from_user.id)))
+    await callback.message.answer("Меню:", reply_markup=get_main_menu_keyboard(await _adm(callback.from_user.id)))
 
 @router.message(EditProfileStates.waiting_bank_name)
 async def edit_bank_manual(message: Message, state: FSMContext):
     bank = message.text.strip()
     if len(bank) < 2 or len(bank) > 30: await message.answer("❌ 2-30 символов"); return
     data = await state.get_data()
-    user = db.get_user_by_telegram_id(message.from_user.id)
-    db.update_user(user['id'], card_number=data['card_number'], bank=bank)
+    user = await current_user(message.from_user.id)
+    await db.update_user(user['id'], card_number=data['card_number'], bank=bank)
     await state.clear()
-    await message.answer(f"✅ Карта: {bank}", reply_markup=get_main_menu_keyboard(_adm(message.from_user.id)))
+    await message.answer(f"✅ Карта: {bank}", reply_markup=get_main_menu_keyboard(await _adm(message.from_user.id)))
 
 
 # ==================== NOTIFICATIONS ====================
@@ -1613,8 +1664,8 @@ async def notify_start(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == "notify_any")
 async def notify_any(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = db.get_user_by_telegram_id(callback.from_user.id)
-    db.create_spot_notification(user['id'])
+    user = await current_user(callback.from_user.id)
+    await db.create_spot_notification(user['id'])
     await callback.message.edit_text("✅ Уведомим!")
 
 @router.callback_query(F.data == "notify_date")
@@ -1628,11 +1679,11 @@ async def ndate(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     dv = callback.data.replace("ndate_","")
     if dv in ("manual","all"): return
-    user = db.get_user_by_telegram_id(callback.from_user.id)
+    user = await current_user(callback.from_user.id)
     ok, _ = validate_date(dv)
     if not ok: return
     date_obj = datetime.strptime(dv, "%d.%m.%Y")
-    db.create_spot_notification(user['id'], desired_date=date_obj.strftime("%Y-%m-%d"), notify_any=False)
+    await db.create_spot_notification(user['id'], desired_date=date_obj.strftime("%Y-%m-%d"), notify_any=False)
     await state.clear()
     await callback.message.edit_text(f"✅ Уведомим на {dv}!")
 
@@ -1649,7 +1700,7 @@ class EditBooking(StatesGroup):
 async def nearest_slots(message: Message, state: FSMContext):
     if await _check_ban(message): 
         return
-    slots = db.get_nearest_free_slots(limit=12, days=AVAILABILITY_LOOKAHEAD_DAYS)
+    slots = await db.get_nearest_free_slots(limit=12, days=AVAILABILITY_LOOKAHEAD_DAYS)
     if not slots:
         await message.answer("Сейчас нет доступных слотов.")
         return
@@ -1671,24 +1722,21 @@ async def booking_cancel_cb(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("booking_cancel_", ""))
 
-    b = db.get_booking_by_id(bid)
-    ok = db.cancel_booking(bid)
+    b = await db.get_booking_by_id(bid)
+    ok = await db.cancel_booking(bid)
     if ok:
         await callback.message.edit_text(f"❌ Бронь #{bid} отменена.")
 
         # Уведомление арендодателю, что бронь отменена и слот снова свободен
         if b and b.get('supplier_telegram_id'):
-            try:
-                await callback.bot.send_message(
-                    b['supplier_telegram_id'],
-                    f"❌ <b>Бронь #{bid} отменена</b>\n"
-                    f"🏠 Место: {b['spot_number']}\n"
-                    f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}\n"
-                    f"ℹ️ Интервал снова доступен для бронирования.",
-                    parse_mode="HTML"
-                )
-            except:
-                pass
+            outbox.send(
+                b['supplier_telegram_id'],
+                f"❌ <b>Бронь #{bid} отменена</b>\n"
+                f"🏠 Место: {b['spot_number']}\n"
+                f"📅 {format_datetime(b['start_time'])} — {format_datetime(b['end_time'])}\n"
+                f"ℹ️ Интервал снова доступен для бронирования.",
+                parse_mode="HTML"
+            )
     else:
         await callback.message.edit_text("❌ Не удалось отменить (возможно уже обработано).")
 
@@ -1696,7 +1744,7 @@ async def booking_cancel_cb(callback: CallbackQuery, state: FSMContext):
 async def booking_paid_cb(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     bid = int(callback.data.replace("booking_paid_", ""))
-    st = db.get_booking_status(bid)
+    st = await db.get_booking_status(bid)
     if not st:
         await callback.message.answer("❌ Бронь не найдена.")
         return
@@ -1740,8 +1788,8 @@ async def receipt_upload(message: Message, state: FSMContext):
         await message.answer("❌ Пришлите фото или файл чека (документ).")
         return
 
-    ok = db.mark_booking_paid(bid)
-    b = db.get_booking_full(bid)
+    ok = await db.mark_booking_paid(bid)
+    b = await db.get_booking_full(bid)
 
     # Отправляем админам
     caption = f"🧾 <b>Чек по брони #{bid}</b>\n"
@@ -1768,14 +1816,11 @@ async def receipt_upload(message: Message, state: FSMContext):
             if sup_card:
                 caption += f"\n💳 {sup_bank + ': ' if sup_bank else ''}<code>{sup_card}</code>"
     kb = admin_payment_review_keyboard(bid)
-    for adm in db.get_admins():
-        try:
-            if kind == "photo":
-                await message.bot.send_photo(adm["telegram_id"], file_id, caption=caption, reply_markup=kb, parse_mode="HTML")
-            else:
-                await message.bot.send_document(adm["telegram_id"], file_id, caption=caption, reply_markup=kb, parse_mode="HTML")
-        except Exception:
-            pass
+    for adm in await db.get_admins():
+        if kind == "photo":
+            outbox.enqueue('send_photo', adm["telegram_id"], photo=file_id, caption=caption, reply_markup=kb, parse_mode="HTML")
+        else:
+            outbox.enqueue('send_document', adm["telegram_id"], document=file_id, caption=caption, reply_markup=kb, parse_mode="HTML")
 
     await state.clear()
     if ok:
@@ -1799,12 +1844,7 @@ async def fallback_spot_confirm(callback: CallbackQuery, state: FSMContext):
 async def iron_spot_confirm_yes(callback: CallbackQuery):
     await callback.answer()  # stop Telegram spinner immediately
     cid = callback.data.split(":", 1)[1]
-    try:
-        from database import create_spot, add_availability, create_spot_confirm, get_slot_confirm, delete_slot_confirm  # noqa
-    except Exception:
-        from database import get_slot_confirm, delete_slot_confirm  # type: ignore
-
-    data = get_slot_confirm(cid)
+    data = await db.get_slot_confirm(cid)
     if not data:
         await callback.message.answer("⚠️ Кнопка устарела. Нажмите /start и попробуйте снова.")
         return
@@ -1823,9 +1863,9 @@ async def iron_spot_confirm_yes(callback: CallbackQuery):
     # Create spot + availability
     try:
         # create_spot may return spot_id; if spot already exists for user, fallback logic should be inside create_spot in your code.
-        spot_id = create_spot(data["user_id"], data["spot_number"])
-        add_availability(spot_id, data["start_time"], data["end_time"], data["price"])
-        delete_slot_confirm(cid)
+        spot_id = await db.create_spot(data["user_id"], data["spot_number"])
+        await db.add_availability(spot_id, data["start_time"], data["end_time"], data["price"])
+        await db.delete_slot_confirm(cid)
         await callback.message.answer("✅ Слот добавлен!")
     except Exception as e:
         await callback.message.answer(f"❌ Ошибка при создании слота: {e}")
@@ -1834,10 +1874,9 @@ async def iron_spot_confirm_yes(callback: CallbackQuery):
 async def iron_spot_confirm_no(callback: CallbackQuery):
     await callback.answer()
     cid = callback.data.split(":", 1)[1]
-    from database import delete_slot_confirm, get_slot_confirm
-    data = get_slot_confirm(cid)
+    data = await db.get_slot_confirm(cid)
     if data and callback.from_user.id == data["user_id"]:
-        delete_slot_confirm(cid)
+        await db.delete_slot_confirm(cid)
     await callback.message.answer("Ок, отменил. Начните заново: /start")
 
 ## NOTE:
@@ -2,9 +2,23 @@
 Утилиты и валидация ParkingBot
 """
 import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
+from config import PRICE_CACHE_SIZE
+
+try:
+    import numpy as _np   # необязательно: ускоряет calculate_prices на больших списках
+except ImportError:
+    _np = None
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+_NP_MIN_BATCH = 16
+
 PHONE_REGEX = r'^(\+7|7|8)?[\s\-]?\(?[489][0-9]{2}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}$'
 
 def validate_name(name: str):
@@ -156,108 +170,336 @@ def calculate_price(start, end):
         • ночной тариф можно брать от 1 часа, но ночная часть всегда минимум 600₽
     - Если бронь затрагивает и день, и ночь — стоимость = (день) + (ночь).
 
-    Минуты округляются вверх до часа (как и раньше).
+    Минуты округляются вверх до часа (как и раньше). Считает Tariff,
+    собранный из config один раз (get_tariff), повторные котировки — из кэша.
     """
     if isinstance(start, str):
         start = datetime.fromisoformat(start)
     if isinstance(end, str):
         end = datetime.fromisoformat(end)
-
     if end <= start:
         return 0
+    return _quote((start - _EPOCH) // _US, (end - _EPOCH) // _US, start.hour * 60 + start.minute)
+
+
+_US_MIN = 60_000_000
+_US_DAY = 1440 * _US_MIN
 
-    from config import (
-        PRICE_TOTAL_BY_HOURS, EXTRA_HOUR_PRICE_AFTER_24,
-        NIGHT_START, NIGHT_END, NIGHT_MIN_PRICE, NIGHT_TOTAL_BY_HOURS,
-    )
 
-    def _day_price(h: int) -> int:
-        h = int(max(0, h))
+class Tariff:
+    """Тарифная сетка из config, разобранная один раз.
+
+    Интервал режется границами день/ночь (NIGHT_END, NIGHT_START) каждого дня;
+    каждый кусок округляется вверх до часа отдельно, тип куска — по его началу.
+    Внутренние куски (от границы до следующей границы) всегда одинаковой
+    длины, поэтому их число считается арифметикой, а не циклом по дням:
+    цена любого интервала — O(1).
+    """
+
+    def __init__(self, day_table: dict, extra_after_24: int, night_start: str, night_end: str,
+                 night_min_price: int, night_table: dict):
+        self.day_table = {int(h): int(p) for h, p in day_table.items()}
+        self.day_24 = self.day_table[24]
+        self.extra_after_24 = int(extra_after_24)
+        self.night_min_price = int(night_min_price)
+        self.night_table = {int(h): int(p) for h, p in night_table.items()}
+        self.night_max = int(night_table.get(12, night_min_price))
+        hh, mm = map(int, night_start.split(":"))
+        self.night_start = hh * 60 + mm
+        hh, mm = map(int, night_end.split(":"))
+        self.night_end = hh * 60 + mm
+        # границы внутри суток (минуты от полуночи) и куски «граница → следующая граница»
+        self.bounds = sorted({self.night_end, self.night_start})
+        self.gaps = []      # [(часы, ночь?)] для куска, начинающегося на bounds[j]
+        for j, b in enumerate(self.bounds):
+            nxt = self.bounds[j + 1] if j + 1 < len(self.bounds) else self.bounds[0] + 1440
+            self.gaps.append((-(-(nxt - b) // 60), self._is_night(b)))
+        self._luts = None   # таблицы для prices_np (строятся при первом вызове)
+
+    @classmethod
+    def from_config(cls) -> "Tariff":
+        return cls(*cls.config_values())
+
+    @staticmethod
+    def config_values() -> tuple:
+        import config
+        return (dict(config.PRICE_TOTAL_BY_HOURS), config.EXTRA_HOUR_PRICE_AFTER_24,
+                config.NIGHT_START, config.NIGHT_END, config.NIGHT_MIN_PRICE,
+                dict(config.NIGHT_TOTAL_BY_HOURS))
+
+    def _is_night(self, minute_of_day: int) -> bool:
+        # ночь: [NIGHT_START..24:00) или [00:00..NIGHT_END)
+        return minute_of_day >= self.night_start or minute_of_day < self.night_end
+
+    def day_price(self, h: int) -> int:
         if h <= 0:
             return 0
-        if h in PRICE_TOTAL_BY_HOURS:
-            return int(PRICE_TOTAL_BY_HOURS[h])
-        days = h // 24
-        rem = h % 24
-        total = days * int(PRICE_TOTAL_BY_HOURS[24])
+        if h in self.day_table:
+            return self.day_table[h]
+        days, rem = divmod(h, 24)
+        total = days * self.day_24
         if rem:
-            if rem in PRICE_TOTAL_BY_HOURS:
-                total += int(PRICE_TOTAL_BY_HOURS[rem])
-            else:
-                total += rem * int(EXTRA_HOUR_PRICE_AFTER_24)
-        return int(total)
+            total += self.day_table[rem] if rem in self.day_table else rem * self.extra_after_24
+        return total
 
-    def _night_price(h: int) -> int:
+    def night_price(self, h: int) -> int:
         """Цена за h ночных часов (минимум NIGHT_MIN_PRICE)."""
-        h = int(max(0, h))
         if h <= 0:
             return 0
         # В ТЗ явно указаны 10/11/12, ниже 10 — минималка.
         if h <= 10:
-            return int(NIGHT_MIN_PRICE)
-        if h in NIGHT_TOTAL_BY_HOURS:
-            return int(NIGHT_TOTAL_BY_HOURS[h])
-        # 12+ считаем как максимум ночи
-        return int(NIGHT_TOTAL_BY_HOURS.get(12, NIGHT_MIN_PRICE))
-
-    # --- Разбиваем интервал по границам 08:00/20:00, чтобы корректно отделить день/ночь.
-    def _parse_hm(s: str):
-        hh, mm = map(int, s.split(":"))
-        return hh, mm
-
-    ns_h, ns_m = _parse_hm(NIGHT_START)
-    ne_h, ne_m = _parse_hm(NIGHT_END)
-
-    # Границы тарифов (день = [NIGHT_END, NIGHT_START), ночь = остальное)
-    # Для аккуратного разбиения собираем все точки переключения в (start, end)
-    boundaries = []
-    start_date = start.date()
-    end_date = end.date()
-    d = start_date
-    while d <= end_date:
-        b1 = datetime(d.year, d.month, d.day, ne_h, ne_m)  # 08:00
-        b2 = datetime(d.year, d.month, d.day, ns_h, ns_m)  # 20:00
-        if start < b1 < end:
-            boundaries.append(b1)
-        if start < b2 < end:
-            boundaries.append(b2)
-        d += timedelta(days=1)
-
-    boundaries.sort()
-    points = [start] + boundaries + [end]
-
-    day_hours = 0
-    night_segments_hours: list[int] = []
-
-    def _is_night(dt: datetime) -> bool:
-        t = dt.time()
-        # ночь: [20:00..24:00) или [00:00..08:00)
-        return (t.hour, t.minute) >= (ns_h, ns_m) or (t.hour, t.minute) < (ne_h, ne_m)
-
-    for a, b in zip(points, points[1:]):
-        if b <= a:
-            continue
-        h = _hours_ceil(a, b)
-        if h <= 0:
-            continue
-        if _is_night(a):
-            night_segments_hours.append(h)
+            return self.night_min_price
+        return self.night_table.get(h, self.night_max)
+
+    def price(self, start, end) -> int:
+        if isinstance(start, str):
+            start = datetime.fromisoformat(start)
+        if isinstance(end, str):
+            end = datetime.fromisoformat(end)
+        if end <= start:
+            return 0
+        return self.price_us((start - _EPOCH) // _US, (end - _EPOCH) // _US,
+                             start.hour * 60 + start.minute)
+
+    def price_us(self, s: int, e: int, start_minute: int) -> int:
+        """Цена интервала [s, e) в микросекундах от эпохи; start_minute — минута суток начала."""
+        # границы строго внутри (s, e): для каждой границы суток — сколько раз и первая/последняя
+        n = 0
+        first = last = None
+        for j, b in enumerate(self.bounds):
+            off = b * _US_MIN
+            lo = (s - off) // _US_DAY + 1
+            hi = -((off - e) // _US_DAY) - 1
+            if hi < lo:
+                continue
+            n += hi - lo + 1
+            t = lo * _US_DAY + off
+            if first is None or t < first[0]:
+                first = (t, j)
+            t = hi * _US_DAY + off
+            if last is None or t > last[0]:
+                last = (t, j)
+
+        day_hours = 0
+        nights = []         # [(часы, сколько раз)]
+        if n == 0:
+            pieces = ((_ceil_hours_us(e - s), self._is_night(start_minute)),)
         else:
-            day_hours += h
-
-    total_night_hours = sum(night_segments_hours)
-    mixed = day_hours > 0 and total_night_hours > 0
-
-    total = _day_price(day_hours)
-    # Ночь считаем по каждому сегменту (если бронь затрагивает два разных ночных окна в длинных бронях).
-    for h in night_segments_hours:
-        p = _night_price(h)
-        # В смешанной брони — минималка ночи действует всегда (даже если h=1)
-        if mixed:
-            p = max(int(NIGHT_MIN_PRICE), p)
-        total += p
-
-    return int(total)
+            pieces = ((_ceil_hours_us(first[0] - s), self._is_night(start_minute)),
+                      (_ceil_hours_us(e - last[0]), self.gaps[last[1]][1]))
+            m = len(self.bounds)
+            for r, (gh, night) in enumerate(self.gaps):
+                cnt = (n - 1 - (r - first[1]) % m + m - 1) // m
+                if cnt <= 0:
+                    continue
+                if night:
+                    nights.append((gh, cnt))
+                else:
+                    day_hours += gh * cnt
+        for h, night in pieces:
+            if h <= 0:      # кусок короче секунды округляется в 0 и не считается
+                continue
+            if night:
+                nights.append((h, 1))
+            else:
+                day_hours += h
+
+        mixed = day_hours > 0 and bool(nights)
+        total = self.day_price(day_hours)
+        # Ночь считаем по каждому сегменту (если бронь затрагивает два разных ночных окна в длинных бронях).
+        for h, cnt in nights:
+            p = self.night_price(h)
+            # В смешанной брони — минималка ночи действует всегда (даже если h=1)
+            if mixed:
+                p = max(self.night_min_price, p)
+            total += p * cnt
+        return total
+
+    def prices_np(self, s, e, start_minute):
+        """price_us для массивов numpy (int64): та же арифметика без цикла по интервалам."""
+        np = _np
+        if self._luts is None:
+            kd = max(self.day_table)
+            kn = max([12, *self.night_table]) + 1
+            lut_n = np.array([self.night_price(h) for h in range(kn + 1)], dtype=np.int64)
+            self._luts = (
+                kd,
+                np.array([self.day_price(h) for h in range(kd + 1)], dtype=np.int64),
+                np.array([self.day_price(r) if r in self.day_table else r * self.extra_after_24
+                          for r in range(24)], dtype=np.int64),
+                kn, lut_n, np.maximum(lut_n, self.night_min_price),
+            )
+        kd, lut_day, lut_rem, kn, lut_n, lut_n_mixed = self._luts
+        valid = e > s
+        n = np.zeros(len(s), dtype=np.int64)
+        first_t = np.full(len(s), np.iinfo(np.int64).max, dtype=np.int64)
+        last_t = np.full(len(s), np.iinfo(np.int64).min, dtype=np.int64)
+        first_j = np.zeros(len(s), dtype=np.int64)
+        last_j = np.zeros(len(s), dtype=np.int64)
+        for j, b in enumerate(self.bounds):
+            off = b * _US_MIN
+            lo = (s - off) // _US_DAY + 1
+            hi = -((off - e) // _US_DAY) - 1
+            has = hi >= lo
+            n += np.where(has, hi - lo + 1, 0)
+            t = lo * _US_DAY + off
+            upd = has & (t < first_t)
+            first_t = np.where(upd, t, first_t)
+            first_j = np.where(upd, j, first_j)
+            t = hi * _US_DAY + off
+            upd = has & (t > last_t)
+            last_t = np.where(upd, t, last_t)
+            last_j = np.where(upd, j, last_j)
+
+        def ceil_h(us):
+            return ((us / 1_000_000 + 3600 - 1) // 3600).astype(np.int64)
+
+        inner = n > 0
+        start_night = (start_minute >= self.night_start) | (start_minute < self.night_end)
+        gap_night = np.array([g[1] for g in self.gaps])
+        # куски: первый (или весь интервал) и последний (только если есть границы)
+        h1 = np.where(inner, ceil_h(np.where(inner, first_t, e) - s), ceil_h(e - s))
+        h2 = np.where(inner, ceil_h(e - np.where(inner, last_t, e)), 0)
+        n2 = gap_night[last_j] & inner
+        day_hours = np.where(~start_night, h1, 0) + np.where(~n2, h2, 0)
+        has_night = (start_night & (h1 > 0)) | (n2 & (h2 > 0))
+        m = len(self.bounds)
+        gap_cnt = []
+        for r, (gh, night) in enumerate(self.gaps):
+            cnt = np.where(inner, np.maximum((n - 1 - (r - first_j) % m + m - 1) // m, 0), 0)
+            gap_cnt.append(cnt)
+            if night:
+                has_night |= cnt > 0
+            else:
+                day_hours += gh * cnt
+
+        mixed = (day_hours > 0) & has_night
+        days, rem = np.divmod(day_hours, 24)
+        total = np.where(day_hours <= kd, lut_day[np.clip(day_hours, 0, kd)], days * self.day_24 + lut_rem[rem])
+
+        def night(h):
+            i = np.clip(h, 0, kn)
+            return np.where(mixed, lut_n_mixed[i], lut_n[i])
+
+        total += np.where(start_night & (h1 > 0), night(h1), 0)
+        total += np.where(n2 & (h2 > 0), night(h2), 0)
+        for (gh, is_night), cnt in zip(self.gaps, gap_cnt):
+            if is_night:
+                total += cnt * night(np.full(len(s), gh, dtype=np.int64))
+        return np.where(valid, total, 0)
+
+
+def _ceil_hours_us(us: int) -> int:
+    # как _hours_ceil: секунды float, (s + 3599) // 3600
+    return int((us / 1_000_000 + 3600 - 1) // 3600)
+
+
+_tariff: Tariff | None = None
+_tariff_values: tuple | None = None
+_tariff_checked = 0.0
+_TARIFF_CHECK_SECONDS = 1.0
+
+
+def get_tariff() -> Tariff:
+    """Тариф из config. Раз в секунду сверяется с config: если тарифы поменяли —
+    пересобирается, кэш котировок сбрасывается."""
+    global _tariff, _tariff_values, _tariff_checked
+    now = time.monotonic()
+    if _tariff is not None and now - _tariff_checked < _TARIFF_CHECK_SECONDS:
+        return _tariff
+    _tariff_checked = now
+    values = Tariff.config_values()
+    if _tariff is None or values != _tariff_values:
+        if _tariff is not None:
+            _quotes.stats['reloads'] += 1
+        _tariff, _tariff_values = Tariff(*values), values
+        _quotes.clear()
+    return _tariff
+
+
+class _QuoteCache:
+    """LRU котировок. Тариф повторяется каждые сутки, поэтому цена зависит только
+    от (время суток начала, длительность) — в мкс, без потери точности. На практике
+    ключей мало: минуты начала × длительности с шагом TIME_STEP_MINUTES."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._d: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+    def get(self, key):
+        with self._lock:
+            p = self._d.get(key)
+            if p is None:
+                self.stats['misses'] += 1
+                return None
+            self._d.move_to_end(key)
+            self.stats['hits'] += 1
+            return p
+
+    def put(self, key, price: int):
+        with self._lock:
+            self._d[key] = price
+            if len(self._d) > self.size:
+                self._d.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+
+    def info(self) -> dict:
+        with self._lock:
+            total = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, size=len(self._d), max_size=self.size,
+                        hit_rate=round(self.stats['hits'] / total * 100, 1) if total else 0.0)
+
+
+_quotes = _QuoteCache(PRICE_CACHE_SIZE)
+
+
+def _quote(s: int, e: int, start_minute: int) -> int:
+    t = get_tariff()
+    key = (s % _US_DAY, e - s)
+    p = _quotes.get(key)
+    if p is None:
+        p = t.price_us(s, e, start_minute)
+        if t is _tariff:    # тариф не сменился, пока считали
+            _quotes.put(key, p)
+    return p
+
+
+def get_price_cache_stats() -> dict:
+    """hits / misses / hit_rate (%), size, reloads (сколько раз тарифы менялись)."""
+    return _quotes.info()
+
+
+def reset_price_cache():
+    global _tariff
+    _tariff = None
+    _quotes.clear()
+
+
+def calculate_prices(intervals) -> list[int]:
+    """Цены для списка пар (start, end) разом — для кнопок со слотами и временем окончания.
+
+    С numpy — векторно (Tariff.prices_np), без него — по одной через Tariff.price_us.
+    Результат совпадает с calculate_price для каждой пары.
+    """
+    t = get_tariff()
+    s_us, e_us, s_min = [], [], []
+    for start, end in intervals:
+        if isinstance(start, str):
+            start = datetime.fromisoformat(start)
+        if isinstance(end, str):
+            end = datetime.fromisoformat(end)
+        s_us.append((start - _EPOCH) // _US)
+        e_us.append((end - _EPOCH) // _US)
+        s_min.append(start.hour * 60 + start.minute)
+    if _np is not None and len(s_us) >= _NP_MIN_BATCH:
+        return t.prices_np(_np.array(s_us, dtype=_np.int64), _np.array(e_us, dtype=_np.int64),
+                           _np.array(s_min, dtype=_np.int64)).tolist()
+    return [_quote(s, e, m) if e > s else 0 for s, e, m in zip(s_us, e_us, s_min)]
 
 def format_price_info():
     """Строка с тарифами для показа пользователю"""
@@ -280,6 +522,25 @@ def now_local():
     tz = ZoneInfo(TIMEZONE)
     return datetime.now(tz).replace(tzinfo=None, second=0, microsecond=0)
 
+def to_epoch_min(dt) -> int:
+    """datetime/строка БД → целые минуты от 1970-01-01 00:00 по локальным часам TIMEZONE.
+
+    Naive datetime считается уже локальным (так время и хранится в БД),
+    aware — сначала переводится в TIMEZONE.
+    """
+    if isinstance(dt, str):
+        dt = datetime.fromisoformat(dt)
+    if dt.tzinfo is not None:
+        from config import TIMEZONE
+        dt = dt.astimezone(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+    return int((dt - _EPOCH).total_seconds()) // 60
+
+
+def from_epoch_min(m: int) -> datetime:
+    """Обратное к to_epoch_min: naive локальный datetime."""
+    return _EPOCH + timedelta(minutes=int(m))
+
+
 def normalize_dt(dt: datetime) -> datetime:
     """Нормализует datetime: обнуляет секунды/микросекунды."""
     if isinstance(dt, str):
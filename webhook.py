@@ -0,0 +1,87 @@
+"""
+Режим вебхука ParkingBot
+
+Telegram присылает апдейты POST-запросами на WEBHOOK_URL + WEBHOOK_PATH;
+aiohttp-сервер слушает WEBAPP_HOST:WEBAPP_PORT (по умолчанию только
+localhost — снаружи его закрывает reverse proxy с TLS). Запросы без
+правильного X-Telegram-Bot-Api-Secret-Token отклоняются (401).
+
+Telegram получает ответ сразу, апдейт обрабатывается в фоне. Одновременно
+принято не больше WEBHOOK_MAX_IN_FLIGHT апдейтов; если лимит выбран, ответ
+на следующий запрос задерживается — Telegram сам притормаживает доставку
+(не больше WEBHOOK_MAX_CONNECTIONS соединений), очередь в памяти не растёт.
+Порядок внутри чата обеспечивает ChatSerialMiddleware (chat_executor.py):
+фоновые задачи создаются в порядке поступления запросов.
+"""
+import asyncio
+import logging
+import secrets
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT,
+                    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_MAX_IN_FLIGHT)
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Фоновая обработка с лимитом апдейтов в работе."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None,
+                 max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self.stats = {'received': 0, 'processed': 0, 'errors': 0, 'in_flight': 0}
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        self.stats['received'] += 1
+        self.stats['in_flight'] += 1
+        task = asyncio.create_task(self._process(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _process(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot, update)
+            self.stats['processed'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.exception(f"webhook update {update.get('update_id')}: {e}")
+        finally:
+            self.stats['in_flight'] -= 1
+            self._slots.release()
+
+
+def build_app(dp: Dispatcher, bot: Bot, secret_token: Optional[str] = None,
+              path: str = WEBHOOK_PATH, **kwargs: Any) -> web.Application:
+    """aiohttp-приложение с обработчиком вебхука; startup/shutdown диспетчера — хуки приложения."""
+    app = web.Application()
+    BoundedRequestHandler(dp, bot, secret_token=secret_token, **kwargs).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Регистрирует вебхук в Telegram и обслуживает его до остановки процесса."""
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = build_app(dp, bot, secret_token=secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+    url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+    await bot.set_webhook(url, secret_token=secret, drop_pending_updates=True,
+                          max_connections=WEBHOOK_MAX_CONNECTIONS,
+                          allowed_updates=dp.resolve_used_update_types())
+    logger.info(f"Webhook {url} → http://{WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()